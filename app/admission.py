@@ -0,0 +1,143 @@
+import asyncio
+import heapq
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from itertools import count
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+
+# max concurrent operations of every stage of /ask, 0 means no limit
+ADMISSION_EMBED_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_EMBED_MAX_IN_FLIGHT') or 32)
+# searches of concurrent requests share database calls (see SEARCH_BATCH_MAX_WAIT_MS), so the limit is above IO_POOL_SIZE
+ADMISSION_SEARCH_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_SEARCH_MAX_IN_FLIGHT') or 32)
+ADMISSION_GENERATE_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_GENERATE_MAX_IN_FLIGHT') or 16)
+# operations waiting for a stage; when the queue is full, requests are rejected with 429
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE') or 64)
+# max wait for a stage; a request that would wait longer is rejected with 503
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT') or 5)
+
+ADMISSION_IN_FLIGHT = Gauge('app_admission_in_flight', 'Operations running in a stage of /ask', ['stage'])
+ADMISSION_QUEUE_DEPTH = Gauge('app_admission_queue_depth', 'Operations waiting for a stage of /ask', ['stage'])
+ADMISSION_WAIT = Histogram(
+    'app_admission_wait_seconds',
+    'Time an admitted operation waited for a stage of /ask',
+    ['stage'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+ADMISSION_REJECTED = Counter(
+    'app_admission_rejected_total', 'Operations of /ask rejected by admission control', ['stage', 'reason']
+)
+
+
+# Bounds the concurrency of one stage. Waiting operations are admitted smallest batch first (FIFO within a size);
+# an operation is rejected right away when the queue is full or its estimated wait exceeds `max_wait`,
+# and when it is still waiting after `max_wait`.
+class StageLimiter:
+    def __init__(self, stage: str, max_in_flight: int, max_queue: int, max_wait: float):
+        self.stage = stage
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = count()
+        # moving average of the time a slot is held, for the estimated wait
+        self._hold_time = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(not future.done() for _, _, future in self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, batch_size: int = 1) -> AsyncIterator[None]:
+        if self.max_in_flight <= 0:
+            yield
+            return
+        await self.acquire(batch_size)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._hold_time = 0.8 * self._hold_time + 0.2 * (time.perf_counter() - started)
+            self.release()
+
+    async def acquire(self, batch_size: int = 1) -> None:
+        started = time.perf_counter()
+        if self.in_flight < self.max_in_flight and not self.queue_depth:
+            self.in_flight += 1
+            self._update_gauges()
+            ADMISSION_WAIT.labels(self.stage).observe(0)
+            return
+
+        ahead = sum(not future.done() and size <= batch_size for size, _, future in self._waiters)
+        estimate = (ahead // self.max_in_flight + 1) * self._hold_time
+        if self.queue_depth >= self.max_queue:
+            self._reject('queue_full', 429, estimate)
+        if estimate > self.max_wait:
+            self._reject('deadline', 503, estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (batch_size, next(self._order), future))
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if future.cancelled() or not future.done():
+                self._update_gauges()
+                self._reject('timeout', 503, self._hold_time)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over right before the cancellation
+                self.release()
+            self._update_gauges()
+            raise
+        ADMISSION_WAIT.labels(self.stage).observe(time.perf_counter() - started)
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # the slot goes to the next operation, in_flight stays the same
+                future.set_result(None)
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def _reject(self, reason: str, status_code: int, retry_after: float) -> None:
+        ADMISSION_REJECTED.labels(self.stage, reason).inc()
+        raise HTTPException(
+            status_code=status_code,
+            detail=f'Too many requests in the {self.stage} stage',
+            headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+        )
+
+    def _update_gauges(self) -> None:
+        ADMISSION_IN_FLIGHT.labels(self.stage).set(self.in_flight)
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(self.queue_depth)
+
+
+@dataclass
+class Admission:
+    embed: StageLimiter
+    search: StageLimiter
+    generate: StageLimiter
+
+    def slot(self, stage: str, batch_size: int):
+        return getattr(self, stage).slot(batch_size)
+
+
+def create_admission() -> Admission:
+    return Admission(**{
+        stage: StageLimiter(stage, max_in_flight, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+        for stage, max_in_flight in (
+            ('embed', ADMISSION_EMBED_MAX_IN_FLIGHT),
+            ('search', ADMISSION_SEARCH_MAX_IN_FLIGHT),
+            ('generate', ADMISSION_GENERATE_MAX_IN_FLIGHT),
+        )
+    })
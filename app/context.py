@@ -1,20 +1,61 @@
 import asyncio
+import contextvars
 import logging
+import time
 from concurrent.futures import Executor
-from dataclasses import dataclass
-from typing import TypeVar, Callable, Any
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import TypeVar, Callable, Any, AsyncContextManager
 
-from app.db import Database
+import httpx
+
+from app.admission import Admission
+from app.db import SearchBackend
+from app.hybrid import LexicalSearch
+from app.search_batching import SearchCoalescer
+from app.semantic_cache import SemanticCache
+from app.tracing import IO_QUEUE_WAIT, Trace
+from common.article_store import ArticleStore
+from common.embedding_cache import EmbeddingCache
 
 T = TypeVar('T')
 
 
 @dataclass
 class Context:
-    db: Database
+    db: SearchBackend
     io_pool: Executor
+    http_client: httpx.AsyncClient
     logger: logging.Logger
+    embedding_cache: EmbeddingCache | None = None
+    answer_cache: SemanticCache | None = None
+    articles: ArticleStore | None = None
+    trace: Trace = field(default_factory=Trace)
+    admission: Admission | None = None
+    # shares database searches between concurrent requests, disabled when None
+    search_coalescer: SearchCoalescer | None = None
+    # BM25 search fused with the vector search, disabled when None
+    lexical: LexicalSearch | None = None
+
+    def admit(self, stage: str, batch_size: int = 1) -> AsyncContextManager:
+        # a slot of the stage of /ask, without a limit when admission control is off
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.slot(stage, batch_size)
 
     async def run_io(self, task: Callable[..., T], *args: Any) -> T:
+        submitted = time.perf_counter()
+        started = []
+
+        def run() -> T:
+            started.append(time.perf_counter())
+            return task(*args)
+
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.io_pool, task, *args)
+        try:
+            # the task sees the trace id of the request in its logs
+            return await loop.run_in_executor(self.io_pool, contextvars.copy_context().run, run)
+        finally:
+            if started:
+                IO_QUEUE_WAIT.observe(started[0] - submitted)
+                self.trace.record('io_queue_wait', started[0] - submitted)
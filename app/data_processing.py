@@ -1,43 +1,205 @@
+import asyncio
 import os
+import time
 from collections import defaultdict
-from typing import AsyncIterator
+from typing import AsyncIterator, Sequence
 
 import httpx
+import numpy as np
 from fastapi import HTTPException
+from prometheus_client import Counter, Histogram
 
 from app.context import Context
-from app.models import Question, DBSearchResponse, Topic
+from app.hybrid import LEXICAL_SEARCH_TIMEOUT, LEXICAL_SEARCH_TIMEOUTS, fuse
+from app.models import EventMode, Question, DBSearchResponse, Topic
+from app.sse import ERROR_EVENT, Event, QuestionEventFormatter, aiter_events, format_event
+from app.tracing import ASK_BATCH_SIZE
+from common.embedding_cache import aencode_with_cache
+from common.embedding_format import ACCEPT_EMBEDDINGS, load_embeddings
+from common.passages import count_tokens, truncate_tokens
 
 LLM_HOST = os.getenv('LLM_HOST') or 'localhost'
 LLM_PORT = os.getenv('LLM_PORT') or '8080'
-EMBEDDINGS_URL = f'http://{LLM_HOST}:{LLM_PORT}/encode'
-LLM_URL = f'http://{LLM_HOST}:{LLM_PORT}/llm_ask'
+LLM_BASE_URL = f'http://{LLM_HOST}:{LLM_PORT}'
+EMBEDDINGS_URL = '/encode'
+LLM_URL = '/llm_ask'
+RERANK_URL = '/rerank'
 
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS') or 100)
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS') or 20)
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY') or 30)
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT') or 2)
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT') or 10)
+LLM_POOL_TIMEOUT = float(os.getenv('LLM_POOL_TIMEOUT') or 5)
+# max pause between two chunks of the /llm_ask stream
+LLM_STREAM_TIMEOUT = float(os.getenv('LLM_STREAM_TIMEOUT') or 30)
+LLM_HTTP2 = (os.getenv('LLM_HTTP2') or '').lower() in ('1', 'true', 'yes')
 
-async def get_articles(queries: list[Question], embeddings: list[list], context: Context) -> list[DBSearchResponse]:
-    topic_to_questions: dict[Topic, list] = defaultdict(list)
-    for index, (query, emb) in enumerate(zip(queries, embeddings)):
-        topic_to_questions[query.topic].append((index, emb))
+# words of passages in the prompt of one question, 0 means no limit
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET') or 1024)
+PROMPT_MAX_PASSAGES_PER_ARTICLE = int(os.getenv('PROMPT_MAX_PASSAGES_PER_ARTICLE') or 2)
+# `structured` sends the questions and their passages to /llm_ask as lists,
+# `text` sends prompts in the free-text format (for an app_llm without the structured format)
+LLM_PROMPT_FORMAT = os.getenv('LLM_PROMPT_FORMAT') or 'structured'
+# the SEARCH_LIMIT hits of a question are scored by the cross-encoder of app_llm (see RERANK_MODEL there) and
+# the best RERANK_TOP_N go into the prompt; 0 disables re-ranking
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N') or 0)
+RERANK_TIMEOUT = float(os.getenv('RERANK_TIMEOUT_MS') or 1000) / 1000
 
-    result: list = [None] * len(queries)
-    for topic, items in topic_to_questions.items():
-        indexes, embeds = list(zip(*items))
-        # context.db.search(topic=topic.value, embeddings=list(embeds))
-        db_response = await context.run_io(context.db.search, topic.value, list(embeds))
-        for index, resp in zip(indexes, db_response):
-            result[index] = resp
-    return result
+ASK_DISCONNECTS = Counter('app_ask_disconnects_total', '/ask streams cancelled because the client disconnected')
+RERANK_FAILURES = Counter('app_rerank_failures_total', 'Re-rankings that failed, the hits kept their search order')
+FIRST_EVENT_LATENCY = Histogram(
+    'app_ask_first_event_seconds',
+    'Time from the start of /ask processing to the first SSE event of the answer',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
 
 
-async def get_embeddings(queries: list[str]) -> list[list[float]]:
-    async with httpx.AsyncClient() as client:
-        r = await client.post(EMBEDDINGS_URL, json={'items': queries}, timeout=10)
-        if r.status_code != 200:
-            raise HTTPException(status_code=500, detail='Unsuccessful embedding')
-        return r.json()
+def create_llm_client() -> httpx.AsyncClient:
+    # http2 requires the `h2` package (pip install httpx[http2])
+    return httpx.AsyncClient(
+        base_url=LLM_BASE_URL,
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=LLM_CONNECT_TIMEOUT,
+            read=LLM_READ_TIMEOUT,
+            write=LLM_READ_TIMEOUT,
+            pool=LLM_POOL_TIMEOUT,
+        ),
+    )
 
 
-def build_prompts(queries: list[str], articles: list[DBSearchResponse]) -> list[str]:
+def group_by_topic(queries: list[Question]) -> dict[Topic, list[int]]:
+    topic_to_indexes: dict[Topic, list[int]] = defaultdict(list)
+    for index, query in enumerate(queries):
+        topic_to_indexes[query.topic].append(index)
+    return topic_to_indexes
+
+
+async def search_vectors(topic: Topic, embeddings: list[list], context: Context) -> list[DBSearchResponse]:
+    if context.search_coalescer is not None:
+        return await context.search_coalescer.search(topic, embeddings)
+    return await context.run_io(context.db.search, topic, embeddings)
+
+
+async def search_lexical(topic: Topic, queries: list[str], context: Context) -> list[DBSearchResponse] | None:
+    with context.trace.stage('lexical_search'):
+        try:
+            return await asyncio.wait_for(context.lexical.asearch(topic, queries), timeout=LEXICAL_SEARCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            LEXICAL_SEARCH_TIMEOUTS.inc()
+            return None
+
+
+async def search_topic(
+        topic: Topic, queries: list[str], embeddings: list[list], context: Context
+) -> list[DBSearchResponse]:
+    ASK_BATCH_SIZE.labels('topic').observe(len(embeddings))
+    async with context.admit('search', len(embeddings)):
+        with context.trace.stage('search'):
+            if context.lexical is None:
+                return await search_vectors(topic, embeddings, context)
+            vector, lexical = await asyncio.gather(
+                search_vectors(topic, embeddings, context), search_lexical(topic, queries, context)
+            )
+            if lexical is None:
+                return vector
+            return [fuse([v, l]) for v, l in zip(vector, lexical)]
+
+
+async def encode(queries: list[str], context: Context) -> np.ndarray:
+    r = await context.http_client.post(
+        EMBEDDINGS_URL, json={'items': queries}, headers={'accept': ACCEPT_EMBEDDINGS, **context.trace.headers}
+    )
+    if r.status_code != 200:
+        raise HTTPException(status_code=500, detail='Unsuccessful embedding')
+    return load_embeddings(r.headers.get('content-type'), r.content)
+
+
+async def get_embeddings(queries: list[str], context: Context) -> Sequence[np.ndarray]:
+    if context.embedding_cache is None:
+        return await encode(queries, context)
+    return await aencode_with_cache(context.embedding_cache, queries, lambda misses: encode(misses, context))
+
+
+def load_texts(articles: list[DBSearchResponse], context: Context) -> None:
+    # texts of the hits that go into the prompts, when the search returned only ids
+    if context.articles is None:
+        return
+    for response in articles:
+        for item in response.items:
+            if item.entity.text is None:
+                item.entity.text = context.articles.get(item.id) or ''
+
+
+def top_hits(response: DBSearchResponse, n: int) -> DBSearchResponse:
+    return DBSearchResponse(items=sorted(response.items, key=lambda i: i.distance, reverse=True)[:n])
+
+
+async def rerank(
+        queries: list[str], articles: list[DBSearchResponse], context: Context, top_n: int = RERANK_TOP_N
+) -> list[DBSearchResponse]:
+    passages = [[item.entity.text or '' for item in response.items] for response in articles]
+    try:
+        r = await context.http_client.post(
+            RERANK_URL,
+            json={'items': queries, 'passages': passages},
+            headers=context.trace.headers,
+            timeout=RERANK_TIMEOUT,
+        )
+        r.raise_for_status()
+        scores = r.json()['scores']
+    except (httpx.HTTPError, ValueError) as e:
+        RERANK_FAILURES.inc()
+        context.logger.warning('Re-ranking failed, the hits keep their search order: %r', e)
+        return [top_hits(response, top_n) for response in articles]
+    # the score of the cross-encoder replaces the distance, the passages are selected by it
+    return [
+        top_hits(DBSearchResponse(items=[
+            item.model_copy(update={'distance': score}) for item, score in zip(response.items, q_scores)
+        ]), top_n)
+        for response, q_scores in zip(articles, scores)
+    ]
+
+
+def select_passages(
+        response: DBSearchResponse,
+        budget: int = PROMPT_TOKEN_BUDGET,
+        per_article: int = PROMPT_MAX_PASSAGES_PER_ARTICLE,
+) -> list[str]:
+    # the best hits first: duplicates and passages over the per-article limit are skipped,
+    # the rest is packed while it fits into the budget
+    passages = []
+    seen = set()
+    per_article_count: dict[int, int] = defaultdict(int)
+    left = budget
+    for item in sorted(response.items, key=lambda i: i.distance, reverse=True):
+        text = item.entity.text or ''
+        parent = item.entity.article_id if item.entity.article_id is not None else item.id
+        if not text or text in seen or per_article_count[parent] >= per_article:
+            continue
+        if budget:
+            tokens = count_tokens(text)
+            if tokens > left:
+                if passages:
+                    continue
+                # the best passage alone is bigger than the budget
+                text, tokens = truncate_tokens(text, left), left
+            left -= tokens
+        seen.add(text)
+        per_article_count[parent] += 1
+        passages.append(text)
+    return passages
+
+
+def build_prompts(
+        queries: list[str], articles: list[DBSearchResponse], budget: int = PROMPT_TOKEN_BUDGET
+) -> list[str]:
     system_prompt = """
         You are a QA system.
         Answer the user's query strictly based on the provided articles, without any introductions or additional comments.
@@ -52,30 +214,203 @@ def build_prompts(queries: list[str], articles: list[DBSearchResponse]) -> list[
     user_prompts = []
     for query, q_articles in zip(queries, articles):
         rows = [system_prompt, 'Input:', f'<input>{query}</input>']  # suppose our model doesn't support a system prompt
-        rows.extend([f'<article>{a.entity.text}</article>' for a in q_articles.items])
+        rows.extend([f'<article>{passage}</article>' for passage in select_passages(q_articles, budget)])
         user_prompts.append('\n'.join(rows))
     return user_prompts
 
 
-async def get_llm_answer(prompts: list[str]) -> AsyncIterator[str]:
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
-            'POST',
-            LLM_URL,
-            json={'items': prompts},
-            headers={"accept": "text/event-stream", "Content-Type": "application/json"},
-            timeout=10,
-        ) as response:
-            response: httpx.Response
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail='Streaming error')
-            async for text in response.aiter_text():
+def build_llm_request(
+        queries: list[str], articles: list[DBSearchResponse], budget: int = PROMPT_TOKEN_BUDGET
+) -> dict:
+    if LLM_PROMPT_FORMAT == 'text':
+        return {'items': build_prompts(queries, articles, budget)}
+    return {'items': queries, 'articles': [select_passages(q_articles, budget) for q_articles in articles]}
+
+
+async def get_llm_answer(request: dict, context: Context) -> AsyncIterator[Event]:
+    async with context.http_client.stream(
+        'POST',
+        LLM_URL,
+        json=request,
+        headers={"accept": "text/event-stream", "Content-Type": "application/json", **context.trace.headers},
+        timeout=httpx.Timeout(
+            connect=LLM_CONNECT_TIMEOUT,
+            read=LLM_STREAM_TIMEOUT,
+            write=LLM_READ_TIMEOUT,
+            pool=LLM_POOL_TIMEOUT,
+        ),
+    ) as response:
+        response: httpx.Response
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail='Streaming error')
+        # time to the first event of the LLM, then the time of the rest of its stream
+        started = time.perf_counter()
+        stage = 'llm_first_event'
+        async for event in aiter_events(response.aiter_text()):
+            if stage == 'llm_first_event':
+                context.trace.observe(stage, time.perf_counter() - started)
+                started, stage = time.perf_counter(), 'llm_stream'
+            yield event
+        context.trace.observe(stage, time.perf_counter() - started)
+
+
+async def answer_topic(
+        topic: Topic, queries: list[str], embeddings: list[list], context: Context
+) -> AsyncIterator[list]:
+    articles = await search_topic(topic, queries, embeddings, context)
+    with context.trace.stage('load_texts'):
+        load_texts(articles, context)
+    if RERANK_TOP_N:
+        with context.trace.stage('rerank'):
+            articles = await rerank(queries, articles, context)
+    with context.trace.stage('build_prompts'):
+        request = build_llm_request(queries=queries, articles=articles)
+    # the slot is held until the answer is streamed
+    async with context.admit('generate', len(queries)):
+        async for event in get_llm_answer(request=request, context=context):
+            yield event.data
+
+
+async def _run_group(group: int, answer: AsyncIterator[list], steps: asyncio.Queue) -> None:
+    try:
+        async for data in answer:
+            await steps.put((group, data))
+    except Exception as e:
+        await steps.put((group, e))
+    finally:
+        await answer.aclose()
+    await steps.put((group, None))
+
+
+async def merge_answers(groups: list[tuple[list[int], AsyncIterator[list]]], size: int) -> AsyncIterator[str]:
+    # every group is answered independently; the events are re-assembled in the order of the questions,
+    # a finished group contributes [] like a finished prompt in a single LLM request
+    if not groups:
+        yield format_event(0, [])
+        return
+
+    queues = [asyncio.Queue(maxsize=1) for _ in groups]
+    tasks = [
+        asyncio.create_task(_run_group(group, answer, steps))
+        for group, ((_, answer), steps) in enumerate(zip(groups, queues))
+    ]
+    active = list(range(len(groups)))
+    try:
+        event_id = 0
+        while True:
+            data: list = [[] for _ in range(size)]
+            for group in list(active):
+                _, step = await queues[group].get()
+                if step is None:
+                    active.remove(group)
+                    continue
+                if isinstance(step, Exception):
+                    raise step
+                for index, chunk in zip(groups[group][0], step):
+                    data[index] = chunk
+            if not active:
+                break
+            yield format_event(event_id, data)
+            event_id += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_questions(groups: list[tuple[list[int], AsyncIterator[list]]], size: int) -> AsyncIterator[str]:
+    # per-question mode: steps of every group are framed as soon as they arrive, without waiting for other groups
+    steps = asyncio.Queue(maxsize=max(len(groups), 1))
+    tasks = [asyncio.create_task(_run_group(group, answer, steps)) for group, (_, answer) in enumerate(groups)]
+    formatter = QuestionEventFormatter(size)
+    active = len(groups)
+    try:
+        while active:
+            group, step = await steps.get()
+            if isinstance(step, Exception):
+                raise step
+            indexes = groups[group][0]
+            if step is None:
+                active -= 1
+                events = formatter.finish(indexes)
+            else:
+                events = formatter.format(indexes, step)
+            for text in events:
                 yield text
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def stream_error(e: Exception, context: Context) -> dict:
+    if isinstance(e, HTTPException):
+        context.logger.warning('/ask: stream failed with %s: %s', e.status_code, e.detail)
+        error = {'status': e.status_code, 'detail': e.detail}
+        if e.headers and 'Retry-After' in e.headers:
+            error['retry_after'] = int(e.headers['Retry-After'])
+        return error
+    context.logger.exception('/ask: stream failed')
+    return {'status': 500, 'detail': 'Internal Server Error'}
 
 
-async def ask_action(queries: list[Question], context: Context) -> AsyncIterator[str]:
+async def start_stream(stream: AsyncIterator[str], started: float, context: Context) -> AsyncIterator[str]:
+    # the first event is awaited before the response starts, so errors are still reported with a status code
+    first = await anext(stream, None)
+    latency = time.perf_counter() - started
+    FIRST_EVENT_LATENCY.observe(latency)
+    context.logger.info('/ask: first event in %.3f s', latency)
+
+    async def chain():
+        streaming = time.perf_counter()
+        sent = 0
+        try:
+            if first is not None:
+                yield first
+                sent += 1
+            async for text in stream:
+                yield text
+                sent += 1
+        except (GeneratorExit, asyncio.CancelledError):
+            ASK_DISCONNECTS.inc()
+            context.logger.info('/ask: client disconnected after %.3f s', time.perf_counter() - started)
+            raise
+        except Exception as e:
+            # the status code is already sent, e.g. a topic was rejected by admission control after another one
+            # started to answer; the stream ends with an error event
+            yield format_event(sent, stream_error(e, context), ERROR_EVENT)
+            return
+        finally:
+            # stops the answers of all topics and closes their /llm_ask streams
+            await stream.aclose()
+        context.trace.observe('stream', time.perf_counter() - streaming)
+        context.logger.info('/ask: done in %.3f s, %s', time.perf_counter() - started, context.trace.summary())
+
+    return chain()
+
+
+async def ask_action(
+        queries: list[Question], context: Context, events: EventMode = EventMode.BATCH
+) -> AsyncIterator[str]:
+    started = time.perf_counter()
     str_queries = [q.question for q in queries]
-    embeddings = await get_embeddings(queries=str_queries)
-    articles = await get_articles(queries=queries, embeddings=embeddings, context=context)
-    user_prompts = build_prompts(queries=str_queries, articles=articles)
-    return get_llm_answer(prompts=user_prompts)
+    ASK_BATCH_SIZE.labels('request').observe(len(queries))
+    async with context.admit('embed', len(queries)):
+        with context.trace.stage('embed'):
+            embeddings = await get_embeddings(queries=str_queries, context=context)
+    cache = context.answer_cache
+    if cache is not None and queries:
+        answers = [cache.lookup(q.topic, emb) for q, emb in zip(queries, embeddings)]
+        if all(answer is not None for answer in answers):
+            per_question = events == EventMode.QUESTION
+            return await start_stream(cache.cached_stream(answers, per_question), started, context)
+
+    groups = [
+        (indexes, answer_topic(topic, [str_queries[i] for i in indexes], [embeddings[i] for i in indexes], context))
+        for topic, indexes in group_by_topic(queries).items()
+    ]
+    if events == EventMode.QUESTION:
+        answer = stream_questions(groups, size=len(queries))
+    else:
+        answer = merge_answers(groups, size=len(queries))
+    if cache is not None:
+        answer = cache.store_stream(answer, topics=[q.topic for q in queries], embeddings=embeddings)
+    return await start_stream(answer, started, context)
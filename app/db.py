@@ -1,30 +1,262 @@
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Protocol
 
-from pymilvus import MilvusClient
+from prometheus_client import Counter, Gauge, Histogram
+from pymilvus import MilvusClient, MilvusException
 
 from app.models import DBSearchResponse
+from app.partitions import LoadedPartitions
+from common.local_index import LocalIndex
+from common.passages import article_id
+from common.topics import partition_name, topic_of_partition
 
 milvus_host = os.getenv('MILVUS_HOST') or '127.0.0.1'
 milvus_port = os.getenv('MILVUS_PORT') or '19530'
+health_check_interval = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL') or 30)
+# `milvus` or `local`, the in-process index built by data_builder in LOCAL_INDEX_PATH
+db_backend = os.getenv('DB_BACKEND') or 'milvus'
+local_index_path = os.getenv('LOCAL_INDEX_PATH') or 'local_index'
+
+# number of passages found per question, they are packed into the prompt budget afterwards
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT') or 3)
+
+POOL_SIZE = Gauge('app_db_pool_size', 'Number of open Milvus connections')
+POOL_IN_USE = Gauge('app_db_pool_in_use', 'Number of Milvus connections taken from the pool')
+POOL_WAIT = Histogram('app_db_pool_wait_seconds', 'Time spent waiting for a free Milvus connection')
+POOL_RECONNECTS = Counter('app_db_pool_reconnects_total', 'Number of broken Milvus connections replaced')
+
+
+class SearchBackend(Protocol):
+    def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        ...
+
+    def discover_topics(self) -> list[str]:
+        ...
+
+    def close(self) -> None:
+        ...
 
 
 class Database:
     COLLECTION_NAME = 'articles'
 
-    def __init__(self, host=milvus_host, port=milvus_port):
-        self.client = MilvusClient(uri=f'http://{host}:{port}', timeout=10)
+    def __init__(
+            self,
+            host=milvus_host,
+            port=milvus_port,
+            uri: str | None = None,
+            with_text: bool = True,
+            partitioned: bool = True,
+    ):
+        self.client = MilvusClient(uri=uri or f'http://{host}:{port}', timeout=10)
+        self.output_fields = ['topic', 'article_id', 'text'] if with_text else ['topic', 'article_id']
+        # a collection without topic partitions (e.g. in Milvus Lite) is searched with a filter expression
+        self.partitioned = partitioned
+        self.last_used = time.monotonic()
 
     def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        if self.partitioned:
+            scope = {'partition_names': [partition_name(topic)]}
+        else:
+            scope = {'filter': f'topic == "{topic}"'}
         res = self.client.search(
             collection_name=self.COLLECTION_NAME,
             data=embeddings,
             anns_field='embedding',
-            limit=3,
+            limit=SEARCH_LIMIT,
             search_params={'metric_type': 'IP', 'params': {}},
-            output_fields=['topic', 'text'],
-            filter=f'topic == "{topic}"',
+            output_fields=self.output_fields,
+            **scope,
         )
+        self.last_used = time.monotonic()
         return [
             DBSearchResponse(items=result)
             for result in res
         ]
+
+    def partitions(self) -> list[str]:
+        return [
+            partition for partition in self.client.list_partitions(self.COLLECTION_NAME)
+            if topic_of_partition(partition) is not None
+        ]
+
+    def is_healthy(self) -> bool:
+        try:
+            self.client.has_collection(self.COLLECTION_NAME)
+        except MilvusException:
+            return False
+        self.last_used = time.monotonic()
+        return True
+
+    def close(self) -> None:
+        try:
+            self.client.close()
+        except MilvusException:
+            pass
+
+
+# Connections are opened lazily up to `size`, which should match the number of io_pool threads:
+# each thread holds at most one connection at a time, so a bigger pool is never used.
+class DatabasePool:
+    def __init__(self, size: int = 8, host=milvus_host, port=milvus_port, with_text: bool = True):
+        self.size = size
+        self.host = host
+        self.port = port
+        self.with_text = with_text
+        self._idle: queue.LifoQueue[Database] = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.partitions = LoadedPartitions(Database.COLLECTION_NAME)
+
+    def _open(self) -> Database:
+        try:
+            return Database(host=self.host, port=self.port, with_text=self.with_text)
+        except MilvusException:
+            self._forget()
+            raise
+
+    def _reserve(self) -> bool:
+        with self._lock:
+            if self._opened >= self.size:
+                return False
+            self._opened += 1
+            POOL_SIZE.set(self._opened)
+            return True
+
+    def _forget(self) -> None:
+        with self._lock:
+            self._opened -= 1
+            POOL_SIZE.set(self._opened)
+
+    def _discard(self, db: Database) -> None:
+        POOL_RECONNECTS.inc()
+        db.close()
+        self._forget()
+
+    def acquire(self) -> Database:
+        if self._closed:
+            raise RuntimeError('Database pool is closed')
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            db = self._open() if self._reserve() else self._wait()
+
+        if time.monotonic() - db.last_used > health_check_interval and not db.is_healthy():
+            # the broken connection is replaced in its slot, the number of open connections stays the same
+            POOL_RECONNECTS.inc()
+            db.close()
+            db = self._open()
+        POOL_IN_USE.inc()
+        return db
+
+    def _wait(self) -> Database:
+        with POOL_WAIT.time():
+            while True:
+                try:
+                    return self._idle.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+                # a broken connection was discarded meanwhile, its slot is free
+                if self._closed:
+                    raise RuntimeError('Database pool is closed')
+                if self._reserve():
+                    return self._open()
+
+    def release(self, db: Database) -> None:
+        POOL_IN_USE.dec()
+        if self._closed:
+            db.close()
+            return
+        self._idle.put(db)
+
+    @contextmanager
+    def connection(self) -> Iterator[Database]:
+        db = self.acquire()
+        broken = False
+        try:
+            yield db
+        except MilvusException:
+            broken = True
+            raise
+        finally:
+            if broken:
+                # the connection may be broken, don't give it to anyone else
+                POOL_IN_USE.dec()
+                self._discard(db)
+            else:
+                self.release(db)
+
+    def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        partition = partition_name(topic)
+        try:
+            with self.connection() as db, self.partitions.use(db.client, partition):
+                return db.search(topic, embeddings)
+        except MilvusException:
+            # retry once on a fresh connection, loading the partition again in case it was released meanwhile
+            self.partitions.forget(partition)
+            with self.connection() as db, self.partitions.use(db.client, partition):
+                return db.search(topic, embeddings)
+
+    def discover_topics(self) -> list[str]:
+        # also takes over the partitions already loaded, e.g. after data_builder rebuilt the collection
+        with self.connection() as db:
+            partitions = db.partitions()
+            self.partitions.sync(db.client, partitions)
+        return [topic_of_partition(partition) for partition in partitions]
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+            POOL_SIZE.set(0)
+
+
+class LocalDatabase:
+    def __init__(self, path: str = local_index_path, with_text: bool = True, limit: int = SEARCH_LIMIT):
+        self.index = LocalIndex(path)
+        self.with_text = with_text
+        self.limit = limit
+
+    def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        shard = self.index.shards.get(topic)
+        with_text = self.with_text and shard is not None and shard.texts is not None
+        return [
+            DBSearchResponse(items=[
+                {
+                    'id': int(shard.ids[row]),
+                    'distance': score,
+                    'entity': {
+                        'topic': topic,
+                        'article_id': article_id(int(shard.ids[row])),
+                        'text': shard.texts[row] if with_text else None,
+                    },
+                }
+                for row, score in hits
+            ])
+            for hits in self.index.search(topic, embeddings, limit=self.limit)
+        ]
+
+    def discover_topics(self) -> list[str]:
+        # shards are memory-mapped, the ones of cold topics are paged out by the OS instead of released
+        return self.index.topics
+
+    def close(self) -> None:
+        pass
+
+
+def create_database(size: int, with_text: bool = True) -> SearchBackend:
+    if db_backend == 'milvus':
+        return DatabasePool(size=size, with_text=with_text)
+    if db_backend == 'local':
+        return LocalDatabase(with_text=with_text)
+    raise ValueError(f'Unknown DB_BACKEND: {db_backend}')
@@ -0,0 +1,89 @@
+import asyncio
+import contextvars
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
+from prometheus_client import Counter
+
+from app.db import SEARCH_LIMIT
+from app.models import DBSearchResponse, DBSearchResponseItem
+from common.bm25 import BM25Index
+from common.passages import article_id
+
+# built by data_builder in BM25_INDEX_PATH; hits of both searches are fused with reciprocal rank fusion
+LEXICAL_SEARCH_LIMIT = int(os.getenv('LEXICAL_SEARCH_LIMIT') or SEARCH_LIMIT)
+# the vector hits are used alone when the lexical search takes longer
+LEXICAL_SEARCH_TIMEOUT = float(os.getenv('LEXICAL_SEARCH_TIMEOUT_MS') or 50) / 1000
+# the lexical search runs on its own threads, a slow one doesn't hold the io pool of the database searches
+LEXICAL_SEARCH_THREADS = int(os.getenv('LEXICAL_SEARCH_THREADS') or 2)
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K') or 60)
+# weights of the vector and the lexical ranks in the fusion; equal weights win when questions paraphrase the passages,
+# a higher lexical weight when they repeat their words, see benchmarks/bench_hybrid.py
+HYBRID_VECTOR_WEIGHT = float(os.getenv('HYBRID_VECTOR_WEIGHT') or 1)
+HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT') or 1)
+
+LEXICAL_SEARCH_TIMEOUTS = Counter(
+    'app_lexical_search_timeouts_total', 'Lexical searches that took longer than LEXICAL_SEARCH_TIMEOUT_MS'
+)
+
+
+class LexicalSearch:
+    def __init__(
+            self,
+            path: str,
+            with_text: bool = True,
+            limit: int = LEXICAL_SEARCH_LIMIT,
+            threads: int = LEXICAL_SEARCH_THREADS,
+    ):
+        self.index = BM25Index(path)
+        self.with_text = with_text
+        self.limit = limit
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='lexical-search')
+
+    async def asearch(self, topic, queries: list[str]) -> list[DBSearchResponse]:
+        # a search that is still queued when the caller gives up is not started
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, contextvars.copy_context().run, self.search, topic, queries)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def search(self, topic, queries: list[str]) -> list[DBSearchResponse]:
+        shard = self.index.shards.get(topic)
+        with_text = self.with_text and shard is not None and shard.texts is not None
+        return [
+            DBSearchResponse(items=[
+                {
+                    'id': int(shard.ids[row]),
+                    'distance': score,
+                    'entity': {
+                        'topic': topic,
+                        'article_id': article_id(int(shard.ids[row])),
+                        'text': shard.texts[row] if with_text else None,
+                    },
+                }
+                for row, score in hits
+            ])
+            for hits in self.index.search(topic, queries, limit=self.limit)
+        ]
+
+
+def fuse(
+        responses: list[DBSearchResponse],
+        k: int = HYBRID_RRF_K,
+        limit: int = SEARCH_LIMIT,
+        weights: Sequence[float] = (HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT),
+) -> DBSearchResponse:
+    # weighted reciprocal rank fusion of the vector and the lexical hits: a hit scores weight / (k + rank) in every
+    # list it is found in, scores of the searches are not comparable; the item of the first list is kept,
+    # the vector search returns texts
+    scores: dict[int, float] = defaultdict(float)
+    items: dict[int, DBSearchResponseItem] = {}
+    for response, weight in zip(responses, weights):
+        for rank, item in enumerate(sorted(response.items, key=lambda i: i.distance, reverse=True), start=1):
+            scores[item.id] += weight / (k + rank)
+            items.setdefault(item.id, item)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+    return DBSearchResponse(items=[items[i].model_copy(update={'distance': scores[i]}) for i in best])
@@ -1,45 +1,111 @@
 import logging
+import os
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from typing import Annotated
 
+import httpx
 import uvicorn
 from fastapi import FastAPI, Depends
+from pymilvus import MilvusException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, HTMLResponse
+from starlette.background import BackgroundTask
 from prometheus_fastapi_instrumentator import Instrumentator
 
+from app.admission import Admission, create_admission
 from app.context import Context
-from app.data_processing import ask_action
-from app.db import Database
+from app.data_processing import ask_action, create_llm_client
+from app.db import SearchBackend, create_database
+from app.hybrid import LexicalSearch
 from app.models import AskRequest
-from common import setup_logging
+from app.search_batching import SearchCoalescer, create_search_coalescer
+from app.semantic_cache import SemanticCache, create_semantic_cache
+from app.topics import known_topics, set_known_topics
+from common import setup_logging, shutdown_logging
+from common.article_store import ArticleStore
+from common.embedding_cache import EmbeddingCache, create_embedding_cache
+from common.tracing import TraceMiddleware
 
 
 class TextEventStreamResponse(StreamingResponse):
     media_type = 'text/event-stream'
 
 
+IO_POOL_SIZE = int(os.getenv('IO_POOL_SIZE') or 8)
+# built by data_builder; when set, the search returns only ids and texts are read from the store
+ARTICLE_STORE_PATH = os.getenv('ARTICLE_STORE_PATH')
+ARTICLE_CACHE_SIZE = int(os.getenv('ARTICLE_CACHE_SIZE') or 1024)
+# built by data_builder; when set, a BM25 search runs next to the vector search, see app/hybrid.py
+BM25_INDEX_PATH = os.getenv('BM25_INDEX_PATH')
+
 io_pool: ThreadPoolExecutor
+db_pool: SearchBackend
+http_client: httpx.AsyncClient
+embedding_cache: EmbeddingCache | None = None
+answer_cache: SemanticCache | None = None
+articles: ArticleStore | None = None
+admission: Admission | None = None
+search_coalescer: SearchCoalescer | None = None
+lexical: LexicalSearch | None = None
 logger: logging.Logger
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    global io_pool, logger
+    global io_pool, db_pool, http_client, embedding_cache, answer_cache, articles, admission, search_coalescer, lexical
+    global logger
 
     logger = setup_logging('app')
-    with ThreadPoolExecutor(max_workers=8) as thread_pool:
-        io_pool = thread_pool
-        yield
+    embedding_cache = create_embedding_cache('app', default_size=10000)
+    answer_cache = create_semantic_cache()
+    admission = create_admission()
+    if ARTICLE_STORE_PATH:
+        articles = ArticleStore(ARTICLE_STORE_PATH, cache_size=ARTICLE_CACHE_SIZE)
+    if BM25_INDEX_PATH:
+        lexical = LexicalSearch(BM25_INDEX_PATH, with_text=articles is None)
+    db_pool = create_database(size=IO_POOL_SIZE, with_text=articles is None)
+    discover_topics()
+    try:
+        async with create_llm_client() as client:
+            http_client = client
+            with ThreadPoolExecutor(max_workers=IO_POOL_SIZE) as thread_pool:
+                io_pool = thread_pool
+                search_coalescer = create_search_coalescer(db_pool.search, io_pool)
+                yield
+    finally:
+        db_pool.close()
+        if articles is not None:
+            articles.close()
+        if lexical is not None:
+            lexical.close()
+        shutdown_logging()
+
+
+def discover_topics() -> None:
+    try:
+        topics = db_pool.discover_topics()
+    except MilvusException as e:
+        # e.g. the collection is not built yet, data_builder calls /cache/invalidate when it is
+        logger.warning('Topics are not discovered, any topic is accepted: %r', e)
+        return
+    set_known_topics(topics)
+    logger.info('Topics: %s', ', '.join(sorted(topics)))
 
 
 def get_session() -> Context:
     assert io_pool is not None
     return Context(
-        db=Database(),
+        db=db_pool,
         io_pool=io_pool,
+        http_client=http_client,
         logger=logger,
+        embedding_cache=embedding_cache,
+        answer_cache=answer_cache,
+        articles=articles,
+        admission=admission,
+        search_coalescer=search_coalescer,
+        lexical=lexical,
     )
 
 
@@ -49,6 +115,8 @@ app = FastAPI(lifespan=lifespan)
 
 instrumentator = Instrumentator().instrument(app).expose(app)
 
+app.add_middleware(TraceMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -65,7 +133,24 @@ async def root():
 
 @app.post("/ask", response_class=TextEventStreamResponse)
 async def ask(query: AskRequest, context: ContextDep) -> StreamingResponse:
-    return StreamingResponse(await ask_action(query.questions, context), media_type="text/event-stream")
+    stream = await ask_action(query.questions, context, query.events)
+    # starlette cancels the response when the client disconnects, the stream is closed right away to stop its answers
+    return StreamingResponse(stream, media_type="text/event-stream", background=BackgroundTask(stream.aclose))
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(context: ContextDep) -> dict:
+    # called by data_builder after the collection is reloaded
+    if context.answer_cache is not None:
+        context.answer_cache.invalidate()
+    # topics may have been added or removed
+    await context.run_io(discover_topics)
+    return {'status': 'ok'}
+
+
+@app.get("/topics")
+async def topics() -> dict:
+    return {'topics': known_topics()}
 
 
 if __name__ == "__main__":
@@ -1,12 +1,12 @@
 import enum
-from typing import Iterable
+from typing import Annotated, Iterable
 
-from pydantic import BaseModel
+from pydantic import AfterValidator, BaseModel
 
+from app.topics import validate_topic
 
-class Topic(enum.Enum):
-    BUSINESS = 'business'
-    SPORT = 'sports'
+# topics are discovered from the database, see app.topics
+Topic = Annotated[str, AfterValidator(validate_topic)]
 
 
 # API models
@@ -17,20 +17,31 @@ class Question(BaseModel):
     topic: Topic
 
 
+class EventMode(enum.Enum):
+    # one event per step with a chunk for every question
+    BATCH = 'batch'
+    # `delta` events with a chunk of one question and a `done` event per question
+    QUESTION = 'question'
+
+
 class AskRequest(BaseModel):
     questions: list[Question]
+    events: EventMode = EventMode.BATCH
 
 
 # DB models
 
 class DBSearchRequest(BaseModel):
-    topic: Topic
+    topic: str
     embedding: Iterable
 
 
 class DBResponseEntity(BaseModel):
-    topic: Topic
-    text: str
+    topic: str
+    # the article the passage was cut from
+    article_id: int | None = None
+    # not returned by the search when texts are kept in the article store
+    text: str | None = None
 
 
 class DBSearchResponseItem(BaseModel):
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymilvus import MilvusClient, MilvusException
+from pymilvus.client.types import LoadState
+
+# max number of topic partitions kept loaded in Milvus memory, 0 keeps every partition that was searched
+MAX_LOADED_PARTITIONS = int(os.getenv('MILVUS_MAX_LOADED_PARTITIONS') or 16)
+
+PARTITIONS_LOADED = Gauge('app_milvus_partitions_loaded', 'Number of topic partitions loaded in Milvus')
+PARTITION_LOADS = Counter('app_milvus_partition_loads_total', 'Topic partitions loaded on demand')
+PARTITION_RELEASES = Counter('app_milvus_partition_releases_total', 'Least recently used topic partitions released')
+PARTITION_LOAD_SECONDS = Histogram(
+    'app_milvus_partition_load_seconds',
+    'Time spent loading a topic partition before its search',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+# Loads the partitions of the searched topics on demand and releases the least recently used ones to keep at most
+# `max_loaded` in memory. A partition with searches running on it is never released, so the limit may be exceeded
+# for a while when all of them are busy. Called from the io pool threads, each with its own connection.
+class LoadedPartitions:
+    def __init__(self, collection: str, max_loaded: int = MAX_LOADED_PARTITIONS):
+        self.collection = collection
+        self.max_loaded = max_loaded
+        # least recently used first, with the number of searches running on each partition
+        self._loaded: OrderedDict[str, int] = OrderedDict()
+        # a partition is loaded or released by one thread at a time, the others wait for it
+        self._busy: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> list[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    @contextmanager
+    def use(self, client: MilvusClient, partition: str) -> Iterator[None]:
+        self._acquire(client, partition)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._loaded.get(partition):
+                    self._loaded[partition] -= 1
+
+    def forget(self, partition: str) -> None:
+        # after a failed search: the partition may have been released by someone else, it's loaded again next time
+        with self._lock:
+            self._loaded.pop(partition, None)
+            PARTITIONS_LOADED.set(len(self._loaded))
+
+    def sync(self, client: MilvusClient, partitions: list[str]) -> None:
+        # takes over the partitions loaded by a previous run or by hand, releasing the ones over the limit
+        loaded = [
+            partition for partition in partitions
+            if client.get_load_state(self.collection, partition)['state'] == LoadState.Loaded
+        ]
+        with self._lock:
+            self._loaded = OrderedDict((partition, self._loaded.get(partition, 0)) for partition in loaded)
+            evicted = self._evict()
+        self._release(client, evicted)
+
+    def _take(self, partition: str) -> bool:
+        if partition not in self._loaded:
+            return False
+        self._loaded.move_to_end(partition)
+        self._loaded[partition] += 1
+        return True
+
+    def _acquire(self, client: MilvusClient, partition: str) -> None:
+        with self._lock:
+            if self._take(partition):
+                return
+            busy = self._busy.setdefault(partition, threading.Lock())
+        with busy:
+            with self._lock:
+                if self._take(partition):
+                    return
+            with PARTITION_LOAD_SECONDS.time():
+                client.load_partitions(self.collection, [partition])
+            PARTITION_LOADS.inc()
+            with self._lock:
+                self._loaded[partition] = 1
+                evicted = self._evict()
+        # released after letting go of the lock of this partition, so two threads never wait for each other's locks
+        self._release(client, evicted)
+
+    def _evict(self) -> list[str]:
+        # called with self._lock held
+        evicted = []
+        excess = len(self._loaded) - self.max_loaded
+        if self.max_loaded > 0 and excess > 0:
+            evicted = [partition for partition, searches in self._loaded.items() if not searches][:excess]
+            for partition in evicted:
+                del self._loaded[partition]
+        PARTITIONS_LOADED.set(len(self._loaded))
+        return evicted
+
+    def _release(self, client: MilvusClient, partitions: list[str]) -> None:
+        for partition in partitions:
+            with self._lock:
+                busy = self._busy.setdefault(partition, threading.Lock())
+            # a search of the partition arriving meanwhile waits here and loads it again
+            with busy:
+                with self._lock:
+                    if partition in self._loaded:
+                        # loaded again by a search since it was evicted
+                        continue
+                try:
+                    client.release_partitions(self.collection, [partition])
+                except MilvusException:
+                    # stays loaded in Milvus, loading it again is a no-op
+                    continue
+            PARTITION_RELEASES.inc()
@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Callable
+
+from prometheus_client import Histogram
+
+from app.models import DBSearchResponse
+from app.tracing import IO_QUEUE_WAIT
+
+# queries of one topic searched together; a window of 0 disables coalescing
+SEARCH_BATCH_MAX_SIZE = int(os.getenv('SEARCH_BATCH_MAX_SIZE') or 64)
+SEARCH_BATCH_MAX_WAIT = float(os.getenv('SEARCH_BATCH_MAX_WAIT_MS') or 2) / 1000
+
+SEARCH_BATCH_SIZE = Histogram(
+    'app_search_batch_size',
+    'Number of query vectors in one database search',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+SEARCH_BATCH_REQUESTS = Histogram(
+    'app_search_batch_requests',
+    'Number of /ask requests sharing one database search',
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+SEARCH_QUEUE_DELAY = Histogram(
+    'app_search_queue_delay_seconds',
+    'Time a search waits for its batch to be flushed',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+@dataclass
+class _Pending:
+    embeddings: list
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+# Coalesces the searches of concurrent /ask requests into one multi-vector search per topic. A search of a topic
+# without a search in flight is sent right away; the ones arriving meanwhile wait for it and go together when it
+# finishes, when they reach `max_batch_size` vectors or when the first of them waited `max_wait` seconds.
+class SearchCoalescer:
+    def __init__(
+            self,
+            search: Callable[[str, list], list[DBSearchResponse]],
+            io_pool: Executor,
+            max_batch_size: int = SEARCH_BATCH_MAX_SIZE,
+            max_wait: float = SEARCH_BATCH_MAX_WAIT,
+    ):
+        self._search = search
+        self._io_pool = io_pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: dict[str, list[_Pending]] = {}
+        self._pending_size: dict[str, int] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._in_flight: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def search(self, topic: str, embeddings: list) -> list[DBSearchResponse]:
+        if not embeddings:
+            return []
+
+        loop = asyncio.get_running_loop()
+        pending = _Pending(embeddings=embeddings, future=loop.create_future())
+        self._pending.setdefault(topic, []).append(pending)
+        self._pending_size[topic] = self._pending_size.get(topic, 0) + len(embeddings)
+        if self._pending_size[topic] >= self.max_batch_size or not self._in_flight.get(topic):
+            self._flush(topic)
+        elif topic not in self._timers:
+            self._timers[topic] = loop.call_later(self.max_wait, self._flush, topic)
+        return await pending.future
+
+    def _flush(self, topic: str) -> None:
+        timer = self._timers.pop(topic, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(topic, [])
+        self._pending_size.pop(topic, None)
+        if batch:
+            self._in_flight[topic] = self._in_flight.get(topic, 0) + 1
+            task = asyncio.get_running_loop().create_task(self._run(topic, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, topic: str, batch: list[_Pending]) -> None:
+        now = time.monotonic()
+        embeddings = []
+        for pending in batch:
+            SEARCH_QUEUE_DELAY.observe(now - pending.enqueued)
+            embeddings.extend(pending.embeddings)
+        SEARCH_BATCH_SIZE.observe(len(embeddings))
+        SEARCH_BATCH_REQUESTS.observe(len(batch))
+
+        submitted = time.perf_counter()
+
+        def run() -> list[DBSearchResponse]:
+            IO_QUEUE_WAIT.observe(time.perf_counter() - submitted)
+            return self._search(topic, embeddings)
+
+        try:
+            # logs of the search carry the trace id of the request that opened the batch
+            responses = await asyncio.get_running_loop().run_in_executor(
+                self._io_pool, contextvars.copy_context().run, run
+            )
+            if len(responses) != len(embeddings):
+                raise ValueError(f'{len(responses)} responses for {len(embeddings)} queries')
+        except BaseException as e:
+            # every search of the batch gets the error, the task itself ends quietly unless it was cancelled
+            for pending in batch:
+                if pending.future.done():
+                    continue
+                if isinstance(e, Exception):
+                    pending.future.set_exception(e)
+                else:
+                    pending.future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+        finally:
+            self._in_flight[topic] -= 1
+            if self._pending.get(topic):
+                self._flush(topic)
+
+        offset = 0
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_result(responses[offset: offset + len(pending.embeddings)])
+            offset += len(pending.embeddings)
+
+
+def create_search_coalescer(
+        search: Callable[[str, list], list[DBSearchResponse]], io_pool: Executor
+) -> SearchCoalescer | None:
+    if SEARCH_BATCH_MAX_WAIT <= 0:
+        return None
+    return SearchCoalescer(search, io_pool)
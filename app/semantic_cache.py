@@ -0,0 +1,149 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import count
+from typing import AsyncIterator, Sequence
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from app.models import Topic
+from app.sse import DELTA_EVENT, EVENT_NAME, QuestionEventFormatter, format_event, parse_events
+
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE') or 0)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD') or 0.95)
+# answers bigger than this are not cached
+SEMANTIC_CACHE_MAX_ANSWER_BYTES = int(os.getenv('SEMANTIC_CACHE_MAX_ANSWER_BYTES') or 64 * 1024)
+
+SEMANTIC_CACHE_HITS = Counter('app_semantic_cache_hits_total', 'Questions answered from the semantic cache')
+SEMANTIC_CACHE_MISSES = Counter('app_semantic_cache_misses_total', 'Questions not found in the semantic cache')
+SEMANTIC_CACHE_INVALIDATIONS = Counter('app_semantic_cache_invalidations_total', 'Semantic cache invalidations')
+SEMANTIC_CACHE_ITEMS = Gauge('app_semantic_cache_items', 'Number of answers in the semantic cache')
+
+# the answer of one question: its chunk from every SSE event, `[]` once it is finished
+Answer = list
+
+
+@dataclass
+class _Entry:
+    topic: Topic
+    embedding: np.ndarray
+    answer: Answer
+
+
+class _TopicIndex:
+    def __init__(self):
+        self.keys: list[int] = []
+        self.embeddings: list[np.ndarray] = []
+        self._matrix: np.ndarray | None = None
+
+    def add(self, key: int, embedding: np.ndarray) -> None:
+        self.keys.append(key)
+        self.embeddings.append(embedding)
+        self._matrix = None
+
+    def remove(self, key: int) -> None:
+        index = self.keys.index(key)
+        del self.keys[index]
+        del self.embeddings[index]
+        self._matrix = None
+
+    def nearest(self, embedding: np.ndarray) -> tuple[int, float] | None:
+        if not self.keys:
+            return None
+        if self._matrix is None:
+            self._matrix = np.vstack(self.embeddings)
+        scores = self._matrix @ embedding
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+
+# Answers of previous questions, looked up by inner product of the question embeddings within the same topic.
+# The least recently used answer is evicted when the cache is full.
+class SemanticCache:
+    def __init__(self, max_items: int, threshold: float, max_answer_bytes: int = SEMANTIC_CACHE_MAX_ANSWER_BYTES):
+        self.max_items = max_items
+        self.threshold = threshold
+        self.max_answer_bytes = max_answer_bytes
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._topics: dict[Topic, _TopicIndex] = {}
+        self._keys = count()
+        # bumped by invalidate(), an answer streamed across an invalidation is based on the old collection
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, topic: Topic, embedding: Sequence[float]) -> Answer | None:
+        index = self._topics.get(topic)
+        nearest = index.nearest(np.asarray(embedding, dtype=np.float32)) if index is not None else None
+        if nearest is None or nearest[1] < self.threshold:
+            SEMANTIC_CACHE_MISSES.inc()
+            return None
+        SEMANTIC_CACHE_HITS.inc()
+        self._entries.move_to_end(nearest[0])
+        return self._entries[nearest[0]].answer
+
+    def store(self, topic: Topic, embedding: Sequence[float], answer: Answer) -> None:
+        key = next(self._keys)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._entries[key] = _Entry(topic=topic, embedding=vector, answer=answer)
+        self._topics.setdefault(topic, _TopicIndex()).add(key, vector)
+        while len(self._entries) > self.max_items:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._topics[evicted.topic].remove(evicted_key)
+        SEMANTIC_CACHE_ITEMS.set(len(self._entries))
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._topics.clear()
+        self._generation += 1
+        SEMANTIC_CACHE_INVALIDATIONS.inc()
+        SEMANTIC_CACHE_ITEMS.set(0)
+
+    async def cached_stream(self, answers: list[Answer], per_question: bool = False) -> AsyncIterator[str]:
+        formatter = QuestionEventFormatter(len(answers))
+        indexes = list(range(len(answers)))
+        for i in range(max(len(answer) for answer in answers)):
+            step = [answer[i] if i < len(answer) else [] for answer in answers]
+            if per_question:
+                for text in formatter.format(indexes, step):
+                    yield text
+            else:
+                yield format_event(i, step)
+        if per_question:
+            for text in formatter.finish(indexes):
+                yield text
+
+    async def store_stream(
+            self, stream: AsyncIterator[str], topics: list[Topic], embeddings: list[Sequence[float]]
+    ) -> AsyncIterator[str]:
+        generation = self._generation
+        parts = []
+        size = 0
+        async for text in stream:
+            yield text
+            size += len(text)
+            if size <= self.max_answer_bytes:
+                parts.append(text)
+        if size > self.max_answer_bytes or generation != self._generation:
+            return
+
+        answers: list[Answer] = [[] for _ in topics]
+        for event in parse_events(''.join(parts)):
+            if event.event == DELTA_EVENT:
+                answers[event.data['index']].append(event.data['text'])
+            elif event.event == EVENT_NAME:
+                for answer, chunk in zip(answers, event.data):
+                    answer.append(chunk)
+        for topic, embedding, answer in zip(topics, embeddings, answers):
+            while answer and answer[-1] == []:
+                answer.pop()
+            if answer:
+                self.store(topic, embedding, answer)
+
+
+def create_semantic_cache() -> SemanticCache | None:
+    if SEMANTIC_CACHE_SIZE <= 0:
+        return None
+    return SemanticCache(max_items=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD)
@@ -0,0 +1,126 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+EVENT_NAME = 'qasystem'
+# events of the per-question mode of /ask
+DELTA_EVENT = 'delta'
+DONE_EVENT = 'done'
+# sent instead of the rest of an /ask stream that failed after its first event
+ERROR_EVENT = 'error'
+# an upstream event bigger than this is an error instead of growing the buffer
+SSE_MAX_EVENT_BYTES = int(os.getenv('SSE_MAX_EVENT_BYTES') or 1024 * 1024)
+
+
+@dataclass
+class Event:
+    id: int
+    data: Any
+    event: str = EVENT_NAME
+
+
+class SSEError(ValueError):
+    pass
+
+
+def format_event(event_id: int, data: Any, event: str = EVENT_NAME) -> str:
+    return (f'event: {event}\n'
+            f'id: {event_id}\n'
+            f'data: {json.dumps(data, separators=(",", ":"))}\n\n')
+
+
+# Per-question framing of answer steps: a `delta` event for every non-empty chunk and one `done` event per question,
+# instead of one event with a chunk (or a [] placeholder) for every question of the batch.
+class QuestionEventFormatter:
+    def __init__(self, size: int):
+        self.finished = [False] * size
+        self.event_id = 0
+
+    def format(self, indexes: Iterable[int], step: list) -> Iterator[str]:
+        for index, chunk in zip(indexes, step):
+            if self.finished[index] or chunk == '':
+                continue
+            if chunk == []:
+                self.finished[index] = True
+                yield format_event(self.event_id, {'index': index}, DONE_EVENT)
+            else:
+                yield format_event(self.event_id, {'index': index, 'text': chunk}, DELTA_EVENT)
+            self.event_id += 1
+
+    def finish(self, indexes: list[int]) -> Iterator[str]:
+        return self.format(indexes, [[]] * len(indexes))
+
+
+# Incremental parser of a text/event-stream: chunks may split or merge events at any point,
+# complete events are returned as soon as their terminating blank line is received.
+class SSEParser:
+    def __init__(self, max_event_size: int = SSE_MAX_EVENT_BYTES):
+        self.max_event_size = max_event_size
+        self._buffer = ''
+        self._fields: dict[str, str] = {}
+        self._data: list[str] = []
+        self._size = 0
+
+    def feed(self, chunk: str) -> list[Event]:
+        text = self._buffer + chunk
+        # a trailing \r may be the first half of \r\n
+        held = '\r' if text.endswith('\r') else ''
+        lines = text[:len(text) - len(held)].replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        self._buffer = lines.pop() + held
+
+        events = []
+        for line in lines:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        if self._size + len(self._buffer) > self.max_event_size:
+            raise SSEError(f'SSE event is bigger than {self.max_event_size} characters')
+        return events
+
+    def close(self) -> list[Event]:
+        # the stream ended without a blank line after the last event
+        events = self.feed('\n') if self._buffer else []
+        event = self._dispatch()
+        return events + ([event] if event is not None else [])
+
+    def _process_line(self, line: str) -> Event | None:
+        if not line:
+            return self._dispatch()
+        self._size += len(line)
+        if line.startswith(':'):
+            return None
+        name, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if name == 'data':
+            self._data.append(value)
+        elif name in ('event', 'id'):
+            self._fields[name] = value
+        return None
+
+    def _dispatch(self) -> Event | None:
+        fields, data = self._fields, self._data
+        self._fields, self._data, self._size = {}, [], 0
+        if not data:
+            return None
+        try:
+            return Event(event=fields.get('event', 'message'), id=int(fields['id']), data=json.loads('\n'.join(data)))
+        except (KeyError, ValueError) as e:
+            raise SSEError(f'Invalid SSE event: {e}') from e
+
+
+def parse_events(source: str) -> Iterator[Event]:
+    parser = SSEParser(max_event_size=len(source) + 1)
+    yield from parser.feed(source)
+    yield from parser.close()
+
+
+async def aiter_events(chunks: AsyncIterator[str], max_event_size: int = SSE_MAX_EVENT_BYTES) -> AsyncIterator[Event]:
+    # `chunks` is e.g. httpx.Response.aiter_text(), split at arbitrary points
+    parser = SSEParser(max_event_size)
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
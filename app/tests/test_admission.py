@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.admission import StageLimiter
+
+
+async def hold(limiter: StageLimiter, batch_size: int, seconds: float, order: list) -> None:
+    async with limiter.slot(batch_size):
+        order.append(batch_size)
+        await asyncio.sleep(seconds)
+
+
+def test_max_in_flight_and_priority():
+    async def main():
+        limiter = StageLimiter('test', max_in_flight=1, max_queue=10, max_wait=5)
+        order = []
+        first = asyncio.create_task(hold(limiter, 10, 0.05, order))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(hold(limiter, size, 0, order)) for size in (8, 1, 4, 1)]
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 1 and limiter.queue_depth == 4
+        await asyncio.gather(first, *waiting)
+        assert limiter.in_flight == 0 and limiter.queue_depth == 0
+        return order
+
+    assert asyncio.run(main()) == [10, 1, 1, 4, 8]
+
+
+def test_rejections():
+    async def main():
+        limiter = StageLimiter('test', max_in_flight=1, max_queue=1, max_wait=0.05)
+        running = asyncio.create_task(hold(limiter, 1, 0.2, []))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold(limiter, 1, 0, []))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as full:
+            await limiter.acquire()
+        with pytest.raises(HTTPException) as timeout:
+            await queued
+        await running
+        return full.value, timeout.value, limiter
+
+    full, timeout, limiter = asyncio.run(main())
+    assert full.status_code == 429 and int(full.headers['Retry-After']) >= 1
+    assert timeout.status_code == 503
+    assert limiter.in_flight == 0
+
+
+def test_deadline_estimate():
+    async def main():
+        limiter = StageLimiter('test', max_in_flight=1, max_queue=10, max_wait=0.05)
+        await hold(limiter, 1, 0.1, [])
+        running = asyncio.create_task(hold(limiter, 1, 0.1, []))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(HTTPException) as rejected:
+                await limiter.acquire()
+        finally:
+            await running
+        return rejected.value
+
+    assert asyncio.run(main()).status_code == 503
+
+
+def test_cancelled_waiter_keeps_no_slot():
+    async def main():
+        limiter = StageLimiter('test', max_in_flight=1, max_queue=10, max_wait=5)
+        running = asyncio.create_task(hold(limiter, 1, 0.02, []))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(limiter, 1, 0, []))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await running
+        await hold(limiter, 1, 0, [])
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.in_flight == 0 and limiter.queue_depth == 0
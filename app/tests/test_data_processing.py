@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+from fastapi import HTTPException
+
+import app.data_processing
+from app.context import Context
+from app.data_processing import build_llm_request, merge_answers, select_passages, start_stream, stream_questions
+from app.models import DBSearchResponse
+from app.sse import parse_events
+
+
+async def answer(steps: list[list], delay: float):
+    for step in steps:
+        await asyncio.sleep(delay)
+        yield step
+
+
+def merge(groups, size: int) -> list:
+    async def main():
+        return ''.join([text async for text in merge_answers(groups, size)])
+
+    return [event.data for event in parse_events(asyncio.run(main()))]
+
+
+def test_merge_keeps_question_order():
+    groups = [
+        ([0, 2], answer([['q0', 'q2'], ['a', 'b'], ['c', []]], delay=0.01)),
+        ([1], answer([['q1'], ['d']], delay=0)),
+    ]
+    assert merge(groups, size=3) == [['q0', 'q1', 'q2'], ['a', 'd', 'b'], ['c', [], []]]
+
+
+def test_merge_empty_request():
+    assert merge([], size=0) == [[]]
+
+
+def search_response(*hits) -> DBSearchResponse:
+    return DBSearchResponse(items=[
+        {'id': i, 'distance': distance, 'entity': {'topic': 'sports', 'article_id': article, 'text': text}}
+        for i, (distance, article, text) in enumerate(hits)
+    ])
+
+
+def test_select_passages_dedupes_and_packs():
+    response = search_response(
+        (0.5, 1, 'c c c'),
+        (0.9, 1, 'a a'),
+        (0.8, 2, 'a a'),
+        (0.7, 1, 'b b'),
+        (0.6, 3, 'd d d d'),
+    )
+    assert select_passages(response, budget=7, per_article=2) == ['a a', 'b b']
+    assert select_passages(response, budget=7, per_article=3) == ['a a', 'b b', 'c c c']
+    assert select_passages(response, budget=0, per_article=1) == ['a a', 'd d d d']
+
+
+def test_select_passages_truncates_the_best_one():
+    response = search_response((0.9, 1, 'a b c d'), (0.8, 2, 'e'))
+    assert select_passages(response, budget=2) == ['a b']
+
+
+def test_build_llm_request(monkeypatch):
+    articles = [search_response((0.9, 1, 'a a'), (0.8, 2, 'b b')), search_response()]
+    assert build_llm_request(['q1', 'q2'], articles, budget=10) == {
+        'items': ['q1', 'q2'], 'articles': [['a a', 'b b'], []]
+    }
+    monkeypatch.setattr(app.data_processing, 'LLM_PROMPT_FORMAT', 'text')
+    request = build_llm_request(['q1', 'q2'], articles, budget=10)
+    assert list(request) == ['items'] and '<input>q1</input>\n<article>a a</article>' in request['items'][0]
+
+
+def test_stream_questions_does_not_wait_for_slow_groups():
+    async def main():
+        groups = [
+            ([0, 2], answer([['q0', 'q2'], ['a', []], ['b', []]], delay=0.05)),
+            ([1], answer([['q1'], ['c']], delay=0)),
+        ]
+        return ''.join([text async for text in stream_questions(groups, size=3)])
+
+    events = [(event.id, event.event, event.data) for event in parse_events(asyncio.run(main()))]
+    assert events == [
+        (0, 'delta', {'index': 1, 'text': 'q1'}),
+        (1, 'delta', {'index': 1, 'text': 'c'}),
+        (2, 'done', {'index': 1}),
+        (3, 'delta', {'index': 0, 'text': 'q0'}),
+        (4, 'delta', {'index': 2, 'text': 'q2'}),
+        (5, 'delta', {'index': 0, 'text': 'a'}),
+        (6, 'done', {'index': 2}),
+        (7, 'delta', {'index': 0, 'text': 'b'}),
+        (8, 'done', {'index': 0}),
+    ]
+
+
+async def rejected():
+    await asyncio.sleep(0.01)
+    yield ['q1']
+    raise HTTPException(status_code=429, detail='Too many requests', headers={'Retry-After': '2'})
+
+
+def test_rejection_after_the_first_event_ends_the_stream_with_an_error():
+    async def main():
+        context = Context(db=None, io_pool=None, http_client=None, logger=logging.getLogger('test'))
+        groups = [([0], answer([['q0']], delay=0)), ([1], rejected())]
+        stream = await start_stream(stream_questions(groups, size=2), 0, context)
+        return ''.join([text async for text in stream])
+
+    events = [(event.id, event.event, event.data) for event in parse_events(asyncio.run(main()))]
+    assert events == [
+        (0, 'delta', {'index': 0, 'text': 'q0'}),
+        (1, 'done', {'index': 0}),
+        (2, 'delta', {'index': 1, 'text': 'q1'}),
+        (3, 'error', {'status': 429, 'detail': 'Too many requests', 'retry_after': 2}),
+    ]
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+from pymilvus import MilvusException
+
+import app.db
+from app.tests.test_partitions import FakeClient
+
+
+class FakeDatabase:
+    COLLECTION_NAME = 'articles'
+    opened = []
+
+    def __init__(self, host=None, port=None, with_text: bool = True):
+        self.client = FakeClient(loaded=['topic_sports'])
+        self.healthy = True
+        self.failures = 0
+        self.closed = False
+        self.last_used = time.monotonic()
+        FakeDatabase.opened.append(self)
+
+    def search(self, topic, embeddings: list) -> list:
+        if self.failures:
+            self.failures -= 1
+            raise MilvusException(message='connection reset')
+        return [[] for _ in embeddings]
+
+    def is_healthy(self) -> bool:
+        return self.healthy
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeDatabase.opened = []
+    monkeypatch.setattr(app.db, 'Database', FakeDatabase)
+    pool = app.db.DatabasePool(size=2)
+    yield pool
+    pool.close()
+
+
+def metric(name: str) -> float:
+    return REGISTRY.get_sample_value(name)
+
+
+def test_connections_are_opened_lazily_and_reused(pool):
+    first = pool.acquire()
+    assert metric('app_db_pool_size') == 1 and metric('app_db_pool_in_use') == 1
+    pool.release(first)
+    assert pool.acquire() is first
+    second = pool.acquire()
+    assert second is not first and metric('app_db_pool_size') == 2 and metric('app_db_pool_in_use') == 2
+    pool.release(first)
+    pool.release(second)
+    assert len(FakeDatabase.opened) == 2 and metric('app_db_pool_in_use') == 0
+
+
+def test_broken_idle_connection_is_replaced_in_its_slot(pool, monkeypatch):
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    second.healthy = False
+    monkeypatch.setattr(app.db, 'health_check_interval', 0)
+    reconnects = metric('app_db_pool_reconnects_total')
+
+    db = pool.acquire()
+    assert second.closed and db not in (first, second)
+    assert metric('app_db_pool_reconnects_total') == reconnects + 1
+    assert pool._opened == 2 and metric('app_db_pool_size') == 2
+    pool.release(db)
+
+
+def test_search_is_retried_on_a_fresh_connection(pool):
+    db = pool.acquire()
+    db.failures = 1
+    pool.release(db)
+
+    assert pool.search('sports', [[1.0]]) == [[]]
+    assert db.closed and len(FakeDatabase.opened) == 2
+    assert pool._opened == 1 and metric('app_db_pool_in_use') == 0
+
+
+def test_waiter_takes_the_slot_of_a_discarded_connection(monkeypatch):
+    monkeypatch.setattr(app.db, 'Database', FakeDatabase)
+    pool = app.db.DatabasePool(size=1)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    with pytest.raises(MilvusException):
+        with pool.connection():
+            waiter.start()
+            time.sleep(0.05)
+            # the connection breaks, it is not returned to the pool
+            raise MilvusException(message='connection reset')
+    waiter.join(timeout=1)
+    assert acquired and pool._opened == 1
+    pool.close()
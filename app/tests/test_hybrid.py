@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app.data_processing
+from app.context import Context
+from app.data_processing import search_topic
+from app.hybrid import LexicalSearch, fuse
+from app.models import DBSearchResponse
+from common.bm25 import BM25IndexWriter
+
+
+def response(*hits) -> DBSearchResponse:
+    return DBSearchResponse(items=[
+        {'id': i, 'distance': distance, 'entity': {'topic': 'business', 'text': text}}
+        for i, distance, text in hits
+    ])
+
+
+class FakeDatabase:
+    def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        return [response((1, 0.9, 'vector first'), (2, 0.8, 'both')) for _ in embeddings]
+
+
+class SlowLexicalSearch(LexicalSearch):
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(1)
+
+    def search(self, topic, queries: list[str]) -> list[DBSearchResponse]:
+        time.sleep(0.5)
+        return [response((3, 5.0, None)) for _ in queries]
+
+
+def test_hits_found_by_both_searches_rank_first():
+    fused = fuse([response((1, 0.9, 'a'), (2, 0.8, 'b')), response((2, 7.0, None), (3, 3.0, 'c'))], k=60, limit=3)
+    assert [item.id for item in fused.items] == [2, 1, 3]
+    # the text of the vector hit is kept
+    assert fused.items[0].entity.text == 'b'
+    assert fused.items[0].distance == 1 / 62 + 1 / 61
+    assert [item.id for item in fuse([response((1, 0.9, 'a'), (2, 0.8, 'b'))], limit=1).items] == [1]
+    # a weight above the other one moves the hits of its list up
+    weighted = fuse([response((1, 0.9, 'a')), response((3, 3.0, 'c'))], k=60, limit=2, weights=(1, 2))
+    assert [item.id for item in weighted.items] == [3, 1]
+
+
+def run_search(lexical) -> list[DBSearchResponse]:
+    async def main():
+        with ThreadPoolExecutor(1) as pool:
+            context = Context(
+                db=FakeDatabase(), io_pool=pool, http_client=None, logger=logging.getLogger('test'), lexical=lexical
+            )
+            return await search_topic('business', ['Bank of Pakistan (SBP)'], [[1.0]], context)
+
+    return asyncio.run(main())
+
+
+def test_search_fuses_lexical_hits(tmp_path):
+    writer = BM25IndexWriter(str(tmp_path))
+    writer.add('business', ids=[2, 5], texts=['both', 'State Bank of Pakistan (SBP)'])
+    writer.close()
+    [result] = run_search(LexicalSearch(str(tmp_path), limit=3))
+    assert [item.id for item in result.items] == [1, 5, 2]
+    assert result.items[1].entity.text == 'State Bank of Pakistan (SBP)'
+
+
+def test_slow_lexical_search_is_skipped(monkeypatch):
+    monkeypatch.setattr(app.data_processing, 'LEXICAL_SEARCH_TIMEOUT', 0.05)
+    lexical = SlowLexicalSearch()
+    started = time.perf_counter()
+    # the io pool has one thread, the lexical search runs on its own
+    [result] = run_search(lexical)
+    assert time.perf_counter() - started < 0.4
+    assert [item.id for item in result.items] == [1, 2]
+    lexical.close()
@@ -5,10 +5,13 @@ from dataclasses import dataclass
 from typing import Iterator
 
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
 from httpx import AsyncClient, ASGITransport
 
 import app.main
+from app.data_processing import create_llm_client
+from app.db import DatabasePool
 from app.main import app as fastapi_app
 
 client = TestClient(fastapi_app)
@@ -18,9 +21,19 @@ client = TestClient(fastapi_app)
 def setup_app():
     # lifespan doesn't work with TestClient
     app.main.logger = logging.getLogger('test')
+    app.main.db_pool = DatabasePool(size=1)
     with ThreadPoolExecutor(max_workers=1) as thread_pool:
         app.main.io_pool = thread_pool
         yield
+    app.main.db_pool.close()
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def setup_http_client():
+    # connections are bound to the event loop of the test
+    async with create_llm_client() as http_client:
+        app.main.http_client = http_client
+        yield
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+from pydantic import ValidationError
+from pymilvus import MilvusException
+from pymilvus.client.types import LoadState
+
+import app.db
+from app.models import Question
+from app.partitions import LoadedPartitions
+from app.topics import reset_known_topics, set_known_topics
+
+
+class FakeClient:
+    def __init__(self, partitions: list[str] = (), loaded: list[str] = ()):
+        self.partitions = ['_default', *partitions]
+        self.loaded = set(loaded)
+        self.calls = []
+        self.searches = []
+
+    def load_partitions(self, collection: str, partitions: list[str]) -> None:
+        self.calls.append(('load', *partitions))
+        self.loaded.update(partitions)
+
+    def release_partitions(self, collection: str, partitions: list[str]) -> None:
+        self.calls.append(('release', *partitions))
+        self.loaded.difference_update(partitions)
+
+    def get_load_state(self, collection: str, partition: str) -> dict:
+        return {'state': LoadState.Loaded if partition in self.loaded else LoadState.NotLoad}
+
+    def list_partitions(self, collection: str) -> list[str]:
+        return self.partitions
+
+    def search(self, partition_names: list[str], data: list, **kwargs) -> list:
+        if not self.loaded.issuperset(partition_names):
+            raise MilvusException(message='partition not loaded')
+        self.searches.append(partition_names)
+        return [[] for _ in data]
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def topics():
+    yield set_known_topics
+    reset_known_topics()
+
+
+def test_least_recently_used_partition_is_released():
+    client = FakeClient()
+    partitions = LoadedPartitions('articles', max_loaded=2)
+    for partition in ['a', 'b', 'a', 'c', 'a']:
+        with partitions.use(client, partition):
+            assert partition in client.loaded
+    assert client.calls == [('load', 'a'), ('load', 'b'), ('load', 'c'), ('release', 'b')]
+    assert partitions.loaded == ['c', 'a']
+
+
+def test_partition_in_use_is_not_released():
+    client = FakeClient()
+    partitions = LoadedPartitions('articles', max_loaded=1)
+    with partitions.use(client, 'a'):
+        with partitions.use(client, 'b'):
+            # both are searched, the limit is exceeded until one of them is done
+            assert client.loaded == {'a', 'b'}
+        with partitions.use(client, 'c'):
+            assert client.loaded == {'a', 'c'}
+    assert ('release', 'a') not in client.calls
+
+
+def test_concurrent_searches_load_a_partition_once():
+    client = FakeClient()
+    partitions = LoadedPartitions('articles', max_loaded=4)
+    start = threading.Barrier(8)
+
+    def search() -> None:
+        start.wait()
+        with partitions.use(client, 'a'):
+            pass
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.calls == [('load', 'a')]
+
+
+def test_sync_takes_over_loaded_partitions():
+    client = FakeClient(loaded=['a', 'b', 'c'])
+    partitions = LoadedPartitions('articles', max_loaded=2)
+    partitions.sync(client, ['a', 'b', 'c', 'd'])
+    assert client.calls == [('release', 'a')]
+    assert partitions.loaded == ['b', 'c']
+
+
+def test_pool_routes_searches_to_partitions(monkeypatch):
+    client = FakeClient(partitions=['topic_sports', 'topic_business'])
+    monkeypatch.setattr(app.db, 'MilvusClient', lambda **kwargs: client)
+    pool = app.db.DatabasePool(size=1)
+    assert sorted(pool.discover_topics()) == ['business', 'sports']
+
+    pool.search('sports', [[1.0]])
+    # released behind the back of the pool, the search is retried after loading it again
+    client.loaded.clear()
+    pool.search('sports', [[1.0]])
+    assert client.searches == [['topic_sports'], ['topic_sports']]
+    assert client.calls == [('load', 'topic_sports'), ('load', 'topic_sports')]
+
+
+def test_question_topic_is_checked_against_known_topics(topics):
+    assert Question(question='q', topic='Anything').topic == 'anything'
+    topics(['sports', 'business', 'world_news'])
+    assert Question(question='q', topic='World News').topic == 'world_news'
+    with pytest.raises(ValidationError):
+        Question(question='q', topic='weather')
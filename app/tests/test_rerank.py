@@ -0,0 +1,43 @@
+import asyncio
+import json
+import logging
+
+import httpx
+
+from app.context import Context
+from app.data_processing import rerank
+from app.models import DBSearchResponse
+
+
+def response(*texts) -> DBSearchResponse:
+    return DBSearchResponse(items=[
+        {'id': i, 'distance': 1 - i / 10, 'entity': {'topic': 'sports', 'text': text}}
+        for i, text in enumerate(texts)
+    ])
+
+
+def run_rerank(handler, queries: list[str], articles: list[DBSearchResponse], top_n: int) -> list[DBSearchResponse]:
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url='http://llm') as client:
+            context = Context(db=None, io_pool=None, http_client=client, logger=logging.getLogger('test'))
+            return await rerank(queries, articles, context, top_n=top_n)
+
+    return asyncio.run(main())
+
+
+def test_best_scored_passages_are_kept():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={'scores': [[0.1, 0.9, 0.5], [0.3]]})
+
+    result = run_rerank(handler, ['q1', 'q2'], [response('a', 'b', 'c'), response('d')], top_n=2)
+    assert requests == [{'items': ['q1', 'q2'], 'passages': [['a', 'b', 'c'], ['d']]}]
+    assert [[item.entity.text for item in r.items] for r in result] == [['b', 'c'], ['d']]
+    assert result[0].items[0].distance == 0.9
+
+
+def test_search_order_is_kept_when_reranking_fails():
+    result = run_rerank(lambda request: httpx.Response(503), ['q1'], [response('a', 'b', 'c')], top_n=2)
+    assert [item.entity.text for item in result[0].items] == ['a', 'b']
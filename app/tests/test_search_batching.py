@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.models import DBSearchResponse
+from app.search_batching import SearchCoalescer
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.calls = []
+
+    def search(self, topic: str, embeddings: list) -> list[DBSearchResponse]:
+        self.calls.append((topic, list(embeddings)))
+        return [
+            DBSearchResponse(items=[{'id': int(e[0]), 'distance': 1.0, 'entity': {'topic': topic}}])
+            for e in embeddings
+        ]
+
+
+def run_concurrently(coalescer: SearchCoalescer, searches: list[tuple[str, list]]) -> list:
+    async def main():
+        return await asyncio.gather(*(coalescer.search(topic, embeddings) for topic, embeddings in searches))
+
+    return asyncio.run(main())
+
+
+def ids(responses: list[DBSearchResponse]) -> list[int]:
+    return [response.items[0].id for response in responses]
+
+
+def test_searches_wait_for_the_one_in_flight():
+    db = FakeDatabase()
+    with ThreadPoolExecutor(2) as pool:
+        coalescer = SearchCoalescer(db.search, pool, max_batch_size=64, max_wait=10)
+        result = run_concurrently(coalescer, [
+            ('sports', [[1]]), ('business', [[2], [3]]), ('sports', [[4], [5]]), ('business', [[6]]), ('sports', [[7]]),
+        ])
+    # the first search of a topic goes right away, the next ones together after it
+    assert sorted(db.calls) == [
+        ('business', [[2], [3]]), ('business', [[6]]), ('sports', [[1]]), ('sports', [[4], [5], [7]]),
+    ]
+    assert [ids(r) for r in result] == [[1], [2, 3], [4, 5], [6], [7]]
+
+
+def test_flush_on_max_batch_size():
+    db = FakeDatabase()
+    with ThreadPoolExecutor(2) as pool:
+        coalescer = SearchCoalescer(db.search, pool, max_batch_size=2, max_wait=10)
+        result = run_concurrently(coalescer, [
+            ('sports', [[1]]), ('sports', [[2]]), ('sports', [[3]]), ('sports', [[4], [5]]),
+        ])
+    assert db.calls == [('sports', [[1]]), ('sports', [[2], [3]]), ('sports', [[4], [5]])]
+    assert [ids(r) for r in result] == [[1], [2], [3], [4, 5]]
+
+
+def test_flush_on_max_wait():
+    db = FakeDatabase()
+
+    def search(topic, embeddings):
+        if embeddings == [[1]]:
+            time.sleep(0.2)
+        return db.search(topic, embeddings)
+
+    async def main():
+        first = asyncio.create_task(coalescer.search('sports', [[1]]))
+        await asyncio.sleep(0)
+        second = await coalescer.search('sports', [[2]])
+        # the second search didn't wait for the slow one in flight
+        assert not first.done()
+        return ids(await first), ids(second)
+
+    with ThreadPoolExecutor(2) as pool:
+        coalescer = SearchCoalescer(search, pool, max_wait=0.01)
+        assert asyncio.run(main()) == ([1], [2])
+    assert db.calls == [('sports', [[2]]), ('sports', [[1]])]
+
+
+def test_errors_are_propagated():
+    def search(topic, embeddings):
+        raise ValueError('database is down')
+
+    with ThreadPoolExecutor(1) as pool:
+        coalescer = SearchCoalescer(search, pool, max_wait=0.001)
+        with pytest.raises(ValueError):
+            run_concurrently(coalescer, [('sports', [[1]]), ('sports', [[2]])])
+
+
+def test_short_responses_fail_the_batch():
+    def search(topic, embeddings):
+        return FakeDatabase().search(topic, embeddings[1:])
+
+    with ThreadPoolExecutor(1) as pool:
+        coalescer = SearchCoalescer(search, pool, max_wait=0.001)
+        with pytest.raises(ValueError):
+            run_concurrently(coalescer, [('sports', [[1], [2]])])
+
+
+def test_cancelled_batch_cancels_its_requests():
+    started = threading.Event()
+    release = threading.Event()
+
+    def search(topic, embeddings):
+        started.set()
+        release.wait()
+        return FakeDatabase().search(topic, embeddings)
+
+    async def main():
+        searches = [asyncio.ensure_future(coalescer.search('sports', [[i]])) for i in range(2)]
+        await asyncio.to_thread(started.wait)
+        for task in list(coalescer._tasks):
+            task.cancel()
+        result = await asyncio.gather(*searches, return_exceptions=True)
+        release.set()
+        return result
+
+    with ThreadPoolExecutor(1) as pool:
+        coalescer = SearchCoalescer(search, pool, max_batch_size=1, max_wait=10)
+        result = asyncio.run(main())
+    assert all(isinstance(r, asyncio.CancelledError) for r in result)
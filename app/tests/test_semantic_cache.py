@@ -0,0 +1,92 @@
+import asyncio
+
+from app.semantic_cache import SemanticCache
+from app.sse import format_event, parse_events
+
+
+def collect(stream) -> list[str]:
+    async def main():
+        return [text async for text in stream]
+
+    return asyncio.run(main())
+
+
+async def llm_stream():
+    yield format_event(0, ['Answer for q1', 'Answer for q2'])[:10]
+    yield format_event(0, ['Answer for q1', 'Answer for q2'])[10:]
+    yield format_event(1, ['a', 'b'])
+    yield format_event(2, ['c', []])
+
+
+def test_lookup_by_threshold():
+    cache = SemanticCache(max_items=10, threshold=0.9)
+    cache.store('sports', [1.0, 0.0], ['answer'])
+    assert cache.lookup('sports', [0.95, 0.05]) == ['answer']
+    assert cache.lookup('sports', [0.6, 0.8]) is None
+    assert cache.lookup('business', [1.0, 0.0]) is None
+
+
+def test_lru_eviction_and_invalidation():
+    cache = SemanticCache(max_items=2, threshold=0.9)
+    cache.store('sports', [1.0, 0.0], ['first'])
+    cache.store('sports', [0.0, 1.0], ['second'])
+    cache.lookup('sports', [1.0, 0.0])
+    cache.store('business', [1.0, 0.0], ['third'])
+    assert len(cache) == 2
+    assert cache.lookup('sports', [0.0, 1.0]) is None
+    assert cache.lookup('sports', [1.0, 0.0]) == ['first']
+
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.lookup('sports', [1.0, 0.0]) is None
+
+
+def test_store_and_replay_stream():
+    cache = SemanticCache(max_items=10, threshold=0.9)
+    topics = ['sports', 'business']
+    embeddings = [[1.0, 0.0], [0.0, 1.0]]
+    original = collect(cache.store_stream(llm_stream(), topics, embeddings))
+
+    answers = [cache.lookup(topic, emb) for topic, emb in zip(topics, embeddings)]
+    assert answers == [['Answer for q1', 'a', 'c'], ['Answer for q2', 'b']]
+    assert ''.join(collect(cache.cached_stream(answers))) == ''.join(original)
+
+
+def test_stream_across_invalidation_is_not_stored():
+    cache = SemanticCache(max_items=10, threshold=0.9)
+
+    async def stream():
+        yield format_event(0, ['Answer for q1'])
+        # the collection was rebuilt while the answer was generated
+        cache.invalidate()
+        yield format_event(1, [[]])
+
+    collect(cache.store_stream(stream(), ['sports'], [[1.0, 0.0]]))
+    assert len(cache) == 0
+    assert cache.lookup('sports', [1.0, 0.0]) is None
+
+
+def test_per_question_replay():
+    cache = SemanticCache(max_items=10, threshold=0.9)
+    answers = [['Answer for q1', 'a', 'c'], ['Answer for q2', 'b']]
+    stream = collect(cache.cached_stream(answers, per_question=True))
+    events = [(event.event, event.data) for event in parse_events(''.join(stream))]
+    assert events == [
+        ('delta', {'index': 0, 'text': 'Answer for q1'}),
+        ('delta', {'index': 1, 'text': 'Answer for q2'}),
+        ('delta', {'index': 0, 'text': 'a'}),
+        ('delta', {'index': 1, 'text': 'b'}),
+        ('delta', {'index': 0, 'text': 'c'}),
+        ('done', {'index': 1}),
+        ('done', {'index': 0}),
+    ]
+
+    topics = ['sports', 'business']
+    embeddings = [[1.0, 0.0], [0.0, 1.0]]
+
+    async def question_stream():
+        for text in stream:
+            yield text
+
+    collect(cache.store_stream(question_stream(), topics, embeddings))
+    assert [cache.lookup(topic, emb) for topic, emb in zip(topics, embeddings)] == answers
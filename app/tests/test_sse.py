@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app.sse import Event, SSEError, SSEParser, aiter_events, format_event, parse_events
+
+
+def test_any_split():
+    source = format_event(0, ['a', 'b']) + format_event(1, [[], 'c\n'])
+    expected = [Event(id=0, data=['a', 'b']), Event(id=1, data=[[], 'c\n'])]
+    for split in range(len(source) + 1):
+        parser = SSEParser()
+        events = parser.feed(source[:split]) + parser.feed(source[split:]) + parser.close()
+        assert events == expected
+
+
+def test_line_endings_comments_and_multiline_data():
+    source = ': ping\r\nevent: qasystem\r\nid: 3\r\ndata: [1,\r\ndata: 2]\r\n\r\nid: 4\rdata:[3]\r\r'
+    assert list(parse_events(source)) == [Event(id=3, data=[1, 2]), Event(id=4, data=[3], event='message')]
+
+
+def test_last_event_without_blank_line():
+    assert list(parse_events('id: 0\ndata: []')) == [Event(id=0, data=[], event='message')]
+
+
+def test_bounded_buffer():
+    parser = SSEParser(max_event_size=16)
+    parser.feed('id: 0\ndata: [')
+    with pytest.raises(SSEError):
+        parser.feed('1, 2, 3, 4, 5, 6')
+
+
+def test_aiter_events():
+    async def chunks():
+        for chunk in ['event: qasystem\nid: 0\nda', 'ta: ["a"]\n', '\nevent: qasystem\nid: 1\ndata: ["b"]\n\n']:
+            yield chunk
+
+    async def main():
+        return [event async for event in aiter_events(chunks())]
+
+    assert asyncio.run(main()) == [Event(id=0, data=['a']), Event(id=1, data=['b'])]
@@ -0,0 +1,35 @@
+from typing import Iterable
+
+from prometheus_client import Gauge
+
+from common.topics import normalize_topic
+
+TOPICS_KNOWN = Gauge('app_topics_known', 'Number of topics discovered in the database')
+
+# topics of the collection, discovered from the database at startup and after data_builder rebuilds it;
+# None until the first discovery succeeds, any topic is accepted then
+_known: frozenset[str] | None = None
+
+
+def set_known_topics(topics: Iterable[str]) -> None:
+    global _known
+    _known = frozenset(topics)
+    TOPICS_KNOWN.set(len(_known))
+
+
+def reset_known_topics() -> None:
+    global _known
+    _known = None
+
+
+def known_topics() -> list[str] | None:
+    return None if _known is None else sorted(_known)
+
+
+def validate_topic(topic: str) -> str:
+    topic = normalize_topic(topic)
+    if not topic:
+        raise ValueError('Topic is empty')
+    if _known is not None and topic not in _known:
+        raise ValueError(f'Unknown topic {topic!r}, expected one of: {", ".join(sorted(_known))}')
+    return topic
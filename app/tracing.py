@@ -0,0 +1,58 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from prometheus_client import Histogram
+
+from common.tracing import TRACE_HEADER, get_trace_id
+
+STAGE_LATENCY = Histogram(
+    'app_ask_stage_seconds',
+    'Duration of the stages of /ask processing',
+    ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+IO_QUEUE_WAIT = Histogram(
+    'app_io_pool_queue_wait_seconds',
+    'Time a task waits for a free thread of the io pool',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+ASK_BATCH_SIZE = Histogram(
+    'app_ask_batch_size',
+    'Number of questions per /ask request and per topic of a request',
+    ['scope'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+# Stage durations of one request. Stages of different topics run concurrently, so their durations are summed up
+# in the summary logged at the end of the request; the histograms get every stage separately.
+@dataclass
+class Trace:
+    trace_id: str = field(default_factory=get_trace_id)
+    stages: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {TRACE_HEADER: self.trace_id}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        STAGE_LATENCY.labels(stage).observe(seconds)
+        self.record(stage, seconds)
+
+    def record(self, stage: str, seconds: float) -> None:
+        # only for the summary, for stages with their own metrics
+        self.stages[stage] += seconds
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        return ' '.join(f'{stage}={seconds:.3f}s' for stage, seconds in self.stages.items())
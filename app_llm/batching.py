@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+from prometheus_client import Histogram
+from starlette.concurrency import run_in_threadpool
+
+ENCODE_BATCH_MAX_SIZE = int(os.getenv('ENCODE_BATCH_MAX_SIZE') or 64)
+ENCODE_BATCH_MAX_WAIT = float(os.getenv('ENCODE_BATCH_MAX_WAIT_MS') or 5) / 1000
+
+ENCODE_BATCH_SIZE = Histogram(
+    'app_llm_encode_batch_size',
+    'Number of items in one forward pass of the embedding model',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+ENCODE_QUEUE_DELAY = Histogram(
+    'app_llm_encode_queue_delay_seconds',
+    'Time an /encode request waits for its batch to be flushed',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+@dataclass
+class _Pending:
+    items: list
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+# Coalesces concurrent /encode requests into one model call.
+# A batch is flushed when it reaches `max_batch_size` items or when its first request waited `max_wait` seconds.
+# A batch whose wait ran out while another one is encoded is flushed when that one finishes, so model calls don't
+# compete for the CPU; only a full batch is encoded alongside.
+# Also batches the (question, passage) pairs of /rerank, with its own metrics.
+class EncodeBatcher:
+    def __init__(
+            self,
+            encode: Callable[[list], np.ndarray],
+            max_batch_size: int = ENCODE_BATCH_MAX_SIZE,
+            max_wait: float = ENCODE_BATCH_MAX_WAIT,
+            batch_size_metric: Histogram = ENCODE_BATCH_SIZE,
+            queue_delay_metric: Histogram = ENCODE_QUEUE_DELAY,
+    ):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._batch_size_metric = batch_size_metric
+        self._queue_delay_metric = queue_delay_metric
+        self._pending: list[_Pending] = []
+        self._pending_items = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    async def encode(self, items: list) -> np.ndarray:
+        if not items:
+            return np.empty((0, 0), dtype=np.float32)
+
+        loop = asyncio.get_running_loop()
+        pending = _Pending(items=items, future=loop.create_future())
+        self._pending.append(pending)
+        self._pending_items += len(items)
+        if self._pending_items >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._on_timer)
+        return await pending.future
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        if not self._in_flight:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_items = self._pending, [], 0
+        if batch:
+            self._in_flight += 1
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._in_flight -= 1
+        # requests whose wait ran out during the batch go now
+        if not self._in_flight and self._pending and self._timer is None:
+            self._flush()
+
+    async def _run(self, batch: list[_Pending]) -> None:
+        now = time.monotonic()
+        items = []
+        for pending in batch:
+            self._queue_delay_metric.observe(now - pending.enqueued)
+            items.extend(pending.items)
+        self._batch_size_metric.observe(len(items))
+
+        try:
+            vectors = await run_in_threadpool(self._encode, items)
+            if len(vectors) != len(items):
+                raise ValueError(f'{len(vectors)} vectors for {len(items)} items')
+        except BaseException as e:
+            # every request of the batch gets the error, the task itself ends quietly unless it was cancelled
+            for pending in batch:
+                if pending.future.done():
+                    continue
+                if isinstance(e, Exception):
+                    pending.future.set_exception(e)
+                else:
+                    pending.future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        offset = 0
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_result(vectors[offset: offset + len(pending.items)])
+            offset += len(pending.items)
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator
+
+from prometheus_client import Gauge, Histogram
+
+from app_llm.llm_model import LLMModel, Prompt
+
+LLM_STEP_LATENCY = Histogram(
+    'app_llm_generation_step_seconds',
+    'Duration of one generation step over the whole running batch',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+LLM_BATCH_OCCUPANCY = Histogram(
+    'app_llm_generation_batch_occupancy',
+    'Number of sequences in the running batch per generation step',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+LLM_RUNNING_SEQUENCES = Gauge('app_llm_generation_running_sequences', 'Number of sequences in the running batch')
+LLM_WAITING_REQUESTS = Gauge('app_llm_generation_waiting_requests', 'Number of requests waiting to join the batch')
+
+_DONE = object()
+
+
+@dataclass(eq=False)
+class _Request:
+    prompts: list[str | Prompt]
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    sequences: list[Iterator[str]] = field(default_factory=list)
+    # indexes of the sequences that are still generated
+    active: list[int] = field(default_factory=list)
+    first: bool = True
+    cancelled: bool = False
+    # items sent to the event loop and not taken by the client yet, guarded by the condition of the engine;
+    # the queue doesn't count the ones the event loop hasn't put into it
+    unread: int = 0
+
+    def send(self, item) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop of the request is closed
+            self.cancelled = True
+
+
+# Runs one step loop for all concurrent /llm_ask requests: every step decodes the running sequences of all requests
+# together. New prompts join the batch between steps, and a finished sequence leaves it right away.
+# A request whose client is `buffer` steps behind is skipped until the client catches up.
+class ContinuousBatchingEngine:
+    def __init__(self, llm_model: LLMModel, max_batch_size: int = 32, buffer: int = 4):
+        self.llm_model = llm_model
+        self.max_batch_size = max_batch_size
+        self.buffer = buffer
+        self._waiting: deque[_Request] = deque()
+        self._running: list[_Request] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='llm-continuous-batching', daemon=True)
+        self._thread.start()
+
+    async def ask(self, prompts: list[str | Prompt]) -> AsyncIterator[list]:
+        request = _Request(prompts=prompts, loop=asyncio.get_running_loop())
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Generation engine is closed')
+            self._waiting.append(request)
+            LLM_WAITING_REQUESTS.set(len(self._waiting))
+            self._condition.notify()
+        try:
+            while True:
+                response = await request.queue.get()
+                with self._condition:
+                    request.unread -= 1
+                    # the request may be stepped again
+                    self._condition.notify()
+                if response is _DONE:
+                    break
+                if isinstance(response, Exception):
+                    raise response
+                yield response
+        finally:
+            request.cancelled = True
+            self._wake()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _wake(self) -> None:
+        with self._condition:
+            self._condition.notify()
+
+    def _send(self, request: _Request, item) -> None:
+        with self._condition:
+            request.unread += 1
+        request.send(item)
+
+    def _occupancy(self) -> int:
+        return sum(len(request.active) for request in self._running)
+
+    def _admit(self) -> None:
+        occupancy = self._occupancy()
+        while self._waiting:
+            request = self._waiting[0]
+            if self._running and occupancy + len(request.prompts) > self.max_batch_size:
+                break
+            self._waiting.popleft()
+            if request.cancelled:
+                continue
+            if not request.prompts:
+                # nothing to generate, the answer is one empty step
+                self._send(request, [])
+                self._send(request, _DONE)
+                continue
+            request.sequences = [self.llm_model.generate(prompt) for prompt in request.prompts]
+            request.active = list(range(len(request.sequences)))
+            self._running.append(request)
+            occupancy += len(request.active)
+        LLM_WAITING_REQUESTS.set(len(self._waiting))
+        LLM_RUNNING_SEQUENCES.set(occupancy)
+
+    def _ready(self) -> bool:
+        # a running request can be stepped or has to be removed
+        return any(request.cancelled or request.unread < self.buffer for request in self._running)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        break
+                    self._admit()
+                    if self._ready():
+                        break
+                    # every running request waits for its client, or there is no work
+                    self._condition.wait()
+                if self._closed:
+                    break
+            self._step()
+
+        for request in [*self._running, *self._waiting]:
+            request.send(RuntimeError('Generation engine is closed'))
+
+    def _step(self) -> None:
+        batch: list[tuple[_Request, int]] = []
+        with self._condition:
+            for request in list(self._running):
+                if request.cancelled:
+                    self._running.remove(request)
+                elif request.unread < self.buffer:
+                    batch.extend((request, index) for index in request.active)
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        try:
+            chunks = self.llm_model.decode([request.sequences[index] for request, index in batch])
+        except Exception as e:
+            for request in dict.fromkeys(request for request, _ in batch):
+                self._running.remove(request)
+                self._send(request, e)
+            return
+        LLM_STEP_LATENCY.observe(time.perf_counter() - started)
+        LLM_BATCH_OCCUPANCY.observe(len(batch))
+
+        responses: dict[_Request, list] = {}
+        for (request, index), chunk in zip(batch, chunks):
+            response = responses.setdefault(request, [[] for _ in request.sequences])
+            response[index] = chunk
+            if chunk == []:
+                request.active.remove(index)
+        for request, response in responses.items():
+            first, request.first = request.first, False
+            if not first and not any(response):
+                self._running.remove(request)
+                self._send(request, _DONE)
+            else:
+                self._send(request, response)
+        LLM_RUNNING_SEQUENCES.set(self._occupancy())
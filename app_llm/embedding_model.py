@@ -0,0 +1,64 @@
+import argparse
+import os
+import time
+from typing import Callable
+
+import numpy as np
+import torch
+from prometheus_client import Gauge
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL') or 'all-MiniLM-L6-v2'
+# a directory saved with `python -m app_llm.embedding_model --save <dir>`, the model is not downloaded then
+EMBEDDING_MODEL_PATH = os.getenv('EMBEDDING_MODEL_PATH')
+# dynamic int8 quantization of the linear layers, CPU only
+EMBEDDING_QUANTIZE = (os.getenv('EMBEDDING_QUANTIZE') or '').lower() in ('1', 'true', 'yes')
+# items encoded before the application reports ready, 0 disables the warm-up
+ENCODE_WARMUP_BATCH = int(os.getenv('ENCODE_WARMUP_BATCH') or 32)
+
+STARTUP_TIME = Gauge('app_llm_startup_seconds', 'Duration of the startup phases of the application', ['phase'])
+
+
+def quantize(model: torch.nn.Module) -> torch.nn.Module:
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_embedding_model(
+        name: str = EMBEDDING_MODEL, path: str | None = EMBEDDING_MODEL_PATH, quantized: bool = EMBEDDING_QUANTIZE
+) -> SentenceTransformer:
+    started = time.perf_counter()
+    if path and os.path.isdir(path):
+        model = SentenceTransformer(model_name_or_path=path, device='cpu', local_files_only=True)
+    else:
+        model = SentenceTransformer(model_name_or_path=name, device='cpu')
+    STARTUP_TIME.labels('load').set(time.perf_counter() - started)
+
+    if quantized:
+        started = time.perf_counter()
+        model = quantize(model)
+        STARTUP_TIME.labels('quantize').set(time.perf_counter() - started)
+    return model
+
+
+def warm_up(
+        encode: Callable[[list[str]], np.ndarray], batch_size: int = ENCODE_WARMUP_BATCH, phase: str = 'warmup'
+) -> None:
+    # the first forward passes allocate buffers and pick kernels, one small and one full batch cover both paths
+    if batch_size <= 0:
+        return
+    started = time.perf_counter()
+    encode(['warm-up'])
+    encode([f'warm-up sentence number {i}' for i in range(batch_size)])
+    STARTUP_TIME.labels(phase).set(time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', required=True, help='directory to save the model to, see EMBEDDING_MODEL_PATH')
+    parser.add_argument('--model', default=EMBEDDING_MODEL)
+    args = parser.parse_args()
+    SentenceTransformer(model_name_or_path=args.model, device='cpu').save(args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,56 @@
 import logging
 from dataclasses import dataclass
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from sentence_transformers import SentenceTransformer
 
-from app_llm.llm_model import LLMModel
+from app_llm.batching import EncodeBatcher
+from app_llm.llm_model import LLMModel, Prompt
+from app_llm.llm_runner import LLMRunner
+from app_llm.reranker import Reranker
+from common.embedding_cache import EmbeddingCache
 
 
 @dataclass
 class Context:
     embedding_model: SentenceTransformer
+    encoder: EncodeBatcher
     llm_model: LLMModel
+    llm_runner: LLMRunner
     logger: logging.Logger
+    embedding_cache: EmbeddingCache | None = None
+    # disabled unless RERANK_MODEL is set
+    reranker: Reranker | None = None
 
 
 class LLMRequest(BaseModel):
     items: list[str]
+
+
+# /llm_ask takes prompts in the free-text format, or, with `articles`, the bare questions and the articles
+# of every question, which need no parsing
+class LLMAskRequest(LLMRequest):
+    articles: list[list[str]] | None = None
+
+    @model_validator(mode='after')
+    def check_articles(self) -> 'LLMAskRequest':
+        if self.articles is not None and len(self.articles) != len(self.items):
+            raise ValueError('articles must have an entry for every item')
+        return self
+
+    @property
+    def prompts(self) -> list[str | Prompt]:
+        if self.articles is None:
+            return list(self.items)
+        return [Prompt(query=query, articles=articles) for query, articles in zip(self.items, self.articles)]
+
+
+# /rerank scores every passage of `passages[i]` against the question `items[i]`
+class RerankRequest(LLMRequest):
+    passages: list[list[str]]
+
+    @model_validator(mode='after')
+    def check_passages(self) -> 'RerankRequest':
+        if len(self.passages) != len(self.items):
+            raise ValueError('passages must have an entry for every item')
+        return self
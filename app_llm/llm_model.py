@@ -1,7 +1,29 @@
 import random
 import re
+from dataclasses import dataclass, field
 from typing import Iterator
 
+# both tags in one scan; as before, a tag and its content are on one line
+_TAG = re.compile('<(input|article)>(.+)</\\1>')
+
+
+@dataclass
+class Prompt:
+    query: str | None
+    articles: list[str] = field(default_factory=list)
+
+
+def parse_prompt(text: str) -> Prompt:
+    # the free-text format: the first <input> is the query, every <article> is an article
+    prompt = Prompt(query=None)
+    for match in _TAG.finditer(text):
+        tag, content = match.groups()
+        if tag == 'article':
+            prompt.articles.append(content)
+        elif prompt.query is None:
+            prompt.query = content
+    return prompt
+
 
 class LLMModel:
     def __init__(self, seed):
@@ -13,29 +35,36 @@ class LLMModel:
         for i in range(n):
             t += t / (t + 1)
 
-    def ask(self, prompts: list[str]) -> Iterator[list[str]]:
-        # yes, we are parsing the message we just made, but this is done intentionally
-        response = []
-        for prompt in prompts:
-            match = re.compile('<input>(.+)</input>').search(prompt)
-            if match is None:
-                self._cpu_load(10000000)
-                response.append("I don't know what to say..")
-            else:
-                response.append(f'Answer for question "{match.group(1)}" is:')
-        yield response
-        iters = [re.compile('<article>(.+)</article>').finditer(prompt) for prompt in prompts]
-        while True:
-            response = []
-            for iterator in iters:
-                if (match := next(iterator, None)) is None:
-                    response.append([])
-                    continue
-                article = match.group(1)
-                start = random.randint(0, max(len(article) - 1, 0))
-                stop = random.randint(start + 1, start + 128)
-                response.append(article[start: stop])
-                self._cpu_load(1_000_000)
-            if not any(response):
-                break
+    def generate(self, prompt: str | Prompt) -> Iterator[str]:
+        if isinstance(prompt, str):
+            prompt = parse_prompt(prompt)
+        if prompt.query is None:
+            self._cpu_load(10000000)
+            yield "I don't know what to say.."
+        else:
+            yield f'Answer for question "{prompt.query}" is:'
+        for article in prompt.articles:
+            start = random.randint(0, max(len(article) - 1, 0))
+            stop = random.randint(start + 1, start + 128)
+            self._cpu_load(1_000_000)
+            yield article[start: stop]
+
+    @staticmethod
+    def decode(sequences: list[Iterator[str]]) -> list:
+        # one step of every sequence, [] for a finished one
+        return [next(sequence, []) for sequence in sequences]
+
+    def step(self, sequences: list[Iterator[str]], first: bool) -> list | None:
+        if first:
+            return [next(sequence) for sequence in sequences]
+        response = self.decode(sequences)
+        if not any(response):
+            return None
+        return response
+
+    def ask(self, prompts: list[str | Prompt]) -> Iterator[list[str]]:
+        sequences = [self.generate(prompt) for prompt in prompts]
+        response = self.step(sequences, first=True)
+        while response is not None:
             yield response
+            response = self.step(sequences, first=False)
@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Protocol
+
+from starlette.concurrency import iterate_in_threadpool
+
+from app_llm.continuous_batching import ContinuousBatchingEngine
+from app_llm.llm_model import LLMModel, Prompt
+
+LLM_EXECUTION_MODE = os.getenv('LLM_EXECUTION_MODE') or 'inline'
+LLM_WORKERS = int(os.getenv('LLM_WORKERS') or os.cpu_count() or 1)
+# number of generated steps a request may be ahead of its client
+LLM_STREAM_BUFFER = int(os.getenv('LLM_STREAM_BUFFER') or 4)
+# max number of prompts generated together in the continuous mode
+LLM_MAX_BATCH_SIZE = int(os.getenv('LLM_MAX_BATCH_SIZE') or 32)
+
+_DONE = 'done'
+
+_worker_model: LLMModel | None = None
+_worker_results = None
+_worker_credits: list = []
+_worker_cancelled: list = []
+
+
+class LLMRunner(Protocol):
+    def ask(self, prompts: list[str | Prompt]) -> AsyncIterator[list]:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class InlineRunner:
+    def __init__(self, llm_model: LLMModel):
+        self.llm_model = llm_model
+
+    async def ask(self, prompts: list[str | Prompt]) -> AsyncIterator[list]:
+        async for response in iterate_in_threadpool(self.llm_model.ask(prompts)):
+            yield response
+
+    def close(self) -> None:
+        pass
+
+
+def _init_worker(seed: int, counter, results, credits, cancelled) -> None:
+    global _worker_model, _worker_results, _worker_credits, _worker_cancelled
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+    _worker_model = LLMModel(seed=seed)
+    _worker_results, _worker_credits, _worker_cancelled = results, credits, cancelled
+
+
+def _put(slot: int, serial: int, item) -> bool:
+    # blocks while the client is `buffer` steps behind, but gives up as soon as it has gone
+    while not _worker_cancelled[slot].is_set():
+        if _worker_credits[slot].acquire(timeout=0.1):
+            _worker_results.put((serial, item))
+            return True
+    return False
+
+
+def _generate(prompts: list[str | Prompt], slot: int, serial: int) -> None:
+    try:
+        for response in _worker_model.ask(prompts):
+            if not _put(slot, serial, response):
+                return
+    except Exception as e:
+        _put(slot, serial, e)
+    _put(slot, serial, _DONE)
+
+
+@dataclass
+class _Stream:
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+
+    def send(self, item) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop of the request is closed
+            pass
+
+
+# Worker slots of the pool: a request waits for a free slot without holding a thread, and the slot is returned by
+# the executor thread once its worker has stopped.
+class _Slots:
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self._free = list(range(size))
+        self._waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    async def acquire(self) -> int:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over right before the cancellation
+                self.release(future.result())
+            raise
+
+    def release(self, slot: int) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, future, slot)
+                    return
+                except RuntimeError:
+                    # the event loop of the waiter is closed
+                    continue
+            self._free.append(slot)
+
+    def _hand_over(self, future: asyncio.Future, slot: int) -> None:
+        if future.done():
+            self.release(slot)
+        else:
+            future.set_result(slot)
+
+
+# Runs LLMModel.ask in worker processes pinned to cores, so generation doesn't compete for the GIL of the server.
+# Every running request has a slot: a semaphore of `buffer` credits and a cancellation event shared with the workers.
+# Steps of all workers come back through one queue, which a single reader thread fans out to the requests.
+class ProcessPoolRunner:
+    def __init__(self, seed: int, workers: int = LLM_WORKERS, buffer: int = LLM_STREAM_BUFFER):
+        mp_context = multiprocessing.get_context('spawn')
+        self.buffer = buffer
+        self._results = mp_context.Queue()
+        self._credits = [mp_context.Semaphore(buffer) for _ in range(workers)]
+        self._cancelled = [mp_context.Event() for _ in range(workers)]
+        self._slots = _Slots(workers)
+        self._streams: dict[int, _Stream] = {}
+        self._serials = itertools.count()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(seed, mp_context.Value('i', 0), self._results, self._credits, self._cancelled),
+        )
+        self._reader = threading.Thread(target=self._read, name='llm-process-reader', daemon=True)
+        self._reader.start()
+
+    async def ask(self, prompts: list[str | Prompt]) -> AsyncIterator[list]:
+        slot = await self._slots.acquire()
+        serial = next(self._serials)
+        stream = self._streams[serial] = _Stream(loop=asyncio.get_running_loop())
+        try:
+            future = self._executor.submit(_generate, prompts, slot, serial)
+        except BaseException:
+            del self._streams[serial]
+            self._slots.release(slot)
+            raise
+        try:
+            while True:
+                response = await stream.queue.get()
+                self._credits[slot].release()
+                if response == _DONE:
+                    break
+                if isinstance(response, Exception):
+                    raise response
+                yield response
+        finally:
+            del self._streams[serial]
+            if not future.done():
+                # the client has disconnected: stop the worker
+                self._cancelled[slot].set()
+                future.cancel()
+            # the credits are not released by this request anymore, the slot is reset when the worker has stopped
+            future.add_done_callback(lambda _: self._reset(slot))
+
+    def _reset(self, slot: int) -> None:
+        credits = self._credits[slot]
+        while credits.acquire(block=False):
+            pass
+        for _ in range(self.buffer):
+            credits.release()
+        self._cancelled[slot].clear()
+        self._slots.release(slot)
+
+    def _read(self) -> None:
+        while True:
+            serial, item = self._results.get()
+            if serial is None:
+                break
+            stream = self._streams.get(serial)
+            # steps of a cancelled request are dropped
+            if stream is not None:
+                stream.send(item)
+
+    def close(self) -> None:
+        for cancelled in self._cancelled:
+            cancelled.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._results.put((None, None))
+        self._reader.join()
+
+
+def create_llm_runner(llm_model: LLMModel, seed: int) -> LLMRunner:
+    if LLM_EXECUTION_MODE == 'inline':
+        return InlineRunner(llm_model)
+    if LLM_EXECUTION_MODE == 'process':
+        return ProcessPoolRunner(seed=seed)
+    if LLM_EXECUTION_MODE == 'continuous':
+        return ContinuousBatchingEngine(llm_model, max_batch_size=LLM_MAX_BATCH_SIZE, buffer=LLM_STREAM_BUFFER)
+    raise ValueError(f'Unknown LLM_EXECUTION_MODE: {LLM_EXECUTION_MODE}')
@@ -4,15 +4,23 @@ from typing import Annotated
 
 import ujson
 import uvicorn
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from prometheus_fastapi_instrumentator import Instrumentator
 from sentence_transformers import SentenceTransformer
 
-from app_llm.entities import LLMRequest, Context
+from app_llm.batching import EncodeBatcher
+from app_llm.embedding_model import load_embedding_model, warm_up
+from app_llm.entities import LLMAskRequest, LLMRequest, RerankRequest, Context
 from app_llm.llm_model import LLMModel
-from common import setup_logging
+from app_llm.llm_runner import LLMRunner, create_llm_runner
+from app_llm.reranker import Reranker, create_reranker
+from common import setup_logging, shutdown_logging
+from common.embedding_cache import EmbeddingCache, aencode_with_cache, create_embedding_cache
+from common.embedding_format import NPY_MEDIA_TYPE, accepts_npy, dump_npy
+from common.tracing import TraceMiddleware
 
 
 class TextEventStreamResponse(StreamingResponse):
@@ -20,28 +28,48 @@ class TextEventStreamResponse(StreamingResponse):
 
 
 model: SentenceTransformer
+encoder: EncodeBatcher
 llm_model: LLMModel
+llm_runner: LLMRunner
+# optional, disabled unless EMBEDDING_CACHE_SIZE is set
+embedding_cache: EmbeddingCache | None = None
+# optional, disabled unless RERANK_MODEL is set
+reranker: Reranker | None = None
+ready = False
 logger: logging.Logger
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    global model, llm_model, logger
+    global model, encoder, llm_model, llm_runner, embedding_cache, reranker, ready, logger
 
-    model = SentenceTransformer(
-        model_name_or_path='all-MiniLM-L6-v2',
-        device='cpu',
-    )
+    model = load_embedding_model()
+    # the replica reports ready only after the first forward passes
+    warm_up(model.encode)
+    encoder = EncodeBatcher(model.encode)
+    reranker = create_reranker()
     llm_model = LLMModel(seed=14)
+    llm_runner = create_llm_runner(llm_model, seed=14)
+    embedding_cache = create_embedding_cache('app_llm', default_size=0)
     logger = setup_logging('app_llm')
-    yield
+    ready = True
+    try:
+        yield
+    finally:
+        ready = False
+        llm_runner.close()
+        shutdown_logging()
 
 
 def get_session() -> Context:
     return Context(
         embedding_model=model,
+        encoder=encoder,
         llm_model=llm_model,
+        llm_runner=llm_runner,
         logger=logger,
+        embedding_cache=embedding_cache,
+        reranker=reranker,
     )
 
 
@@ -51,6 +79,8 @@ app = FastAPI(lifespan=lifespan)
 
 instrumentator = Instrumentator().instrument(app).expose(app)
 
+app.add_middleware(TraceMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -60,23 +90,55 @@ app.add_middleware(
 )
 
 
+@app.get("/ready")
+async def readiness() -> JSONResponse:
+    # for orchestrators: the model is loaded and warmed up
+    if not ready:
+        return JSONResponse({'status': 'starting'}, status_code=503)
+    return JSONResponse({'status': 'ready'})
+
+
 @app.post("/encode")
-def encode(data: LLMRequest, context: ContextDep) -> list[list[float]]:
+async def encode(
+        data: LLMRequest, context: ContextDep, accept: Annotated[str | None, Header()] = None
+) -> list[list[float]]:
     context.logger.info('request /encode: %u items', len(data.items))
-    return context.embedding_model.encode(data.items).tolist()
+    if context.embedding_cache is None:
+        vectors = await context.encoder.encode(data.items)
+    else:
+        vectors = await aencode_with_cache(context.embedding_cache, data.items, context.encoder.encode)
+    if accepts_npy(accept):
+        # float32 matrix in the .npy format, JSON stays the default for other clients
+        return Response(content=dump_npy(vectors), media_type=NPY_MEDIA_TYPE)
+    return [vector.tolist() for vector in vectors]
+
+
+@app.post("/rerank")
+async def rerank(data: RerankRequest, context: ContextDep) -> JSONResponse:
+    if context.reranker is None:
+        return JSONResponse({'detail': 'RERANK_MODEL is not set'}, status_code=503)
+    context.logger.info('request /rerank: %u items', len(data.items))
+    return JSONResponse({'scores': await context.reranker.score(data.items, data.passages)})
 
 
 @app.post("/llm_ask", response_class=TextEventStreamResponse)
-def ask(query: LLMRequest, context: ContextDep) -> StreamingResponse:
-    def gen_response():
-        for i, response in enumerate(context.llm_model.ask(query.items)):
-            context.logger.info('/ask: sent part №%u', i)
+async def ask(query: LLMAskRequest, context: ContextDep) -> StreamingResponse:
+    prompts = query.prompts
+
+    async def gen_response():
+        i = 0
+        async for response in context.llm_runner.ask(prompts):
+            # sampled, see LOG_DEBUG_SAMPLE_RATE
+            context.logger.debug('/ask: sent part №%u', i)
             yield (f'event: qasystem\n'
                    f'id: {i}\n'
                    f'data: {ujson.dumps(response)}\n\n')
+            i += 1
 
-    context.logger.info('/ask: %u items', len(query.items))
-    return StreamingResponse(gen_response(), media_type="text/event-stream")
+    context.logger.info('/ask: %u items', len(prompts))
+    # closed right away when the client disconnects, so the generation stops
+    stream = gen_response()
+    return StreamingResponse(stream, media_type="text/event-stream", background=BackgroundTask(stream.aclose))
 
 
 if __name__ == "__main__":
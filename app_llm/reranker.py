@@ -0,0 +1,123 @@
+import argparse
+import hashlib
+import os
+import time
+from typing import Callable
+
+import numpy as np
+from prometheus_client import Histogram
+from sentence_transformers import CrossEncoder
+
+from app_llm.batching import EncodeBatcher
+from app_llm.embedding_model import STARTUP_TIME, quantize, warm_up
+from common.embedding_cache import EmbeddingCache, aencode_with_cache
+
+# a small cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2; /rerank is disabled when neither is set
+RERANK_MODEL = os.getenv('RERANK_MODEL')
+# a directory saved with `python -m app_llm.reranker --save <dir>`, the model is not downloaded then
+RERANK_MODEL_PATH = os.getenv('RERANK_MODEL_PATH')
+RERANK_QUANTIZE = (os.getenv('RERANK_QUANTIZE') or '').lower() in ('1', 'true', 'yes')
+# tokens of a (question, passage) pair, longer passages are truncated
+RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH') or 256)
+RERANK_BATCH_MAX_SIZE = int(os.getenv('RERANK_BATCH_MAX_SIZE') or 64)
+RERANK_BATCH_MAX_WAIT = float(os.getenv('RERANK_BATCH_MAX_WAIT_MS') or 5) / 1000
+# scores of recent pairs, 0 disables the cache
+RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE') or 100000)
+RERANK_CACHE_TTL = float(os.getenv('RERANK_CACHE_TTL') or 3600)
+
+RERANK_BATCH_SIZE = Histogram(
+    'app_llm_rerank_batch_size',
+    'Number of (question, passage) pairs in one forward pass of the cross-encoder',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+RERANK_QUEUE_DELAY = Histogram(
+    'app_llm_rerank_queue_delay_seconds',
+    'Time a /rerank request waits for its batch to be flushed',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+Pair = tuple[str, str]
+
+
+def load_cross_encoder(
+        name: str | None = RERANK_MODEL, path: str | None = RERANK_MODEL_PATH, quantized: bool = RERANK_QUANTIZE
+) -> CrossEncoder:
+    started = time.perf_counter()
+    if path and os.path.isdir(path):
+        model = CrossEncoder(path, device='cpu', max_length=RERANK_MAX_LENGTH, local_files_only=True)
+    else:
+        model = CrossEncoder(name, device='cpu', max_length=RERANK_MAX_LENGTH)
+    STARTUP_TIME.labels('rerank_load').set(time.perf_counter() - started)
+
+    if quantized:
+        model.model = quantize(model.model)
+    return model
+
+
+def pair_key(query: str, passage: str) -> str:
+    # passages are long, the cache keeps a digest of the pair
+    text = ' '.join(query.split()).lower() + '\0' + passage
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Scores (question, passage) pairs. Pairs of concurrent requests share a forward pass, and the scores of the pairs
+# seen recently are taken from the cache.
+class Reranker:
+    def __init__(
+            self,
+            score: Callable[[list[Pair]], np.ndarray],
+            cache: EmbeddingCache | None = None,
+            max_batch_size: int = RERANK_BATCH_MAX_SIZE,
+            max_wait: float = RERANK_BATCH_MAX_WAIT,
+    ):
+        self._batcher = EncodeBatcher(
+            score, max_batch_size, max_wait, batch_size_metric=RERANK_BATCH_SIZE, queue_delay_metric=RERANK_QUEUE_DELAY
+        )
+        self._cache = cache
+
+    async def score(self, queries: list[str], passages: list[list[str]]) -> list[list[float]]:
+        pairs = [(query, passage) for query, q_passages in zip(queries, passages) for passage in q_passages]
+        if self._cache is None:
+            scores = await self._batcher.encode(pairs)
+        else:
+            keys = [pair_key(*pair) for pair in pairs]
+            by_key = dict(zip(keys, pairs))
+            scores = await aencode_with_cache(
+                self._cache, keys, lambda misses: self._batcher.encode([by_key[key] for key in misses])
+            )
+
+        result = []
+        offset = 0
+        for q_passages in passages:
+            result.append([float(score) for score in scores[offset: offset + len(q_passages)]])
+            offset += len(q_passages)
+        return result
+
+
+def create_reranker() -> Reranker | None:
+    if not (RERANK_MODEL or RERANK_MODEL_PATH):
+        return None
+    model = load_cross_encoder()
+
+    def score(pairs: list[Pair]) -> np.ndarray:
+        scores = model.predict(pairs, batch_size=max(len(pairs), 1), show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(scores, dtype=np.float32)
+
+    warm_up(lambda texts: score([(text, text) for text in texts]), phase='rerank_warmup')
+    cache = None
+    if RERANK_CACHE_SIZE > 0:
+        # an entry is a digest and a float32 score, the number of entries is the limit
+        cache = EmbeddingCache('rerank', max_items=RERANK_CACHE_SIZE, ttl=RERANK_CACHE_TTL, max_bytes=2 ** 31)
+    return Reranker(score, cache)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', required=True, help='directory to save the model to, see RERANK_MODEL_PATH')
+    parser.add_argument('--model', default=RERANK_MODEL or 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+    args = parser.parse_args()
+    CrossEncoder(args.model, device='cpu').save(args.save)
+
+
+if __name__ == '__main__':
+    main()
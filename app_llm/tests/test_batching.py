@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from app_llm.batching import EncodeBatcher
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, items: list[str]) -> np.ndarray:
+        self.calls.append(list(items))
+        return np.array([[float(len(item))] for item in items])
+
+
+def run_concurrently(batcher: EncodeBatcher, requests: list[list[str]]) -> list:
+    async def main():
+        return await asyncio.gather(*(batcher.encode(items) for items in requests))
+
+    return asyncio.run(main())
+
+
+def test_requests_share_a_batch():
+    model = FakeModel()
+    batcher = EncodeBatcher(model.encode, max_batch_size=64, max_wait=0.01)
+    result = run_concurrently(batcher, [['a'], ['bb', 'ccc'], ['dddd']])
+    assert model.calls == [['a', 'bb', 'ccc', 'dddd']]
+    assert [r.tolist() for r in result] == [[[1.0]], [[2.0], [3.0]], [[4.0]]]
+
+
+def test_flush_on_max_batch_size():
+    model = FakeModel()
+    batcher = EncodeBatcher(model.encode, max_batch_size=2, max_wait=10)
+    result = run_concurrently(batcher, [['a'], ['b'], ['c', 'd']])
+    assert model.calls == [['a', 'b'], ['c', 'd']]
+    assert [r.tolist() for r in result] == [[[1.0]], [[1.0]], [[1.0], [1.0]]]
+
+
+def test_empty_request():
+    model = FakeModel()
+    batcher = EncodeBatcher(model.encode)
+    result = run_concurrently(batcher, [[]])
+    assert result[0].tolist() == []
+    assert model.calls == []
+
+
+def test_errors_are_propagated():
+    def encode(_):
+        raise ValueError('broken model')
+
+    batcher = EncodeBatcher(encode, max_batch_size=64, max_wait=0.001)
+
+    async def main():
+        return await asyncio.gather(batcher.encode(['a']), batcher.encode(['b']), return_exceptions=True)
+
+    result = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in result)
+
+
+def test_failed_batch_leaves_no_task_behind():
+    errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda _, context: errors.append(context))
+        batcher = EncodeBatcher(lambda items: np.zeros((len(items) - 1, 1)), max_batch_size=64, max_wait=0.001)
+        result = await asyncio.gather(batcher.encode(['a']), batcher.encode(['b']), return_exceptions=True)
+        await asyncio.sleep(0)
+        return result, batcher
+
+    result, batcher = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in result)
+    assert not batcher._tasks
+    assert errors == []
+
+
+def test_cancelled_batch_cancels_its_requests():
+    started = threading.Event()
+    release = threading.Event()
+
+    def encode(items):
+        started.set()
+        release.wait()
+        return np.zeros((len(items), 1))
+
+    async def main():
+        batcher = EncodeBatcher(encode, max_batch_size=2, max_wait=10)
+        requests = [asyncio.ensure_future(batcher.encode([item])) for item in 'ab']
+        await asyncio.to_thread(started.wait)
+        for task in list(batcher._tasks):
+            task.cancel()
+        result = await asyncio.gather(*requests, return_exceptions=True)
+        release.set()
+        return result
+
+    result = asyncio.run(main())
+    assert all(isinstance(r, asyncio.CancelledError) for r in result)
+
+
+def test_timed_out_batch_waits_for_the_running_one():
+    running = []
+    calls = []
+
+    def encode(items):
+        running.append(items)
+        calls.append((list(items), len(running)))
+        time.sleep(0.1 if items in (['a'], ['d']) else 0)
+        running.remove(items)
+        return np.zeros((len(items), 1))
+
+    async def main():
+        batcher = EncodeBatcher(encode, max_batch_size=3, max_wait=0.01)
+        first = asyncio.ensure_future(batcher.encode(['a']))
+        await asyncio.sleep(0.02)
+        second = asyncio.ensure_future(batcher.encode(['b']))
+        # the wait of ['b'] runs out while ['a'] is encoded
+        await asyncio.sleep(0.02)
+        await asyncio.gather(first, second, batcher.encode(['c']))
+
+        third = asyncio.ensure_future(batcher.encode(['d']))
+        await asyncio.sleep(0.02)
+        await asyncio.gather(third, batcher.encode(['e', 'f', 'g']))
+
+    asyncio.run(main())
+    # a full batch doesn't wait
+    assert calls == [(['a'], 1), (['b', 'c'], 1), (['d'], 1), (['e', 'f', 'g'], 2)]
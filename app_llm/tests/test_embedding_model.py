@@ -0,0 +1,23 @@
+import torch
+
+from app_llm.embedding_model import quantize, warm_up
+
+
+def test_quantize():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.ReLU(), torch.nn.Linear(64, 8))
+    quantized = quantize(model)
+    assert isinstance(model[0], torch.nn.Linear)
+    assert not isinstance(quantized[0], torch.nn.Linear)
+    x = torch.randn(4, 64)
+    assert torch.allclose(model(x), quantized(x), atol=0.05)
+
+
+def test_warm_up():
+    batches = []
+    warm_up(batches.append, batch_size=4)
+    assert [len(batch) for batch in batches] == [1, 4]
+
+    batches.clear()
+    warm_up(batches.append, batch_size=0)
+    assert batches == []
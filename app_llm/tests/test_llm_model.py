@@ -1,6 +1,6 @@
 import pytest
 
-from app_llm.llm_model import LLMModel
+from app_llm.llm_model import LLMModel, Prompt, parse_prompt
 
 
 @pytest.mark.parametrize('num_queries', [1, 2, 8])
@@ -11,3 +11,18 @@ def test_with_valid_prompt(num_queries):
     assert len(response) > 1  # test response was split on chunks
     for chunk in response:
         assert len(chunk) == num_queries
+
+
+def test_parse_prompt():
+    prompt = parse_prompt(
+        'The query is enclosed in <input></input> tags.\n'
+        'Input:\n<input>question</input>\n<article>first</article>\n<article>second</article>\n<input>other</input>'
+    )
+    assert prompt == Prompt(query='question', articles=['first', 'second'])
+    assert parse_prompt('hello') == Prompt(query=None)
+
+
+def test_structured_prompt_is_answered_like_text():
+    text = '<input>question</input>\n<article>first article</article>\n<article>second article</article>'
+    structured = Prompt(query='question', articles=['first article', 'second article'])
+    assert list(LLMModel(14).ask([text])) == list(LLMModel(14).ask([structured]))
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+
+from app_llm.continuous_batching import ContinuousBatchingEngine
+from app_llm.llm_model import LLMModel
+from app_llm.llm_runner import InlineRunner, ProcessPoolRunner
+
+PROMPTS = ['<input>?</input><article>Article from topic</article><article>Another article</article>', 'hello']
+
+
+async def collect(runner, prompts: list[str]) -> list:
+    return [response async for response in runner.ask(prompts)]
+
+
+@pytest.fixture(scope='module')
+def process_runner():
+    runner = ProcessPoolRunner(seed=14, workers=1, buffer=1)
+    yield runner
+    runner.close()
+
+
+def test_inline_runner():
+    expected = list(LLMModel(seed=14).ask(PROMPTS))
+    assert asyncio.run(collect(InlineRunner(LLMModel(seed=14)), PROMPTS)) == expected
+
+
+def test_process_runner(process_runner):
+    expected = list(LLMModel(seed=14).ask(PROMPTS))
+    assert asyncio.run(collect(process_runner, PROMPTS)) == expected
+
+
+def test_process_runner_cancel(process_runner):
+    async def first_chunk():
+        stream = process_runner.ask(['<input>?</input>' + '<article>a</article>' * 100])
+        async for response in stream:
+            await stream.aclose()
+            return response
+
+    assert asyncio.run(first_chunk()) == ['Answer for question "?" is:']
+    # the worker is free again
+    assert asyncio.run(collect(process_runner, [])) == [[]]
+
+
+def test_process_runner_more_streams_than_threads(process_runner):
+    # every stream waits for the only worker, none of them holds a thread of the server meanwhile
+    async def main():
+        return await asyncio.gather(*(collect(process_runner, []) for _ in range(60)))
+
+    assert asyncio.run(main()) == [[[]]] * 60
+
+
+@pytest.fixture
+def engine():
+    engine = ContinuousBatchingEngine(LLMModel(seed=14), max_batch_size=3, buffer=2)
+    yield engine
+    engine.close()
+
+
+def test_continuous_batching():
+    expected = list(LLMModel(seed=14).ask(PROMPTS))
+    engine = ContinuousBatchingEngine(LLMModel(seed=14))
+    try:
+        assert asyncio.run(collect(engine, PROMPTS)) == expected
+    finally:
+        engine.close()
+
+
+def test_continuous_batching_concurrent(engine):
+    short = '<input>short</input><article>a</article>'
+    long = '<input>long</input>' + '\n<article>b</article>' * 5
+
+    async def main():
+        return await asyncio.gather(
+            collect(engine, [long]), collect(engine, [short, short]), collect(engine, [short]), collect(engine, []),
+        )
+
+    result = asyncio.run(main())
+    assert result == [
+        [['Answer for question "long" is:']] + [['b']] * 5,
+        [['Answer for question "short" is:'] * 2, ['a', 'a']],
+        [['Answer for question "short" is:'], ['a']],
+        [[]],
+    ]
+
+
+class RecordingModel(LLMModel):
+    def __init__(self):
+        super().__init__(seed=14)
+        self.batches = []
+
+    def decode(self, sequences):
+        self.batches.append(len(sequences))
+        return super().decode(sequences)
+
+
+def test_continuous_batching_steps_all_sequences_together():
+    model = RecordingModel()
+    engine = ContinuousBatchingEngine(model, max_batch_size=8, buffer=8)
+    short = '<input>short</input><article>a</article>'
+    long = '<input>long</input>' + '\n<article>b</article>' * 3
+
+    async def main():
+        # both requests are queued before the engine admits them
+        with engine._condition:
+            tasks = [asyncio.create_task(collect(engine, [long, short])), asyncio.create_task(collect(engine, [short]))]
+            await asyncio.sleep(0)
+        return await asyncio.gather(*tasks)
+
+    try:
+        result = asyncio.run(main())
+    finally:
+        engine.close()
+    assert result[0] == [
+        ['Answer for question "long" is:', 'Answer for question "short" is:'], ['b', 'a'], ['b', []], ['b', []],
+    ]
+    assert result[1] == [['Answer for question "short" is:'], ['a']]
+    # one step over the sequences of both requests, the short ones leave the batch as soon as they are finished
+    assert model.batches == [3, 3, 3, 1, 1]
+
+
+def test_continuous_batching_bounds_steps_ahead_of_a_stalled_client():
+    model = RecordingModel()
+    engine = ContinuousBatchingEngine(model, buffer=2)
+
+    async def main():
+        stream = engine.ask(['<input>?</input>' + '\n<article>a</article>' * 100])
+        await stream.__anext__()
+        # the event loop is blocked, steps sent meanwhile don't reach the queue of the request
+        time.sleep(0.3)
+        await stream.aclose()
+
+    try:
+        asyncio.run(main())
+    finally:
+        engine.close()
+    # the step the client took and `buffer` steps ahead of it
+    assert len(model.batches) <= 3
+
+
+def test_continuous_batching_cancel(engine):
+    async def first_chunk():
+        stream = engine.ask(['<input>?</input>' + '<article>a</article>' * 100])
+        async for response in stream:
+            await stream.aclose()
+            return response
+
+    assert asyncio.run(first_chunk()) == ['Answer for question "?" is:']
+    assert asyncio.run(collect(engine, [])) == [[]]
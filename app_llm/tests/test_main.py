@@ -1,12 +1,17 @@
 import logging
 
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from sentence_transformers import SentenceTransformer
 
 import app_llm.main
+from app_llm.batching import EncodeBatcher
 from app_llm.llm_model import LLMModel
+from app_llm.llm_runner import InlineRunner
 from app_llm.main import app
+from app_llm.reranker import Reranker
+from common.embedding_format import ACCEPT_EMBEDDINGS, NPY_MEDIA_TYPE, load_npy
 
 client = TestClient(app)
 
@@ -18,8 +23,17 @@ def setup_app():
         model_name_or_path='all-MiniLM-L6-v2',
         device='cpu',
     )
+    app_llm.main.encoder = EncodeBatcher(app_llm.main.model.encode)
     app_llm.main.llm_model = LLMModel(seed=14)
+    app_llm.main.llm_runner = InlineRunner(app_llm.main.llm_model)
     app_llm.main.logger = logging.getLogger('test')
+    app_llm.main.ready = True
+
+
+def test_ready():
+    response = client.get('/ready')
+    assert response.status_code == 200, response.text
+    assert response.json() == {'status': 'ready'}
 
 
 class TestEncode:
@@ -54,6 +68,16 @@ class TestEncode:
         assert result[0] == result[1]
         assert result[0] != result[2]
 
+    def test_npy(self):
+        items = ['hello', 'world']
+        response = client.post(self.URL, json={'items': items}, headers={'accept': ACCEPT_EMBEDDINGS})
+        assert response.status_code == 200, response.text
+        assert response.headers['content-type'] == NPY_MEDIA_TYPE
+        result = load_npy(response.content)
+        assert result.dtype == np.float32 and result.shape == (2, 384)
+        expected = client.post(self.URL, json={'items': items}).json()
+        assert np.allclose(result, expected)
+
 
 class TestLLM:
     URL = '/llm_ask'
@@ -92,6 +116,17 @@ class TestLLM:
         )
         assert response.text == expected
 
+    def test_structured(self):
+        prompt = '<input>input</input>\n<article>a</article>\n<article>b</article>'
+        text = client.post(self.URL, json={'items': [prompt]})
+        response = client.post(self.URL, json={'items': ['input'], 'articles': [['a', 'b']]})
+        assert response.status_code == 200, response.text
+        assert response.text == text.text
+
+    def test_structured_invalid_request(self):
+        response = client.post(self.URL, json={'items': ['a', 'b'], 'articles': [['a']]})
+        assert response.status_code == 422, response.text
+
     def test_batch(self):
         response = client.post(self.URL, json={'items': ['hello', 'world', '!']})
         assert response.status_code == 200, response.text
@@ -101,3 +136,30 @@ class TestLLM:
             'data: ["I don\'t know what to say..","I don\'t know what to say..","I don\'t know what to say.."]\n\n'
         )
         assert response.text == expected
+
+
+class TestRerank:
+    URL = '/rerank'
+
+    @pytest.fixture
+    def reranker(self):
+        # scores a passage by the number of its words found in the question
+        def score(pairs):
+            return np.array([len(set(q.split()) & set(p.split())) for q, p in pairs], dtype=np.float32)
+
+        app_llm.main.reranker = Reranker(score)
+        yield
+        app_llm.main.reranker = None
+
+    def test_disabled(self):
+        response = client.post(self.URL, json={'items': ['a'], 'passages': [['a']]})
+        assert response.status_code == 503, response.text
+
+    def test_invalid_request(self, reranker):
+        response = client.post(self.URL, json={'items': ['a', 'b'], 'passages': [['a']]})
+        assert response.status_code == 422, response.text
+
+    def test_scores(self, reranker):
+        response = client.post(self.URL, json={'items': ['a b', 'c'], 'passages': [['a', 'a b', 'd'], []]})
+        assert response.status_code == 200, response.text
+        assert response.json() == {'scores': [[1.0, 2.0, 0.0], []]}
@@ -0,0 +1,47 @@
+import asyncio
+
+import numpy as np
+
+from app_llm.reranker import Reranker, pair_key
+from common.embedding_cache import EmbeddingCache
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def score(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        self.calls.append(list(pairs))
+        return np.array([len(passage) for _, passage in pairs], dtype=np.float32)
+
+
+def run_concurrently(reranker: Reranker, requests: list[tuple[list[str], list[list[str]]]]) -> list:
+    async def main():
+        return await asyncio.gather(*(reranker.score(queries, passages) for queries, passages in requests))
+
+    return asyncio.run(main())
+
+
+def test_requests_share_a_batch():
+    model = FakeCrossEncoder()
+    reranker = Reranker(model.score, max_batch_size=64, max_wait=0.01)
+    result = run_concurrently(reranker, [(['q1', 'q2'], [['a', 'bb'], ['ccc']]), (['q3'], [['dddd']])])
+    assert model.calls == [[('q1', 'a'), ('q1', 'bb'), ('q2', 'ccc'), ('q3', 'dddd')]]
+    assert result == [[[1.0, 2.0], [3.0]], [[4.0]]]
+
+
+def test_cached_pairs_are_not_scored_again():
+    model = FakeCrossEncoder()
+    cache = EmbeddingCache('test', max_items=100, ttl=60, max_bytes=1024 * 1024)
+    reranker = Reranker(model.score, cache, max_wait=0.001)
+    assert run_concurrently(reranker, [(['Who won?'], [['a', 'bb', 'a']])]) == [[[1.0, 2.0, 1.0]]]
+    # the question is normalized like the embedding cache does, passages are compared as they are
+    assert run_concurrently(reranker, [(['who  WON?'], [['bb', 'ccc']])]) == [[[2.0, 3.0]]]
+    assert model.calls == [[('Who won?', 'a'), ('Who won?', 'bb')], [('who  WON?', 'ccc')]]
+    assert pair_key('q', 'a') != pair_key('q', 'A')
+
+
+def test_no_passages():
+    model = FakeCrossEncoder()
+    reranker = Reranker(model.score)
+    assert run_concurrently(reranker, [(['q'], [[]])]) == [[[]]]
@@ -0,0 +1,343 @@
+# Load test of /ask with realistic question mixes. Every request records the time to the first event (TTFB),
+# the gaps between events and the full stream latency; the stage durations of the application are taken from
+# its /metrics. Runs are saved as JSON and compared with each other.
+#
+#   python -m benchmarks.bench_ask run --local --requests 500 --concurrency 32 --output base.json
+#   python -m benchmarks.bench_ask run --url http://127.0.0.1:8000 --dataset Articles.csv --batch-sizes 1 5 20
+#   python -m benchmarks.bench_ask compare base.json new.json
+#
+# --local starts the application with stubs of fastapi_app_llm and of the database (see benchmarks/stubs.py);
+# --llm-port uses a running fastapi_app_llm instead of the stub, --real-db the database of DB_BACKEND.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Iterator
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.sse import aiter_events
+from benchmarks.stubs import StubConfig, serve_app, serve_stub_llm
+from benchmarks.workload import (
+    load_dataset_questions, load_jsonl_questions, make_requests, synthetic_questions,
+)
+
+
+@dataclass
+class RequestResult:
+    batch_size: int
+    status: int = 0
+    error: str | None = None
+    ttfb: float | None = None
+    total: float | None = None
+    gaps: list[float] = field(default_factory=list)
+    events: int = 0
+    words: int = 0
+
+
+def count_words(data) -> int:
+    if isinstance(data, dict):
+        return len(data.get('text', '').split())
+    return sum(len(chunk.split()) for chunk in data if isinstance(chunk, str))
+
+
+async def send(client: httpx.AsyncClient, body: dict) -> RequestResult:
+    result = RequestResult(batch_size=len(body['questions']))
+    started = time.perf_counter()
+    try:
+        async with client.stream('POST', '/ask', json=body) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                return result
+            previous = None
+            async for event in aiter_events(response.aiter_text()):
+                now = time.perf_counter()
+                if previous is None:
+                    result.ttfb = now - started
+                else:
+                    result.gaps.append(now - previous)
+                previous = now
+                result.events += 1
+                result.words += count_words(event.data)
+        result.total = time.perf_counter() - started
+    except (httpx.HTTPError, ValueError) as e:
+        result.error = type(e).__name__
+    return result
+
+
+async def run_load(
+        url: str, bodies: list[dict], concurrency: int, rate: float | None, seed: int
+) -> list[RequestResult]:
+    # closed loop: `concurrency` clients send requests back to back;
+    # open loop (`rate`): requests arrive as a Poisson process, whatever the state of the earlier ones
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=httpx.Timeout(60, pool=None)) as client:
+        if rate is None:
+            pending = iter(bodies)
+            results = []
+
+            async def worker() -> None:
+                for body in pending:
+                    results.append(await send(client, body))
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return results
+
+        rng = random.Random(seed)
+        tasks = []
+        for body in bodies:
+            tasks.append(asyncio.create_task(send(client, body)))
+            await asyncio.sleep(rng.expovariate(rate))
+        return list(await asyncio.gather(*tasks))
+
+
+def scrape_stages(url: str) -> dict[str, list[float]]:
+    # [sum, count] of app_ask_stage_seconds per stage
+    stages: dict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+    text = httpx.get(f'{url}/metrics', timeout=10).text
+    for family in text_string_to_metric_families(text):
+        if family.name != 'app_ask_stage_seconds':
+            continue
+        for sample in family.samples:
+            if sample.name.endswith('_sum'):
+                stages[sample.labels['stage']][0] += sample.value
+            elif sample.name.endswith('_count'):
+                stages[sample.labels['stage']][1] += sample.value
+    return stages
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(results: list[RequestResult], elapsed: float) -> dict:
+    ok = [r for r in results if r.total is not None]
+    ttfb = [r.ttfb for r in ok if r.ttfb is not None]
+    gaps = [gap for r in ok for gap in r.gaps]
+    totals = [r.total for r in ok]
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'rejected': sum(r.status in (429, 503) for r in results),
+        'errors': sum(r.error is not None or (r.status not in (200, 429, 503)) for r in results),
+        'requests_per_s': len(ok) / elapsed,
+        'questions_per_s': sum(r.batch_size for r in ok) / elapsed,
+        'words_per_s': sum(r.words for r in ok) / elapsed,
+        'ttfb_p50': percentile(ttfb, 0.5),
+        'ttfb_p95': percentile(ttfb, 0.95),
+        'ttfb_p99': percentile(ttfb, 0.99),
+        'gap_p50': percentile(gaps, 0.5),
+        'gap_p99': percentile(gaps, 0.99),
+        'total_p50': percentile(totals, 0.5),
+        'total_p95': percentile(totals, 0.95),
+        'total_p99': percentile(totals, 0.99),
+    }
+
+
+def by_batch_size(results: list[RequestResult]) -> dict[int, dict]:
+    groups: dict[int, list[RequestResult]] = defaultdict(list)
+    for result in results:
+        if result.total is not None:
+            groups[result.batch_size].append(result)
+    return {
+        size: {
+            'requests': len(group),
+            'ttfb_p50': percentile([r.ttfb for r in group if r.ttfb is not None], 0.5),
+            'total_p50': percentile([r.total for r in group], 0.5),
+        }
+        for size, group in sorted(groups.items())
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+@contextmanager
+def local_services(args: argparse.Namespace) -> Iterator[str]:
+    config = StubConfig(
+        encode_ms=args.stub_encode_ms,
+        search_ms=args.stub_search_ms,
+        step_ms=args.stub_step_ms,
+        rerank_ms=args.stub_rerank_ms,
+        steps=args.stub_steps,
+        hits=args.stub_hits,
+        passage_words=args.stub_passage_words,
+    )
+    mp_context = multiprocessing.get_context('spawn')
+    processes = []
+    try:
+        llm_port = args.llm_port
+        if llm_port is None:
+            llm_port = free_port()
+            processes.append(mp_context.Process(target=serve_stub_llm, args=(llm_port, config), daemon=True))
+            processes[-1].start()
+            wait_until_up(f'http://127.0.0.1:{llm_port}/ready')
+        app_port = free_port()
+        db_config = None if args.real_db else config
+        processes.append(mp_context.Process(target=serve_app, args=(app_port, llm_port, db_config), daemon=True))
+        processes[-1].start()
+        wait_until_up(f'http://127.0.0.1:{app_port}/')
+        yield f'http://127.0.0.1:{app_port}'
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+@contextmanager
+def _url(url: str) -> Iterator[str]:
+    yield url.rstrip('/')
+
+
+def run(args: argparse.Namespace) -> None:
+    questions = []
+    if args.dataset:
+        questions += load_dataset_questions(args.dataset, args.dataset_questions, args.seed)
+    for path in args.questions:
+        questions += load_jsonl_questions(path)
+    if not questions:
+        questions = synthetic_questions(1000, args.seed)
+    bodies = make_requests(questions, args.requests, args.batch_sizes, args.topic_skew, args.events, args.seed)
+
+    with (local_services(args) if args.local else _url(args.url)) as url:
+        if args.warmup:
+            asyncio.run(run_load(url, bodies[:args.warmup], args.concurrency, None, args.seed))
+        stages_before = scrape_stages(url)
+        started = time.perf_counter()
+        results = asyncio.run(run_load(url, bodies, args.concurrency, args.rate, args.seed))
+        elapsed = time.perf_counter() - started
+        stages_after = scrape_stages(url)
+
+    stages = {}
+    for stage, (total, count) in stages_after.items():
+        before_total, before_count = stages_before.get(stage, (0.0, 0.0))
+        if count > before_count:
+            stages[stage] = (total - before_total) / (count - before_count)
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k != 'command'},
+        'summary': summarize(results, elapsed),
+        'by_batch_size': by_batch_size(results),
+        'stages': stages,
+        'requests': [asdict(r) for r in results],
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f)
+
+
+def _ms(value: float | None) -> str:
+    return '-' if value is None else f'{value * 1000:.1f} ms'
+
+
+def print_report(report: dict) -> None:
+    summary = report['summary']
+    print(f"requests={summary['requests']} ok={summary['ok']} rejected={summary['rejected']} "
+          f"errors={summary['errors']}")
+    print(f"{summary['requests_per_s']:.1f} requests/s  {summary['questions_per_s']:.1f} questions/s  "
+          f"{summary['words_per_s']:.0f} words/s")
+    for metric in ('ttfb', 'gap', 'total'):
+        values = '  '.join(
+            f'{key.split("_")[1]}={_ms(summary[key])}' for key in summary if key.startswith(f'{metric}_')
+        )
+        print(f'{metric:<6} {values}')
+    for size, row in report['by_batch_size'].items():
+        print(f"batch={size:<4} requests={row['requests']:<6} ttfb p50={_ms(row['ttfb_p50'])}  "
+              f"total p50={_ms(row['total_p50'])}")
+    if report['stages']:
+        print('stages (mean per call): ' + '  '.join(f'{s}={_ms(v)}' for s, v in report['stages'].items()))
+
+
+def compare(paths: list[str]) -> None:
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    base = reports[0]
+    print(f'{"":<24}' + ''.join(f'{path[-24:]:>26}' for path in paths))
+    rows = [(key, base['summary'][key]) for key in base['summary']]
+    rows += [(f'stage {stage}', value) for stage, value in base['stages'].items()]
+    for key, base_value in rows:
+        cells = []
+        for report in reports:
+            if key.startswith('stage '):
+                value = report['stages'].get(key[6:])
+            else:
+                value = report['summary'].get(key)
+            if value is None:
+                cells.append(f'{"-":>26}')
+                continue
+            change = f' ({(value - base_value) / base_value:+.0%})' if report is not base and base_value else ''
+            shown = f'{value * 1000:.1f}ms' if key.startswith(('ttfb', 'gap', 'total', 'stage')) else f'{value:.1f}'
+            cells.append(f'{shown + change:>26}')
+        print(f'{key:<24}' + ''.join(cells))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    target = run_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='base url of a running fastapi_app')
+    target.add_argument('--local', action='store_true', help='start the application with stubs')
+    run_parser.add_argument('--requests', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--rate', type=float, help='requests/s of an open loop, a closed loop without it')
+    run_parser.add_argument('--warmup', type=int, default=20, help='requests sent before the measurement')
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 5, 10])
+    run_parser.add_argument('--topic-skew', type=float, default=0.5, help='share of the business topic')
+    run_parser.add_argument('--events', choices=['batch', 'question'], default='batch')
+    run_parser.add_argument('--dataset', help='Articles.csv to sample questions from')
+    run_parser.add_argument('--dataset-questions', type=int, default=1000)
+    run_parser.add_argument('--questions', nargs='*', default=[], help='JSONL files with questions')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help='JSON file to save the run to')
+    run_parser.add_argument('--llm-port', type=int, help='with --local: a running fastapi_app_llm instead of the stub')
+    run_parser.add_argument('--real-db', action='store_true', help='with --local: the database of DB_BACKEND')
+    run_parser.add_argument('--stub-encode-ms', type=float, default=5)
+    run_parser.add_argument('--stub-search-ms', type=float, default=5)
+    run_parser.add_argument('--stub-step-ms', type=float, default=20)
+    run_parser.add_argument('--stub-rerank-ms', type=float, default=10)
+    run_parser.add_argument('--stub-steps', type=int, default=4)
+    run_parser.add_argument('--stub-hits', type=int, default=3)
+    run_parser.add_argument('--stub-passage-words', type=int, default=200)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('runs', nargs='+', help='JSON files saved with run --output, the first is the base')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args.runs)
+
+
+if __name__ == '__main__':
+    main()
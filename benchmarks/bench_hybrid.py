@@ -0,0 +1,135 @@
+# Recall and added latency of the hybrid search (vector + BM25, fused with RRF) against the vector search alone.
+# The corpus is synthetic: passages of common words with two entity names (tickers, people, banks), every entity is
+# mentioned in a few passages. Embeddings
+# are built from the common words, with entities weighted down, like a small sentence encoder that knows little about
+# rare names. Every question asks about one passage by its entity and a few of its words; a `--paraphrased` share of
+# the questions uses synonyms of the words instead, which the embeddings know and BM25 doesn't.
+#
+#   python -m benchmarks.bench_hybrid --passages 20000
+#   python -m benchmarks.bench_hybrid --entity-weight 0.5 --question-words 5
+#   python -m benchmarks.bench_hybrid --entity-weight 2 --question-words 5 --paraphrased 0.5 --lexical-weight 1.5
+import argparse
+import statistics
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from app.db import LocalDatabase
+from app.hybrid import LexicalSearch, fuse
+from common.bm25 import BM25IndexWriter
+from common.local_index import LocalIndexWriter
+
+DIM = 384
+TOPIC = 'business'
+
+
+def make_corpus(args: argparse.Namespace, rng: np.random.Generator) -> tuple[list[list[str]], list[list[str]]]:
+    # Zipf-distributed common words and two entities of every passage
+    ranks = np.arange(1, args.vocabulary + 1)
+    frequencies = 1 / ranks / (1 / ranks).sum()
+    passages, entities = [], []
+    for _ in range(args.passages):
+        words = [f'w{w}' for w in rng.choice(args.vocabulary, size=args.passage_words, p=frequencies)]
+        names = [f'entity{e}' for e in rng.choice(args.entities, size=2, replace=False)]
+        passages.append(words)
+        entities.append(names)
+    return passages, entities
+
+
+def embed(words: list[str], names: list[str], word_vectors: np.ndarray, args: argparse.Namespace) -> np.ndarray:
+    vector = word_vectors[[int(word[1:]) for word in words]].sum(axis=0)
+    for name in names:
+        seed = zlib.crc32(name.encode())
+        vector += args.entity_weight * np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_questions(
+        passages: list[list[str]], entities: list[list[str]], args: argparse.Namespace, rng: np.random.Generator
+) -> tuple[list[int], list[list[str]], list[list[str]]]:
+    targets = rng.choice(len(passages), size=args.questions, replace=False).tolist()
+    words, names = [], []
+    for target in targets:
+        own = rng.choice(passages[target], size=args.question_words, replace=False).tolist()
+        if rng.random() < args.paraphrased:
+            # a synonym has the vector of its word and another token
+            own = [f's{word[1:]}' for word in own]
+        other = [f'w{w}' for w in rng.integers(args.vocabulary, size=2)]
+        words.append(own + other)
+        names.append(entities[target][:1])
+    return targets, words, names
+
+
+def report(name: str, timings: list[float]) -> None:
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1000
+    p99 = timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000
+    print(f'{name:<15} p50={p50:7.3f} ms  p99={p99:7.3f} ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--passages', type=int, default=20000)
+    parser.add_argument('--passage-words', type=int, default=60)
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    parser.add_argument('--entities', type=int, default=4000)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--question-words', type=int, default=3, help='words of the passage in its question')
+    parser.add_argument('--entity-weight', type=float, default=0.3, help='weight of an entity in the embeddings')
+    parser.add_argument('--paraphrased', type=float, default=0.0, help='share of questions with synonyms of the words')
+    parser.add_argument('--limit', type=int, default=3, help='hits per question, like SEARCH_LIMIT')
+    parser.add_argument('--rrf-k', type=int, default=60)
+    parser.add_argument('--vector-weight', type=float, default=1.0, help='like HYBRID_VECTOR_WEIGHT')
+    parser.add_argument('--lexical-weight', type=float, default=1.0, help='like HYBRID_LEXICAL_WEIGHT')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    word_vectors = rng.standard_normal((args.vocabulary, DIM)).astype(np.float32)
+    passages, entities = make_corpus(args, rng)
+    texts = [' '.join(words + names) for words, names in zip(passages, entities)]
+    targets, question_words, question_names = make_questions(passages, entities, args, rng)
+    questions = [' '.join(words + names) for words, names in zip(question_words, question_names)]
+    queries = [embed(w, n, word_vectors, args).tolist() for w, n in zip(question_words, question_names)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        vectors = np.stack([embed(w, n, word_vectors, args) for w, n in zip(passages, entities)])
+        writer = LocalIndexWriter(f'{tmp}/local_index')
+        writer.add(TOPIC, ids=range(len(texts)), embeddings=vectors, texts=texts)
+        writer.close()
+        bm25 = BM25IndexWriter(f'{tmp}/bm25')
+        bm25.add(TOPIC, ids=range(len(texts)), texts=texts, keep_texts=False)
+        bm25.close()
+        print(f'{len(texts)} passages indexed in {time.perf_counter() - started:.1f} s')
+
+        vector_search = LocalDatabase(f'{tmp}/local_index', limit=args.limit)
+        lexical_search = LexicalSearch(f'{tmp}/bm25', with_text=False, limit=args.limit, threads=1)
+        vector_hits = lexical_hits = hybrid_hits = 0
+        vector_times, lexical_times, fuse_times = [], [], []
+        for target, question, query in zip(targets, questions, queries):
+            started = time.perf_counter()
+            [vector] = vector_search.search(TOPIC, [query])
+            searched = time.perf_counter()
+            [lexical] = lexical_search.search(TOPIC, [question])
+            lexical_searched = time.perf_counter()
+            weights = (args.vector_weight, args.lexical_weight)
+            hybrid = fuse([vector, lexical], k=args.rrf_k, limit=args.limit, weights=weights)
+            fused = time.perf_counter()
+            vector_times.append(searched - started)
+            lexical_times.append(lexical_searched - searched)
+            fuse_times.append(fused - lexical_searched)
+            vector_hits += target in {item.id for item in vector.items}
+            lexical_hits += target in {item.id for item in lexical.items}
+            hybrid_hits += target in {item.id for item in hybrid.items}
+
+    n = len(targets)
+    print(f'recall@{args.limit}: vector={vector_hits / n:.3f}  bm25={lexical_hits / n:.3f}  hybrid={hybrid_hits / n:.3f}')
+    report('vector search', vector_times)
+    report('added: bm25', lexical_times)
+    report('added: fusion', fuse_times)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Measures the per-request overhead of logging on the event loop: concurrent /llm_ask-like requests log once
+# and then once per streamed chunk. Compares no handlers, the former synchronous file handler and the queue pipeline
+# of common.setup_logging with every chunk logged and with sampled chunk logs.
+#
+#   python -m benchmarks.bench_logging --requests 2000 --concurrency 64 --chunks 50
+#   python -m benchmarks.bench_logging --sink-latency 0.2
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from common import setup_logging, shutdown_logging
+
+
+class SlowFileHandler(logging.FileHandler):
+    # emulates a slow disk or a network sink
+    def __init__(self, path: str, latency: float):
+        super().__init__(path)
+        self.latency = latency
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+def file_handler(directory: str, name: str, latency: float) -> logging.FileHandler:
+    handler = SlowFileHandler(os.path.join(directory, f'{name}.txt'), latency)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(trace_id)s - %(message)s"))
+    return handler
+
+
+class TraceIdDefault(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = '-'
+        return True
+
+
+async def request(logger: logging.Logger, chunks: int, chunk_level: int) -> float:
+    started = time.perf_counter()
+    logger.info('/ask: %u items', 8)
+    for i in range(chunks):
+        await asyncio.sleep(0)
+        logger.log(chunk_level, '/ask: sent part №%u', i)
+    return time.perf_counter() - started
+
+
+async def load(logger: logging.Logger, args: argparse.Namespace, chunk_level: int) -> tuple[list[float], float]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited() -> float:
+        async with semaphore:
+            return await request(logger, args.chunks, chunk_level)
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(limited() for _ in range(args.requests)))
+    return latencies, time.perf_counter() - started
+
+
+def run(name: str, args: argparse.Namespace, directory: str) -> tuple[list[float], float, float]:
+    logger = logging.getLogger('app')
+    logger.setLevel(logging.DEBUG)
+    if name == 'no handlers':
+        return *asyncio.run(load(logger, args, logging.DEBUG)), 0.0
+    if name == 'sync file':
+        # the former setup: the handler writes in the thread of the request, every chunk is logged at INFO
+        handler = file_handler(directory, 'sync', args.sink_latency / 1000)
+        handler.addFilter(TraceIdDefault())
+        logger.addHandler(handler)
+        try:
+            return *asyncio.run(load(logger, args, logging.INFO)), 0.0
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+    rate = 1.0 if name == 'queue, every chunk' else args.sample_rate
+    handler = file_handler(directory, name.replace(' ', '_').replace(',', ''), args.sink_latency / 1000)
+    logger = setup_logging('bench', handlers=[handler], debug_sample_rate=rate)
+    latencies, total = asyncio.run(load(logger, args, logging.DEBUG))
+    started = time.perf_counter()
+    shutdown_logging()
+    return latencies, total, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--chunks', type=int, default=50)
+    parser.add_argument('--sample-rate', type=float, default=0.01)
+    parser.add_argument('--sink-latency', type=float, default=0, help='ms added to every write')
+    args = parser.parse_args()
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('no handlers', 'sync file', 'queue, every chunk', 'queue, sampled'):
+            latencies, total, flush = run(name, args, directory)
+            mean = statistics.mean(latencies)
+            if baseline is None:
+                baseline = mean
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(
+                f'{name:<22} {args.requests / total:8.0f} req/s  mean={mean * 1000:7.2f} ms  p99={p99 * 1000:7.2f} ms  '
+                f'overhead per request={(mean - baseline) * 1000:7.2f} ms  shutdown flush={flush:.2f} s'
+            )
+
+
+if __name__ == '__main__':
+    main()
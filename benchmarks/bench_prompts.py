@@ -0,0 +1,103 @@
+# Compares prompts built from whole articles with prompts packed from passages on a synthetic corpus:
+# prompt size and the latency of search, prompt building and generation by the stub LLM of fastapi_app_llm.
+#
+#   python -m benchmarks.bench_prompts --articles 2000 --passage-size 200 --budget 1024
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.data_processing import build_prompts
+from app.db import LocalDatabase
+from app_llm.llm_model import LLMModel
+from common.local_index import LocalIndexWriter
+from common.passages import passage_id, split_passages
+
+DIM = 384
+TOPICS = ['business', 'sports']
+ARTICLE_MAX_LEN = 20480
+
+
+def make_articles(articles: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    vocabulary = [f'word{i}' for i in range(5000)]
+    return [' '.join(rng.choices(vocabulary, k=rng.randint(100, 3000))) for _ in range(articles)]
+
+
+def build_index(path: str, articles: list[str], passage_size: int, overlap: int, seed: int) -> int:
+    rng = np.random.default_rng(seed)
+    writer = LocalIndexWriter(path)
+    count = 0
+    for article_id, article in enumerate(articles):
+        passages = list(split_passages(article[:ARTICLE_MAX_LEN], passage_size, overlap))
+        vectors = rng.standard_normal((len(passages), DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [passage_id(article_id, number) for number in range(len(passages))]
+        writer.add(TOPICS[article_id % len(TOPICS)], ids=ids, embeddings=vectors, texts=passages)
+        count += len(passages)
+    writer.close()
+    return count
+
+
+def run(db: LocalDatabase, llm: LLMModel, queries: np.ndarray, batch_size: int, budget: int) -> tuple[list, list]:
+    prompt_bytes, timings = [], []
+    for i in range(0, len(queries), batch_size):
+        batch = queries[i: i + batch_size].tolist()
+        started = time.perf_counter()
+        articles = db.search(TOPICS[i % len(TOPICS)], batch)
+        prompts = build_prompts([f'question {i + j}' for j in range(len(batch))], articles, budget=budget)
+        for _ in llm.ask(prompts):
+            pass
+        timings.append(time.perf_counter() - started)
+        prompt_bytes.extend(len(prompt.encode()) for prompt in prompts)
+    return prompt_bytes, timings
+
+
+def report(name: str, prompt_bytes: list[int], timings: list[float]) -> None:
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1000
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000
+    print(
+        f'{name:<9} prompt bytes: mean={statistics.mean(prompt_bytes):9.0f} max={max(prompt_bytes):7d}  '
+        f'latency: p50={p50:8.1f} ms  p95={p95:8.1f} ms'
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--articles', type=int, default=2000)
+    parser.add_argument('--passage-size', type=int, default=200)
+    parser.add_argument('--overlap', type=int, default=40)
+    parser.add_argument('--budget', type=int, default=1024, help='words of passages per prompt')
+    parser.add_argument('--search-limit', type=int, default=3)
+    parser.add_argument('--questions', type=int, default=40)
+    parser.add_argument('--batch-size', type=int, default=5)
+    args = parser.parse_args()
+
+    articles = make_articles(args.articles, seed=0)
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((args.questions, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        size = build_index(f'{tmp}/articles', articles, passage_size=0, overlap=0, seed=2)
+        print(f'articles: {size} rows')
+        before = run(
+            LocalDatabase(f'{tmp}/articles', limit=args.search_limit), LLMModel(seed=0), queries, args.batch_size,
+            budget=0,
+        )
+        size = build_index(f'{tmp}/passages', articles, args.passage_size, args.overlap, seed=2)
+        print(f'passages: {size} rows')
+        after = run(
+            LocalDatabase(f'{tmp}/passages', limit=args.search_limit), LLMModel(seed=0), queries, args.batch_size,
+            budget=args.budget,
+        )
+    report('articles', *before)
+    report('passages', *after)
+
+
+if __name__ == '__main__':
+    main()
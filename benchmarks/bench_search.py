@@ -0,0 +1,126 @@
+# Compares the in-process local index with Milvus on a synthetic corpus.
+#
+#   python -m benchmarks.bench_search --articles 5000
+#   python -m benchmarks.bench_search --milvus-uri http://127.0.0.1:19530
+#
+# Without --milvus-uri an embedded Milvus Lite database is used (pymilvus[milvus_lite]).
+import argparse
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+from pymilvus import CollectionSchema, DataType, FieldSchema, MilvusClient
+
+from app.db import Database, LocalDatabase
+from common.local_index import LocalIndexWriter
+
+DIM = 384
+TOPICS = ['business', 'sports']
+
+
+def make_corpus(articles: int, seed: int) -> tuple[np.ndarray, list[str]]:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((articles, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    topics = [TOPICS[i % len(TOPICS)] for i in range(articles)]
+    return vectors, topics
+
+
+def build_local(path: str, vectors: np.ndarray, topics: list[str], text: str) -> LocalDatabase:
+    writer = LocalIndexWriter(path)
+    for topic in TOPICS:
+        rows = [i for i, t in enumerate(topics) if t == topic]
+        writer.add(topic, ids=rows, embeddings=vectors[rows], texts=[text] * len(rows))
+    writer.close()
+    return LocalDatabase(path)
+
+
+def build_milvus(uri: str, vectors: np.ndarray, topics: list[str], text: str) -> Database:
+    client = MilvusClient(uri=uri)
+    if client.has_collection(Database.COLLECTION_NAME):
+        client.drop_collection(Database.COLLECTION_NAME)
+    schema = CollectionSchema([
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True),
+        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=DIM),
+        # Milvus Lite doesn't support partitions, the filter by topic is evaluated as an expression
+        FieldSchema(name='topic', dtype=DataType.VARCHAR, max_length=100),
+        FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=20480),
+    ])
+    index_params = MilvusClient.prepare_index_params()
+    index_params.add_index(field_name='embedding', metric_type='IP', index_type='IVF_FLAT', params={'nlist': 128})
+    client.create_collection(Database.COLLECTION_NAME, schema=schema, index_params=index_params)
+    for start in range(0, len(vectors), 1000):
+        client.insert(Database.COLLECTION_NAME, [
+            {'id': i, 'embedding': vectors[i].tolist(), 'topic': topics[i], 'text': text}
+            for i in range(start, min(start + 1000, len(vectors)))
+        ])
+    client.load_collection(Database.COLLECTION_NAME)
+    return Database(uri=uri, partitioned=False)
+
+
+def measure(search: Callable, queries: np.ndarray, batch_size: int, repeats: int) -> list[float]:
+    timings = []
+    for i in range(repeats):
+        batch = queries[(i * batch_size) % len(queries):][:batch_size].tolist()
+        started = time.perf_counter()
+        search(TOPICS[i % len(TOPICS)], batch)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name: str, batch_size: int, timings: list[float]) -> None:
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1000
+    p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+    qps = batch_size * len(timings) / sum(timings)
+    print(f'{name:<8} batch={batch_size:<4} p50={p50:8.3f} ms  p95={p95:8.3f} ms  {qps:10.1f} queries/s')
+
+
+def recall(local: LocalDatabase, milvus: Database, queries: np.ndarray) -> float:
+    found = total = 0
+    for topic in TOPICS:
+        exact = local.search(topic, queries.tolist())
+        approx = milvus.search(topic, queries.tolist())
+        for e, a in zip(exact, approx):
+            found += len({i.id for i in e.items} & {i.id for i in a.items})
+            total += len(e.items)
+    return found / total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--articles', type=int, default=5000)
+    parser.add_argument('--text-size', type=int, default=2048, help='bytes of article text returned per hit')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 5, 32])
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--milvus-uri', help='Milvus to compare with, an embedded Milvus Lite by default')
+    parser.add_argument('--skip-milvus', action='store_true')
+    args = parser.parse_args()
+
+    vectors, topics = make_corpus(args.articles, seed=0)
+    queries, _ = make_corpus(256, seed=1)
+    text = 'x' * args.text_size
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        local = build_local(f'{tmp}/local_index', vectors, topics, text)
+        print(f'local index built in {time.perf_counter() - started:.2f} s')
+        milvus = None
+        if not args.skip_milvus:
+            started = time.perf_counter()
+            milvus = build_milvus(args.milvus_uri or f'{tmp}/milvus.db', vectors, topics, text)
+            print(f'milvus collection built in {time.perf_counter() - started:.2f} s')
+
+        for batch_size in args.batch_sizes:
+            report('local', batch_size, measure(local.search, queries, batch_size, args.repeats))
+            if milvus is not None:
+                report('milvus', batch_size, measure(milvus.search, queries, batch_size, args.repeats))
+        if milvus is not None:
+            print(f'milvus recall@3 against exact search: {recall(local, milvus, queries[:64]):.3f}')
+            milvus.close()
+
+
+if __name__ == '__main__':
+    main()
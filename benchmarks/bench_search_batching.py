@@ -0,0 +1,77 @@
+# Searches of concurrent requests sent one by one through the io pool versus coalesced per topic by SearchCoalescer.
+# The backend is the stub database (a fixed latency per call, like a round trip to Milvus) or the local index.
+#
+#   python -m benchmarks.bench_search_batching --clients 64 --search-ms 20
+#   python -m benchmarks.bench_search_batching --backend local --articles 20000
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.search_batching import SearchCoalescer
+from benchmarks.bench_search import TOPICS, build_local, make_corpus
+from benchmarks.stubs import StubConfig, StubDatabase
+
+
+async def load(search, clients: int, searches: int, queries: np.ndarray, batch_size: int) -> tuple[list[float], float]:
+    latencies = []
+
+    async def client(n: int) -> None:
+        for i in range(searches):
+            start = (n * searches + i) * batch_size % (len(queries) - batch_size)
+            started = time.perf_counter()
+            await search(TOPICS[n % len(TOPICS)], queries[start: start + batch_size].tolist())
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return latencies, time.perf_counter() - started
+
+
+def run(name: str, db, args: argparse.Namespace, queries: np.ndarray) -> None:
+    async def main() -> tuple[list[float], float]:
+        with ThreadPoolExecutor(args.io_pool_size) as pool:
+            if name == 'direct':
+                async def search(topic, embeddings):
+                    return await asyncio.get_running_loop().run_in_executor(pool, db.search, topic, embeddings)
+            else:
+                search = SearchCoalescer(db.search, pool, max_wait=args.max_wait_ms / 1000).search
+            return await load(search, args.clients, args.searches, queries, args.batch_size)
+
+    latencies, elapsed = asyncio.run(main())
+    latencies.sort()
+    print(
+        f'{name:<10} {len(latencies) / elapsed:8.0f} searches/s  p50={statistics.median(latencies) * 1000:7.2f} ms  '
+        f'p99={latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms'
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=['stub', 'local'], default='stub')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--searches', type=int, default=20, help='searches per client')
+    parser.add_argument('--batch-size', type=int, default=3, help='questions of a topic in one request')
+    parser.add_argument('--io-pool-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=2)
+    parser.add_argument('--search-ms', type=float, default=20, help='latency of a stub search call')
+    parser.add_argument('--articles', type=int, default=20000)
+    args = parser.parse_args()
+
+    queries, _ = make_corpus(1024, seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.backend == 'stub':
+            db = StubDatabase(StubConfig(search_ms=args.search_ms, passage_words=20))
+        else:
+            vectors, topics = make_corpus(args.articles, seed=0)
+            db = build_local(f'{tmp}/local_index', vectors, topics, 'x' * 1024)
+        for name in ('direct', 'coalesced'):
+            run(name, db, args, queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Measures the cold start of the embedding model of fastapi_app_llm in fresh processes:
+# load (from the hub cache or a local directory), quantization, warm-up, the first /encode-sized batch and steady state.
+#
+#   python -m app_llm.embedding_model --save /tmp/minilm
+#   python -m benchmarks.bench_startup --model-path /tmp/minilm
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+SENTENCES = [f'Question number {i} about the business news of the day' for i in range(64)]
+
+
+def child(path: str | None, quantized: bool, warmup: int, batch_size: int) -> dict:
+    started = time.perf_counter()
+    from app_llm.embedding_model import load_embedding_model, warm_up
+    imported = time.perf_counter()
+    model = load_embedding_model(path=path, quantized=quantized)
+    loaded = time.perf_counter()
+    warm_up(model.encode, warmup)
+    warmed = time.perf_counter()
+
+    batch = SENTENCES[:batch_size]
+    first_started = time.perf_counter()
+    vectors = model.encode(batch)
+    first = time.perf_counter() - first_started
+    steady = []
+    for _ in range(20):
+        step_started = time.perf_counter()
+        model.encode(batch)
+        steady.append(time.perf_counter() - step_started)
+    return {
+        'import': imported - started,
+        'load': loaded - imported,
+        'warmup': warmed - loaded,
+        'first_batch': first,
+        'steady_batch': statistics.median(steady),
+        'vectors': vectors.tolist(),
+    }
+
+
+def run(args: argparse.Namespace, path: str | None, quantized: bool, warmup: int) -> dict:
+    command = [
+        sys.executable, '-m', 'benchmarks.bench_startup', '--child',
+        '--warmup', str(warmup), '--batch-size', str(args.batch_size),
+    ]
+    if path:
+        command += ['--model-path', path]
+    if quantized:
+        command.append('--quantized')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', help='local model directory, the hub name is used without it')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=32)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--quantized', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.model_path, args.quantized, args.warmup, args.batch_size)))
+        return
+
+    configurations = [
+        ('hub, cold', None, False, 0),
+        ('local, cold', args.model_path, False, 0),
+        ('local, warm', args.model_path, False, args.warmup),
+        ('local, int8, warm', args.model_path, True, args.warmup),
+    ]
+    reference = None
+    for name, path, quantized, warmup in configurations:
+        if path is None and name.startswith('local'):
+            continue
+        result = run(args, path, quantized, warmup)
+        vectors = result.pop('vectors')
+        if reference is None:
+            reference = vectors
+        similarity = min(sum(a * b for a, b in zip(u, v)) for u, v in zip(reference, vectors))
+        startup = result['import'] + result['load'] + result['warmup']
+        print(
+            f'{name:<18} startup={startup:6.2f} s (import {result["import"]:.2f}, load {result["load"]:.2f}, '
+            f'warm-up {result["warmup"]:.2f})  first batch={result["first_batch"] * 1000:8.1f} ms  '
+            f'steady={result["steady_batch"] * 1000:7.1f} ms  min cosine to fp32={similarity:.4f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
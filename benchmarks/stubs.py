@@ -0,0 +1,129 @@
+# Local stand-ins for fastapi_app_llm and the vector database, so /ask can be load-tested on one machine and every
+# stage can be isolated: a stage whose stub has no latency costs only the work of the application itself.
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Annotated
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Header, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.models import DBSearchResponse
+from app.sse import format_event
+from benchmarks.workload import TOPICS
+from common.embedding_format import NPY_MEDIA_TYPE, accepts_npy, dump_npy
+from common.passages import passage_id
+
+DIM = 384
+
+
+@dataclass
+class StubConfig:
+    # latency of one /encode request, of one search call, of one generation step and of one /rerank request
+    encode_ms: float = 5
+    search_ms: float = 5
+    step_ms: float = 20
+    rerank_ms: float = 10
+    # answer chunks per question after the first "Answer for question ..." event
+    steps: int = 4
+    hits: int = 3
+    passage_words: int = 200
+
+
+def embed(text: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+    vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_stub_llm_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/ready')
+    async def ready() -> JSONResponse:
+        return JSONResponse({'status': 'ready'})
+
+    @app.post('/encode')
+    async def encode(data: dict, accept: Annotated[str | None, Header()] = None):
+        await asyncio.sleep(config.encode_ms / 1000)
+        vectors = np.stack([embed(item) for item in data['items']]) if data['items'] else np.empty((0, DIM))
+        if accepts_npy(accept):
+            return Response(content=dump_npy(vectors), media_type=NPY_MEDIA_TYPE)
+        return vectors.tolist()
+
+    @app.post('/rerank')
+    async def rerank(data: dict) -> dict:
+        await asyncio.sleep(config.rerank_ms / 1000)
+        # the passage with more words of the question ranks higher
+        return {'scores': [
+            [float(len(set(query.split()) & set(passage.split()))) for passage in passages]
+            for query, passages in zip(data['items'], data['passages'])
+        ]}
+
+    @app.post('/llm_ask')
+    async def llm_ask(data: dict) -> StreamingResponse:
+        queries = [item[:64] for item in data['items']]
+
+        async def stream():
+            await asyncio.sleep(config.step_ms / 1000)
+            yield format_event(0, [f'Answer for question "{query}" is:' for query in queries])
+            for step in range(1, config.steps + 1):
+                await asyncio.sleep(config.step_ms / 1000)
+                yield format_event(step, [f'chunk {step} of the answer' for _ in queries])
+
+        return StreamingResponse(stream(), media_type='text/event-stream')
+
+    return app
+
+
+class StubDatabase:
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.text = ' '.join(f'word{i}' for i in range(config.passage_words))
+
+    def search(self, topic, embeddings: list) -> list[DBSearchResponse]:
+        # called in the io pool of the application, like the real search
+        time.sleep(self.config.search_ms / 1000)
+        return [
+            DBSearchResponse(items=[
+                {
+                    'id': passage_id(hit, 0),
+                    'distance': 1 - hit / 10,
+                    'entity': {'topic': topic, 'article_id': hit, 'text': f'{hit} {self.text}'},
+                }
+                for hit in range(self.config.hits)
+            ])
+            for _ in embeddings
+        ]
+
+    def discover_topics(self) -> list[str]:
+        return TOPICS
+
+    def close(self) -> None:
+        pass
+
+
+def serve_stub_llm(port: int, config: StubConfig) -> None:
+    uvicorn.run(create_stub_llm_app(config), host='127.0.0.1', port=port, log_level='warning')
+
+
+def serve_app(port: int, llm_port: int | None, config: StubConfig | None) -> None:
+    # runs in a fresh process: the settings of the application are read from the environment on import
+    if llm_port is not None:
+        os.environ['LLM_HOST'] = '127.0.0.1'
+        os.environ['LLM_PORT'] = str(llm_port)
+    import app.main
+    from common import setup_logging
+
+    if config is not None:
+        app.main.create_database = lambda size, with_text=True: StubDatabase(config)
+    # records are formatted and written as usual, but there is no Loki to send them to
+    log_handler = logging.FileHandler(os.devnull)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(trace_id)s - %(message)s'))
+    app.main.setup_logging = lambda name: setup_logging(name, handlers=[log_handler])
+    uvicorn.run(app.main.app, host='127.0.0.1', port=port, log_level='warning')
@@ -0,0 +1,80 @@
+# Question mixes for the /ask load tests: questions are taken from the dataset (headings, or the first sentence
+# of an article) and from JSONL files, then grouped into requests of varying batch sizes and topic skew.
+# Everything is driven by a seed, so two runs send the same requests.
+import json
+import random
+import re
+from dataclasses import dataclass
+
+# topics of the Articles.csv dataset
+TOPICS = ['business', 'sports']
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+@dataclass
+class WorkloadQuestion:
+    question: str
+    topic: str | None = None
+
+
+def question_from_article(article: str, max_words: int = 20) -> str:
+    sentence = SENTENCE_END.split(article.strip(), maxsplit=1)[0]
+    return ' '.join(sentence.split()[:max_words])
+
+
+def load_dataset_questions(path: str, limit: int, seed: int) -> list[WorkloadQuestion]:
+    import pandas as pd
+
+    df = pd.read_csv(path, encoding='cp1252')
+    df = df.sample(n=min(limit, len(df)), random_state=seed)
+    texts = df['Heading'] if 'Heading' in df else df['Article'].map(question_from_article)
+    return [
+        WorkloadQuestion(question=str(text), topic=topic if topic in TOPICS else None)
+        for text, topic in zip(texts, df['NewsType'])
+    ]
+
+
+def load_jsonl_questions(path: str) -> list[WorkloadQuestion]:
+    # lines are single questions ({"question", "topic"}), recorded /ask bodies ({"questions": [...]})
+    # or other records with a `title`, e.g. a backlog of requests
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for item in record.get('questions') or [record]:
+                text = item.get('question') or item.get('title')
+                if text:
+                    questions.append(WorkloadQuestion(question=text, topic=item.get('topic')))
+    return questions
+
+
+def synthetic_questions(count: int, seed: int) -> list[WorkloadQuestion]:
+    rng = random.Random(seed)
+    subjects = ['the central bank', 'the stock market', 'the national team', 'the league', 'oil prices', 'the coach']
+    verbs = ['announce', 'expect', 'lose', 'win', 'change', 'report']
+    return [
+        WorkloadQuestion(question=f'What did {rng.choice(subjects)} {rng.choice(verbs)} in week {rng.randint(1, 52)}?')
+        for _ in range(count)
+    ]
+
+
+def make_requests(
+        questions: list[WorkloadQuestion],
+        count: int,
+        batch_sizes: list[int],
+        topic_skew: float,
+        events: str,
+        seed: int,
+) -> list[dict]:
+    # `topic_skew` is the share of the first topic among the questions without one, 0.5 is uniform
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        batch = []
+        for question in rng.choices(questions, k=rng.choice(batch_sizes)):
+            topic = question.topic or (TOPICS[0] if rng.random() < topic_skew else rng.choice(TOPICS[1:]))
+            batch.append({'question': question.question, 'topic': topic})
+        requests.append({'questions': batch, 'events': events})
+    return requests
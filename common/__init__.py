@@ -1,27 +1,110 @@
+import copy
 import logging
+import random
+from logging.handlers import QueueHandler, QueueListener
 from os import getenv
-from queue import Queue
+from queue import SimpleQueue
 
-from logging_loki import LokiQueueHandler
+from logging_loki import LokiHandler
+from prometheus_client import Counter
 
+from common.tracing import TraceIdFilter
 
-def setup_logging(app_name: str) -> logging.Logger:
-    loki_logs_handler = LokiQueueHandler(
-        Queue(-1),
+LOG_LEVEL = getenv('LOG_LEVEL') or 'INFO'
+# with LOG_LEVEL=DEBUG, share of the DEBUG records (e.g. one per streamed chunk) that are written,
+# INFO and above are always written
+LOG_DEBUG_SAMPLE_RATE = float(getenv('LOG_DEBUG_SAMPLE_RATE') or 0.01)
+# records waiting for the writer thread; when it falls behind, new records are dropped instead of blocking requests
+LOG_QUEUE_SIZE = int(getenv('LOG_QUEUE_SIZE') or 10000)
+
+LOGGERS = ('uvicorn.access', 'uvicorn', 'app')
+
+LOG_RECORDS_DROPPED = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+
+class DebugSampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, queue: SimpleQueue, max_size: int):
+        super().__init__(queue)
+        self.max_size = max_size
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only the message is resolved in the thread of the request, the writer thread formats the record;
+        # the queue is in-process, so the exception info does not need to be pickled
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # the size check is approximate, a lock-free SimpleQueue is cheaper than a bounded Queue
+        if self.queue.qsize() >= self.max_size:
+            LOG_RECORDS_DROPPED.inc()
+            return
+        self.queue.put_nowait(record)
+
+
+_pipeline: tuple[QueueHandler, QueueListener] | None = None
+
+
+def create_handlers(app_name: str) -> list[logging.Handler]:
+    loki_logs_handler = LokiHandler(
         url=getenv('LOKI_ENDPOINT') or 'http://127.0.0.1:3100/loki/api/v1/push',
         tags={'application': app_name},
         version="1",
     )
+    loki_logs_handler.setFormatter(logging.Formatter("trace_id=%(trace_id)s %(message)s"))
     file_handler = logging.FileHandler('app_logs.txt')
-    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(trace_id)s - %(message)s"))
+    return [loki_logs_handler, file_handler]
 
-    uvicorn_access_logger = logging.getLogger("uvicorn.access")
-    uvicorn_logger = logging.getLogger('uvicorn')
-    app_logger = logging.getLogger('app')
-    app_logger.setLevel(logging.INFO)
 
-    for _logger in (uvicorn_access_logger, uvicorn_logger, app_logger):
-        _logger.addHandler(loki_logs_handler)
-        _logger.addHandler(file_handler)
+def setup_logging(
+        app_name: str,
+        handlers: list[logging.Handler] | None = None,
+        debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE,
+        queue_size: int = LOG_QUEUE_SIZE,
+) -> logging.Logger:
+    # Loggers only put records into a queue, a single listener thread formats and writes them with `handlers`.
+    # The queue handler runs in the thread of the request, so the trace id and the message are resolved there.
+    global _pipeline
+    shutdown_logging()
+
+    queue_handler = NonBlockingQueueHandler(SimpleQueue(), queue_size)
+    queue_handler.addFilter(TraceIdFilter())
+    queue_handler.addFilter(DebugSampleFilter(debug_sample_rate))
+    listener = QueueListener(
+        queue_handler.queue, *(handlers if handlers is not None else create_handlers(app_name)),
+        respect_handler_level=True,
+    )
+    listener.start()
+    _pipeline = queue_handler, listener
+
+    app_logger = logging.getLogger('app')
+    app_logger.setLevel(LOG_LEVEL)
+    for name in LOGGERS:
+        logging.getLogger(name).addHandler(queue_handler)
 
     return app_logger
+
+
+def shutdown_logging() -> None:
+    # writes the queued records and closes the handlers, called when an application stops
+    global _pipeline
+    if _pipeline is None:
+        return
+    queue_handler, listener = _pipeline
+    _pipeline = None
+    for name in LOGGERS:
+        logging.getLogger(name).removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+        handler.close()
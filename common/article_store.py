@@ -0,0 +1,97 @@
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Iterable, Sequence
+
+import numpy as np
+
+# Files of the store:
+#   articles.bin   zlib-compressed utf-8 texts, one after another
+#   articles.idx   int64 little-endian triples (id, offset, length) pointing into articles.bin
+DATA_FILE = 'articles.bin'
+INDEX_FILE = 'articles.idx'
+
+
+class ArticleStoreWriter:
+    def __init__(self, path: str, append: bool = False):
+        os.makedirs(path, exist_ok=True)
+        mode = 'ab' if append else 'wb'
+        self._data = open(os.path.join(path, DATA_FILE), mode)
+        self._index = open(os.path.join(path, INDEX_FILE), mode)
+        self._offset = self._data.seek(0, os.SEEK_END)
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]) -> None:
+        entries = []
+        for article_id, text in zip(ids, texts):
+            blob = zlib.compress(text.encode('utf-8'))
+            self._data.write(blob)
+            entries.append((article_id, self._offset, len(blob)))
+            self._offset += len(blob)
+        # the texts must be on disk before the index points to them
+        self._data.flush()
+        self._index.write(np.asarray(entries, dtype='<i8').reshape(-1, 3).tobytes())
+        self._index.flush()
+
+    def sizes(self) -> dict[str, int]:
+        # a resumed ingestion truncates the files to the sizes recorded in its checkpoint
+        return {DATA_FILE: self._data.tell(), INDEX_FILE: self._index.tell()}
+
+    def truncate(self, sizes: dict[str, int]) -> None:
+        self._data.truncate(sizes.get(DATA_FILE, 0))
+        self._index.truncate(sizes.get(INDEX_FILE, 0))
+        self._offset = self._data.seek(0, os.SEEK_END)
+        self._index.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        self._data.close()
+        self._index.close()
+
+
+# Read-only key -> text store over a memory-mapped file, with an LRU of decompressed hot articles.
+class ArticleStore:
+    def __init__(self, path: str, cache_size: int = 1024):
+        index = np.fromfile(os.path.join(path, INDEX_FILE), dtype='<i8').reshape(-1, 3)
+        index = index[np.argsort(index[:, 0], kind='stable')]
+        self._ids = np.ascontiguousarray(index[:, 0])
+        self._offsets = index[:, 1].tolist()
+        self._lengths = index[:, 2].tolist()
+
+        self._file = open(os.path.join(path, DATA_FILE), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        self.cache_size = cache_size
+        self._cache: OrderedDict[int, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, article_id: int) -> str | None:
+        with self._lock:
+            text = self._cache.get(article_id)
+            if text is not None:
+                self._cache.move_to_end(article_id)
+                return text
+
+        position = int(np.searchsorted(self._ids, article_id))
+        if position == len(self._ids) or self._ids[position] != article_id:
+            return None
+        offset = self._offsets[position]
+        text = zlib.decompress(self._data[offset: offset + self._lengths[position]]).decode('utf-8')
+
+        with self._lock:
+            self._cache[article_id] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def get_many(self, ids: Iterable[int]) -> list[str | None]:
+        return [self.get(article_id) for article_id in ids]
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
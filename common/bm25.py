@@ -0,0 +1,197 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+# Directory layout, one shard per topic:
+#   manifest.json            {"k1": 1.2, "b": 0.75, "topics": {"sports": 1234, ...}}
+#   <topic>.docs.jsonl       tokenized passages appended during the ingest, the arrays are built from it on close
+#   <topic>.terms.txt        sorted vocabulary, one term per line
+#   <topic>.offsets.i64      postings of the term i are offsets[i]:offsets[i + 1] of the next two arrays
+#   <topic>.rows.i32         passage rows
+#   <topic>.weights.f32      BM25 weight of the term in the passage, idf and length normalization included
+#   <topic>.ids.i64          passage ids by row
+#   <topic>.texts.jsonl      one JSON string per line, optional when texts are kept in the article store
+MANIFEST = 'manifest.json'
+K1 = 1.2
+B = 0.75
+_TOPIC_RE = re.compile(r'^[\w-]+$')
+_TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have he in is it its of on or she that the their they this to was '
+    'were what when where which who why will with'.split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _shard_path(path: str, topic: str, suffix: str) -> str:
+    if not _TOPIC_RE.match(topic):
+        raise ValueError(f'Invalid topic name: {topic!r}')
+    return os.path.join(path, f'{topic}.{suffix}')
+
+
+class BM25IndexWriter:
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for name in os.listdir(path):
+                if name == MANIFEST or name.endswith(
+                        ('.docs.jsonl', '.terms.txt', '.offsets.i64', '.rows.i32', '.weights.f32', '.ids.i64',
+                         '.texts.jsonl')
+                ):
+                    os.remove(os.path.join(path, name))
+
+    def sizes(self) -> dict[str, int]:
+        # sizes of the passage files, a resumed ingestion truncates them to the sizes recorded in its checkpoint
+        return {
+            name: os.path.getsize(os.path.join(self.path, name))
+            for name in os.listdir(self.path) if name.endswith('.docs.jsonl')
+        }
+
+    def truncate(self, sizes: dict[str, int]) -> None:
+        for name in os.listdir(self.path):
+            if name.endswith('.docs.jsonl'):
+                if name in sizes:
+                    os.truncate(os.path.join(self.path, name), sizes[name])
+                else:
+                    os.remove(os.path.join(self.path, name))
+
+    def add(self, topic: str, ids: Sequence[int], texts: Sequence[str], keep_texts: bool = True) -> None:
+        with open(_shard_path(self.path, topic, 'docs.jsonl'), 'a', encoding='utf-8') as f:
+            for passage_id, text in zip(ids, texts):
+                doc = {'id': int(passage_id), 'tokens': tokenize(text), 'text': text if keep_texts else None}
+                f.write(json.dumps(doc) + '\n')
+
+    def close(self) -> None:
+        topics = {}
+        for name in os.listdir(self.path):
+            if name.endswith('.docs.jsonl'):
+                topic = name.removesuffix('.docs.jsonl')
+                topics[topic] = self._build(topic)
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump({'k1': K1, 'b': B, 'topics': topics}, f)
+        for topic in topics:
+            os.remove(_shard_path(self.path, topic, 'docs.jsonl'))
+
+    def _build(self, topic: str) -> int:
+        ids, texts, lengths = [], [], []
+        postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        with open(_shard_path(self.path, topic, 'docs.jsonl'), encoding='utf-8') as f:
+            seen = set()
+            for line in f:
+                doc = json.loads(line)
+                # a passage added twice is indexed once
+                if doc['id'] in seen:
+                    continue
+                seen.add(doc['id'])
+                row = len(ids)
+                ids.append(doc['id'])
+                texts.append(doc['text'])
+                lengths.append(len(doc['tokens']))
+                for term, tf in Counter(doc['tokens']).items():
+                    postings[term].append((row, tf))
+
+        terms = sorted(postings)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        norm = K1 * (1 - B + B * lengths / max(float(lengths.mean()) if len(lengths) else 0, 1))
+        offsets = np.zeros(len(terms) + 1, dtype='<i8')
+        rows, weights = [], []
+        for i, term in enumerate(terms):
+            term_rows, tf = np.asarray(postings[term], dtype=np.int64).T
+            idf = math.log(1 + (len(ids) - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            rows.append(term_rows)
+            weights.append(idf * tf * (K1 + 1) / (tf + norm[term_rows]))
+            offsets[i + 1] = offsets[i] + len(term_rows)
+
+        with open(_shard_path(self.path, topic, 'terms.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(term + '\n' for term in terms)
+        offsets.tofile(_shard_path(self.path, topic, 'offsets.i64'))
+        np.concatenate(rows or [[]]).astype('<i4').tofile(_shard_path(self.path, topic, 'rows.i32'))
+        np.concatenate(weights or [[]]).astype('<f4').tofile(_shard_path(self.path, topic, 'weights.f32'))
+        np.asarray(ids, dtype='<i8').tofile(_shard_path(self.path, topic, 'ids.i64'))
+        if any(text is not None for text in texts):
+            with open(_shard_path(self.path, topic, 'texts.jsonl'), 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(text) + '\n' for text in texts)
+        return len(ids)
+
+
+def _map(path: str, dtype: str) -> np.ndarray:
+    # numpy can't map an empty file, e.g. the postings of a shard with nothing but stopwords
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+@dataclass
+class Shard:
+    terms: dict[str, int]
+    offsets: np.ndarray
+    rows: np.ndarray
+    weights: np.ndarray
+    ids: np.ndarray
+    texts: list[str] | None
+
+
+# In-process BM25 search over memory-mapped postings. Weights are computed when the index is built,
+# so a query only sums the postings of its terms.
+class BM25Index:
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.shards: dict[str, Shard] = {}
+        for topic, size in manifest['topics'].items():
+            if size == 0:
+                continue
+            with open(_shard_path(path, topic, 'terms.txt'), encoding='utf-8') as f:
+                terms = {line.rstrip('\n'): i for i, line in enumerate(f)}
+            texts = None
+            if os.path.exists(_shard_path(path, topic, 'texts.jsonl')):
+                with open(_shard_path(path, topic, 'texts.jsonl'), encoding='utf-8') as f:
+                    texts = [json.loads(line) for line in f]
+            self.shards[topic] = Shard(
+                terms=terms,
+                offsets=np.fromfile(_shard_path(path, topic, 'offsets.i64'), dtype='<i8'),
+                rows=_map(_shard_path(path, topic, 'rows.i32'), '<i4'),
+                weights=_map(_shard_path(path, topic, 'weights.f32'), '<f4'),
+                ids=_map(_shard_path(path, topic, 'ids.i64'), '<i8'),
+                texts=texts,
+            )
+
+    @property
+    def topics(self) -> list[str]:
+        return list(self.shards)
+
+    def search(
+            self, topic: str, queries: Sequence[str], limit: int, max_terms: int = 32
+    ) -> list[list[tuple[int, float]]]:
+        # returns (row, score) pairs of the best `limit` rows of the topic shard for every query;
+        # only the `max_terms` rarest terms of a query are scored, they have the shortest postings
+        shard = self.shards.get(topic)
+        if shard is None:
+            return [[] for _ in queries]
+
+        results = []
+        for query in queries:
+            terms = [shard.terms[token] for token in dict.fromkeys(tokenize(query)) if token in shard.terms]
+            terms.sort(key=lambda term: shard.offsets[term + 1] - shard.offsets[term])
+            scores = np.zeros(len(shard.ids), dtype=np.float32)
+            for term in terms[:max_terms]:
+                start, end = shard.offsets[term], shard.offsets[term + 1]
+                # rows are unique within the postings of a term
+                scores[shard.rows[start:end]] += shard.weights[start:end]
+
+            rows = np.flatnonzero(scores)
+            if len(rows) > limit:
+                rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+            rows = rows[np.argsort(-scores[rows], kind='stable')]
+            results.append([(int(row), float(scores[row])) for row in rows])
+        return results
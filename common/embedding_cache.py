@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Sequence
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+EMBEDDING_CACHE_HITS = Counter('embedding_cache_hits_total', 'Embedding cache hits', ['cache'])
+EMBEDDING_CACHE_MISSES = Counter('embedding_cache_misses_total', 'Embedding cache misses', ['cache'])
+EMBEDDING_CACHE_EVICTIONS = Counter('embedding_cache_evictions_total', 'Embedding cache evictions', ['cache'])
+EMBEDDING_CACHE_ITEMS = Gauge('embedding_cache_items', 'Number of cached embeddings', ['cache'])
+EMBEDDING_CACHE_BYTES = Gauge('embedding_cache_bytes', 'Estimated size of cached embeddings', ['cache'])
+
+Vector = Any
+
+
+class EmbeddingCache:
+    def __init__(self, name: str, max_items: int, ttl: float, max_bytes: int):
+        self.name = name
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, tuple[float, int, Vector]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # all-MiniLM-L6-v2 is uncased and splits on whitespace, so this doesn't change the embedding
+        return ' '.join(text.split()).lower()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_many(self, texts: Sequence[str]) -> list[Vector | None]:
+        now = time.monotonic()
+        result = []
+        with self._lock:
+            for text in texts:
+                key = self.normalize(text)
+                item = self._items.get(key)
+                if item is not None and item[0] < now:
+                    self._remove(key)
+                    item = None
+                if item is None:
+                    result.append(None)
+                else:
+                    self._items.move_to_end(key)
+                    result.append(item[2])
+            self._update_gauges()
+        hits = sum(r is not None for r in result)
+        EMBEDDING_CACHE_HITS.labels(self.name).inc(hits)
+        EMBEDDING_CACHE_MISSES.labels(self.name).inc(len(result) - hits)
+        return result
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Vector]) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.normalize(text)
+                # a row of a batch keeps the whole batch alive, a copy is as big as it is counted
+                vector = np.array(vector, dtype=np.float32, copy=True)
+                size = len(key) + vector.nbytes
+                if size > self.max_bytes:
+                    continue
+                if key in self._items:
+                    self._remove(key)
+                self._items[key] = (expires, size, vector)
+                self._bytes += size
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                EMBEDDING_CACHE_EVICTIONS.labels(self.name).inc()
+            self._update_gauges()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def _update_gauges(self) -> None:
+        EMBEDDING_CACHE_ITEMS.labels(self.name).set(len(self._items))
+        EMBEDDING_CACHE_BYTES.labels(self.name).set(self._bytes)
+
+
+def create_embedding_cache(name: str, default_size: int) -> EmbeddingCache | None:
+    max_items = int(os.getenv('EMBEDDING_CACHE_SIZE') or default_size)
+    if max_items <= 0:
+        return None
+    return EmbeddingCache(
+        name=name,
+        max_items=max_items,
+        ttl=float(os.getenv('EMBEDDING_CACHE_TTL') or 3600),
+        max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_BYTES') or 64 * 1024 * 1024),
+    )
+
+
+def _split_misses(cache: EmbeddingCache, texts: Sequence[str]) -> tuple[list, list[str]]:
+    result = cache.get_many(texts)
+    # identical questions in one batch are encoded once
+    misses = list(dict.fromkeys(text for text, vector in zip(texts, result) if vector is None))
+    return result, misses
+
+
+def _fill_misses(cache: EmbeddingCache, texts: Sequence[str], result: list, misses: list[str], vectors) -> list:
+    cache.put_many(misses, vectors)
+    encoded = dict(zip(misses, vectors))
+    return [encoded[text] if vector is None else vector for text, vector in zip(texts, result)]
+
+
+def encode_with_cache(
+        cache: EmbeddingCache, texts: Sequence[str], encode: Callable[[list[str]], Sequence[Vector]]
+) -> list[Vector]:
+    result, misses = _split_misses(cache, texts)
+    if not misses:
+        return result
+    return _fill_misses(cache, texts, result, misses, encode(misses))
+
+
+async def aencode_with_cache(
+        cache: EmbeddingCache, texts: Sequence[str], encode: Callable[[list[str]], Awaitable[Sequence[Vector]]]
+) -> list[Vector]:
+    result, misses = _split_misses(cache, texts)
+    if not misses:
+        return result
+    return _fill_misses(cache, texts, result, misses, await encode(misses))
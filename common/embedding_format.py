@@ -0,0 +1,45 @@
+import io
+import json
+from math import prod
+
+import numpy as np
+
+# Embeddings are sent either as JSON lists of floats (the default) or, when the client accepts it, as a float32 matrix
+# in the .npy format: a short header with dtype and shape followed by the raw little-endian values.
+NPY_MEDIA_TYPE = 'application/x-npy'
+JSON_MEDIA_TYPE = 'application/json'
+# servers that don't know the binary format answer with JSON
+ACCEPT_EMBEDDINGS = f'{NPY_MEDIA_TYPE}, {JSON_MEDIA_TYPE};q=0.5'
+
+
+def accepts_npy(accept: str | None) -> bool:
+    for media_range in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        if media_type == NPY_MEDIA_TYPE:
+            return not any(param.replace(' ', '') in ('q=0', 'q=0.0') for param in params)
+    return False
+
+
+def dump_npy(vectors) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(vectors, dtype='<f4'))
+    return buffer.getvalue()
+
+
+def load_npy(content: bytes) -> np.ndarray:
+    # a read-only view of `content`, the values are not copied
+    stream = io.BytesIO(content)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order or dtype.hasobject:
+        raise ValueError(f'Unsupported array: dtype {dtype}, fortran order {fortran_order}')
+    return np.frombuffer(content, dtype=dtype, count=prod(shape), offset=stream.tell()).reshape(shape)
+
+
+def load_embeddings(content_type: str | None, content: bytes) -> np.ndarray:
+    if (content_type or '').split(';')[0].strip() == NPY_MEDIA_TYPE:
+        return load_npy(content)
+    return np.asarray(json.loads(content), dtype=np.float32)
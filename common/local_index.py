@@ -0,0 +1,124 @@
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+# Directory layout, one shard per topic:
+#   manifest.json            {"dim": 384, "topics": {"sports": 1234, ...}}
+#   <topic>.vectors.f32      float32 little-endian matrix, one normalized embedding per row
+#   <topic>.ids.i64          int64 little-endian article ids
+#   <topic>.texts.jsonl      one JSON string per line, optional when texts are kept in the article store
+MANIFEST = 'manifest.json'
+_SHARD_SUFFIXES = ('.vectors.f32', '.ids.i64', '.texts.jsonl')
+_TOPIC_RE = re.compile(r'^[\w-]+$')
+
+
+def _shard_path(path: str, topic: str, suffix: str) -> str:
+    if not _TOPIC_RE.match(topic):
+        raise ValueError(f'Invalid topic name: {topic!r}')
+    return os.path.join(path, f'{topic}.{suffix}')
+
+
+class LocalIndexWriter:
+    def __init__(self, path: str, dim: int = 384, append: bool = False):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for name in os.listdir(path):
+                if name == MANIFEST or name.endswith(_SHARD_SUFFIXES):
+                    os.remove(os.path.join(path, name))
+
+    def add(
+            self,
+            topic: str,
+            ids: Sequence[int],
+            embeddings: Sequence[Sequence[float]],
+            texts: Sequence[str] | None = None,
+    ) -> None:
+        vectors = np.asarray(embeddings, dtype='<f4').reshape(-1, self.dim)
+        with open(_shard_path(self.path, topic, 'vectors.f32'), 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(_shard_path(self.path, topic, 'ids.i64'), 'ab') as f:
+            f.write(np.asarray(ids, dtype='<i8').tobytes())
+        if texts is not None:
+            with open(_shard_path(self.path, topic, 'texts.jsonl'), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(text) + '\n' for text in texts)
+
+    def sizes(self) -> dict[str, int]:
+        # sizes of the shard files, a resumed ingestion truncates them to the sizes recorded in its checkpoint
+        return {
+            name: os.path.getsize(os.path.join(self.path, name))
+            for name in os.listdir(self.path) if name.endswith(_SHARD_SUFFIXES)
+        }
+
+    def truncate(self, sizes: dict[str, int]) -> None:
+        for name in os.listdir(self.path):
+            if name.endswith(_SHARD_SUFFIXES):
+                if name in sizes:
+                    os.truncate(os.path.join(self.path, name), sizes[name])
+                else:
+                    os.remove(os.path.join(self.path, name))
+
+    def close(self) -> None:
+        topics = {}
+        for name in os.listdir(self.path):
+            if name.endswith('.ids.i64'):
+                topics[name.removesuffix('.ids.i64')] = os.path.getsize(os.path.join(self.path, name)) // 8
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump({'dim': self.dim, 'topics': topics}, f)
+
+
+@dataclass
+class Shard:
+    vectors: np.ndarray
+    ids: np.ndarray
+    texts: list[str] | None
+
+
+# In-process exact inner-product search over memory-mapped shards.
+class LocalIndex:
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.dim = manifest['dim']
+        self.shards: dict[str, Shard] = {}
+        for topic, size in manifest['topics'].items():
+            if size == 0:
+                continue
+            vectors = np.memmap(_shard_path(path, topic, 'vectors.f32'), dtype='<f4', mode='r', shape=(size, self.dim))
+            ids = np.memmap(_shard_path(path, topic, 'ids.i64'), dtype='<i8', mode='r', shape=(size,))
+            texts = None
+            if os.path.exists(_shard_path(path, topic, 'texts.jsonl')):
+                with open(_shard_path(path, topic, 'texts.jsonl'), encoding='utf-8') as f:
+                    texts = [json.loads(line) for line in f]
+            self.shards[topic] = Shard(vectors=vectors, ids=ids, texts=texts)
+
+    @property
+    def topics(self) -> list[str]:
+        return list(self.shards)
+
+    def search(self, topic: str, embeddings: Sequence[Sequence[float]], limit: int) -> list[list[tuple[int, float]]]:
+        # returns (row, score) pairs of the best `limit` rows of the topic shard for every query
+        shard = self.shards.get(topic)
+        if shard is None or not len(embeddings):
+            return [[] for _ in embeddings]
+
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        scores = queries @ shard.vectors.T
+        k = min(limit, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(queries), k))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        rows = np.take_along_axis(top, order, axis=1)
+        rows_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(query_rows, query_scores)]
+            for query_rows, query_scores in zip(rows, rows_scores)
+        ]
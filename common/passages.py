@@ -0,0 +1,40 @@
+from typing import Iterator
+
+# Passage ids are derived from the id of their article, so they stay the same when ingestion is resumed:
+#   passage_id = article_id * MAX_PASSAGES + passage number
+MAX_PASSAGES = 1024
+
+
+# Tokens are approximated by whitespace-separated words, the same way on both sides: data_builder splits articles
+# into passages of PASSAGE_SIZE words, the application packs them into a prompt budget of PROMPT_TOKEN_BUDGET words.
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    return ' '.join(text.split()[:limit])
+
+
+def split_passages(text: str, size: int, overlap: int = 0) -> Iterator[str]:
+    # overlapping windows of `size` words; size 0 keeps the whole text as one passage
+    words = text.split()
+    if size <= 0 or len(words) <= size:
+        yield ' '.join(words)
+        return
+    if not 0 <= overlap < size:
+        raise ValueError(f'Passage overlap must be in [0, {size}), got {overlap}')
+
+    stride = size - overlap
+    for number, start in enumerate(range(0, len(words) - overlap, stride)):
+        if number == MAX_PASSAGES:
+            # the rest of a very long article is not indexed
+            break
+        yield ' '.join(words[start: start + size])
+
+
+def passage_id(article_id: int, number: int) -> int:
+    return article_id * MAX_PASSAGES + number
+
+
+def article_id(passage: int) -> int:
+    return passage // MAX_PASSAGES
@@ -0,0 +1,54 @@
+from common.article_store import ArticleStore, ArticleStoreWriter
+
+
+def test_get(tmp_path):
+    writer = ArticleStoreWriter(str(tmp_path))
+    writer.add([5, 1], ['five', 'one'])
+    writer.add([3], ['три'])
+    writer.close()
+
+    store = ArticleStore(str(tmp_path))
+    assert len(store) == 3
+    assert store.get_many([1, 3, 5, 4]) == ['one', 'три', 'five', None]
+    store.close()
+
+
+def test_append(tmp_path):
+    writer = ArticleStoreWriter(str(tmp_path))
+    writer.add([0], ['first'])
+    writer.close()
+    writer = ArticleStoreWriter(str(tmp_path), append=True)
+    writer.add([1], ['second'])
+    writer.close()
+
+    store = ArticleStore(str(tmp_path))
+    assert store.get_many([0, 1]) == ['first', 'second']
+    store.close()
+
+
+def test_lru(tmp_path):
+    writer = ArticleStoreWriter(str(tmp_path))
+    writer.add([0, 1, 2], ['a', 'b', 'c'])
+    writer.close()
+
+    store = ArticleStore(str(tmp_path), cache_size=2)
+    store.get_many([0, 1, 0, 2])
+    assert list(store._cache) == [0, 2]
+    store.close()
+
+
+def test_truncate_to_checkpoint(tmp_path):
+    writer = ArticleStoreWriter(str(tmp_path))
+    writer.add([0], ['first'])
+    sizes = writer.sizes()
+    writer.add([1], ['lost'])
+    writer.close()
+    writer = ArticleStoreWriter(str(tmp_path), append=True)
+    writer.truncate(sizes)
+    writer.add([1], ['second'])
+    writer.close()
+
+    store = ArticleStore(str(tmp_path))
+    assert len(store) == 2
+    assert store.get_many([0, 1]) == ['first', 'second']
+    store.close()
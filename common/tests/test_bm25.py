@@ -0,0 +1,50 @@
+import pytest
+
+from common.bm25 import BM25Index, BM25IndexWriter, tokenize
+
+
+@pytest.fixture
+def index(tmp_path) -> BM25Index:
+    writer = BM25IndexWriter(str(tmp_path))
+    writer.add('business', ids=[10, 11], texts=['The State Bank of Pakistan (SBP) kept rates', 'Oil prices rise'])
+    writer.add('business', ids=[12, 11], texts=['Bank profits fall as rates rise', 'Oil prices rise'])
+    writer.add('sports', ids=[20], texts=['Pakistan won the match'], keep_texts=False)
+    writer.close()
+    return BM25Index(str(tmp_path))
+
+
+def test_tokenize():
+    assert tokenize('Bank of Pakistan (SBP)') == ['bank', 'pakistan', 'sbp']
+
+
+def test_rare_terms_rank_first(index):
+    result = index.search('business', ['Bank of Pakistan (SBP)', 'rates rise'], limit=3)
+    assert [[row for row, _ in hits] for hits in result] == [[0, 2], [2, 1, 0]]
+    shard = index.shards['business']
+    assert list(shard.ids) == [10, 11, 12]
+    assert shard.texts[0].startswith('The State Bank')
+
+
+def test_limit_and_no_match(index):
+    assert len(index.search('business', ['rates rise'], limit=1)[0]) == 1
+    assert index.search('business', ['hockey', 'the'], limit=3) == [[], []]
+    assert index.search('politics', ['bank'], limit=3) == [[]]
+
+
+def test_texts_are_optional(index):
+    assert index.shards['sports'].texts is None
+    assert index.search('sports', ['pakistan'], limit=3)[0][0][0] == 0
+    assert sorted(index.topics) == ['business', 'sports']
+
+
+def test_truncate_to_checkpoint(tmp_path):
+    writer = BM25IndexWriter(str(tmp_path))
+    writer.add('business', ids=[10], texts=['rates rise'])
+    sizes = writer.sizes()
+    writer.add('business', ids=[11], texts=['lost'])
+    writer.add('sports', ids=[20], texts=['lost'])
+    writer = BM25IndexWriter(str(tmp_path), append=True)
+    writer.truncate(sizes)
+    writer.close()
+    index = BM25Index(str(tmp_path))
+    assert index.topics == ['business'] and list(index.shards['business'].ids) == [10]
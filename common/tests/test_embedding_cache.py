@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pytest
+
+from common.embedding_cache import EmbeddingCache, encode_with_cache
+
+
+def make_cache(max_items=10, ttl=60.0, max_bytes=1024 * 1024) -> EmbeddingCache:
+    return EmbeddingCache(name='test', max_items=max_items, ttl=ttl, max_bytes=max_bytes)
+
+
+def test_only_misses_are_encoded():
+    cache = make_cache()
+    cache.put_many(['hello'], [[1.0]])
+    encoded = []
+
+    def encode(items):
+        encoded.append(items)
+        return [[float(len(item))] for item in items]
+
+    result = encode_with_cache(cache, ['world', '  Hello ', 'abc', 'world'], encode)
+    assert result == [[5.0], [1.0], [3.0], [5.0]]
+    assert encoded == [['world', 'abc']]
+
+    assert encode_with_cache(cache, ['abc', 'WORLD'], encode) == [[3.0], [5.0]]
+    assert len(encoded) == 1
+
+
+def test_lru_eviction():
+    cache = make_cache(max_items=2)
+    cache.put_many(['a', 'b'], [[1.0], [2.0]])
+    cache.get_many(['a'])
+    cache.put_many(['c'], [[3.0]])
+    assert cache.get_many(['a', 'b', 'c']) == [[1.0], None, [3.0]]
+
+
+def test_memory_cap():
+    # a key and a float32 each
+    cache = make_cache(max_bytes=10)
+    cache.put_many(['a', 'b', 'c'], [[1.0], [2.0], [3.0]])
+    assert len(cache) == 2
+    cache.put_many(['d'], [[0.0] * 10])
+    assert len(cache) == 2
+
+
+def test_rows_of_a_batch_are_copied():
+    cache = make_cache()
+    batch = np.arange(6, dtype=np.float64).reshape(3, 2)
+    encode_with_cache(cache, ['a', 'b', 'c'], lambda items: batch)
+    cached = cache.get_many(['a', 'b', 'c'])
+    assert all(vector.base is None and vector.dtype == np.float32 for vector in cached)
+    assert [vector.tolist() for vector in cached] == batch.tolist()
+
+
+def test_ttl():
+    cache = make_cache(ttl=0.01)
+    cache.put_many(['a'], [[1.0]])
+    time.sleep(0.02)
+    assert cache.get_many(['a']) == [None]
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize('text', ['Bank  of Pakistan', ' bank of\tpakistan\n'])
+def test_normalize(text):
+    assert EmbeddingCache.normalize(text) == 'bank of pakistan'
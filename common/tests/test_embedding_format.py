@@ -0,0 +1,28 @@
+import numpy as np
+
+from common.embedding_format import ACCEPT_EMBEDDINGS, accepts_npy, dump_npy, load_embeddings, load_npy
+
+
+def test_npy_round_trip():
+    vectors = np.random.default_rng(0).standard_normal((3, 384)).astype(np.float32)
+    content = dump_npy(vectors)
+    assert len(content) < vectors.nbytes + 256
+
+    result = load_npy(content)
+    assert result.dtype == np.float32 and result.shape == (3, 384)
+    assert np.array_equal(result, vectors)
+    assert not result.flags.writeable
+
+
+def test_load_embeddings_by_content_type():
+    vectors = [[0.5, 1.0], [2.0, -1.0]]
+    assert np.array_equal(load_embeddings('application/x-npy', dump_npy(vectors)), vectors)
+    assert np.array_equal(load_embeddings('application/json', b'[[0.5, 1.0], [2.0, -1.0]]'), vectors)
+
+
+def test_accept():
+    assert accepts_npy(ACCEPT_EMBEDDINGS)
+    assert accepts_npy('application/json, application/x-npy; q=0.9')
+    assert not accepts_npy('application/x-npy;q=0')
+    assert not accepts_npy('application/json')
+    assert not accepts_npy(None)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from common.local_index import LocalIndex, LocalIndexWriter
+
+
+@pytest.fixture
+def index(tmp_path) -> LocalIndex:
+    writer = LocalIndexWriter(str(tmp_path), dim=2)
+    writer.add('sports', ids=[10, 11], embeddings=[[1.0, 0.0], [0.0, 1.0]], texts=['first', 'second'])
+    writer.add('sports', ids=[12], embeddings=[[0.6, 0.8]], texts=['third'])
+    writer.add('business', ids=[20], embeddings=[[1.0, 0.0]], texts=['other'])
+    writer.close()
+    return LocalIndex(str(tmp_path))
+
+
+def test_top_k(index):
+    result = index.search('sports', [[1.0, 0.0], [0.0, 1.0]], limit=2)
+    assert [[row for row, _ in hits] for hits in result] == [[0, 2], [1, 2]]
+    assert result[0][0][1] == pytest.approx(1.0)
+    shard = index.shards['sports']
+    assert shard.ids[2] == 12 and shard.texts[2] == 'third'
+
+
+def test_limit_bigger_than_shard(index):
+    result = index.search('business', np.array([[0.0, 1.0]]), limit=3)
+    assert result == [[(0, 0.0)]]
+
+
+def test_unknown_topic(index):
+    assert index.search('politics', [[1.0, 0.0]], limit=3) == [[]]
+    assert sorted(index.topics) == ['business', 'sports']
+
+
+def test_invalid_topic(tmp_path):
+    writer = LocalIndexWriter(str(tmp_path), dim=2)
+    with pytest.raises(ValueError):
+        writer.add('../sports', ids=[1], embeddings=[[1.0, 0.0]], texts=['text'])
+
+
+def test_truncate_to_checkpoint(tmp_path):
+    writer = LocalIndexWriter(str(tmp_path), dim=2)
+    writer.add('sports', ids=[10], embeddings=[[1.0, 0.0]], texts=['first'])
+    sizes = writer.sizes()
+    # a batch written before a crash, without its checkpoint
+    writer.add('sports', ids=[11], embeddings=[[0.0, 1.0]], texts=['second'])
+    writer.add('business', ids=[20], embeddings=[[1.0, 0.0]], texts=['other'])
+
+    writer = LocalIndexWriter(str(tmp_path), dim=2, append=True)
+    writer.truncate(sizes)
+    writer.add('sports', ids=[11], embeddings=[[0.0, 1.0]], texts=['second'])
+    writer.close()
+    index = LocalIndex(str(tmp_path))
+    assert index.topics == ['sports']
+    assert list(index.shards['sports'].ids) == [10, 11] and index.shards['sports'].texts == ['first', 'second']
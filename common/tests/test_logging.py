@@ -0,0 +1,60 @@
+import logging
+import threading
+
+from common import DebugSampleFilter, setup_logging, shutdown_logging
+from common.tracing import _trace_id
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self, unblocked: threading.Event | None = None):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(trace_id)s %(message)s'))
+        self.unblocked = unblocked
+        self.lines = []
+        self.threads = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.unblocked is not None:
+            self.unblocked.wait()
+        self.threads.add(threading.get_ident())
+        self.lines.append(self.format(record))
+
+
+def test_records_are_written_by_the_listener_and_flushed_on_shutdown():
+    release = threading.Event()
+    handler = SlowHandler(release)
+    logger = setup_logging('test', handlers=[handler], debug_sample_rate=1)
+    token = _trace_id.set('abc')
+    try:
+        for i in range(10):
+            logger.info('record %u', i)
+    finally:
+        _trace_id.reset(token)
+    # the writer is blocked, logging did not wait for it
+    assert handler.lines == []
+    release.set()
+    shutdown_logging()
+    assert handler.lines == [f'abc record {i}' for i in range(10)]
+    assert handler.threads and threading.get_ident() not in handler.threads
+    assert not logging.getLogger('app').handlers
+
+
+def test_full_queue_drops_records():
+    release = threading.Event()
+    handler = SlowHandler(release)
+    logger = setup_logging('test', handlers=[handler], queue_size=2)
+    for i in range(100):
+        logger.info('record %u', i)
+    release.set()
+    shutdown_logging()
+    assert 2 <= len(handler.lines) < 100
+
+
+def test_debug_sampling():
+    record = logging.LogRecord('app', logging.DEBUG, __file__, 0, 'message', None, None)
+    info = logging.LogRecord('app', logging.INFO, __file__, 0, 'message', None, None)
+    assert not DebugSampleFilter(0).filter(record)
+    assert DebugSampleFilter(0).filter(info)
+    assert DebugSampleFilter(1).filter(record)
+    passed = sum(DebugSampleFilter(0.1).filter(record) for _ in range(10000))
+    assert 700 < passed < 1300
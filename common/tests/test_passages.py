@@ -0,0 +1,23 @@
+import pytest
+
+from common.passages import MAX_PASSAGES, article_id, passage_id, split_passages
+
+
+def test_overlapping_passages():
+    text = ' '.join(f'w{i}' for i in range(10))
+    assert list(split_passages(text, size=4, overlap=1)) == ['w0 w1 w2 w3', 'w3 w4 w5 w6', 'w6 w7 w8 w9']
+
+
+def test_short_or_whole_text():
+    assert list(split_passages('  one\n two ', size=4, overlap=1)) == ['one two']
+    assert list(split_passages('a b c d e', size=0)) == ['a b c d e']
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        list(split_passages('a b c d e', size=2, overlap=2))
+
+
+def test_ids():
+    assert article_id(passage_id(42, 7)) == 42
+    assert passage_id(1, 0) == MAX_PASSAGES
@@ -0,0 +1,37 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.tracing import TRACE_HEADER, TraceIdFilter, TraceMiddleware, get_trace_id
+
+app = FastAPI()
+app.add_middleware(TraceMiddleware)
+
+
+@app.get('/trace')
+async def trace() -> str:
+    return get_trace_id()
+
+
+client = TestClient(app)
+
+
+def test_trace_id_is_propagated():
+    response = client.get('/trace', headers={TRACE_HEADER: 'abc-123'})
+    assert response.json() == 'abc-123'
+    assert response.headers[TRACE_HEADER] == 'abc-123'
+
+
+def test_trace_id_is_generated():
+    for headers in ({}, {TRACE_HEADER: 'bad id'}):
+        response = client.get('/trace', headers=headers)
+        trace_id = response.json()
+        assert len(trace_id) == 32 and response.headers[TRACE_HEADER] == trace_id
+    assert get_trace_id() == '-'
+
+
+def test_filter():
+    record = logging.LogRecord('test', logging.INFO, __file__, 0, 'message', None, None)
+    assert TraceIdFilter().filter(record)
+    assert record.trace_id == '-'
@@ -0,0 +1,22 @@
+import re
+
+# Every topic is kept in its own Milvus partition, named after the topic. Partition names allow only letters,
+# digits and `_`, so topics are normalized the same way by data_builder and the application.
+PARTITION_PREFIX = 'topic_'
+_SEPARATORS = re.compile(r'[^a-z0-9_]+')
+
+
+def normalize_topic(topic: str) -> str:
+    # `Sports News` -> `sports_news`
+    return _SEPARATORS.sub('_', topic.strip().lower()).strip('_')
+
+
+def partition_name(topic: str) -> str:
+    return PARTITION_PREFIX + topic
+
+
+def topic_of_partition(partition: str) -> str | None:
+    # None for partitions that don't hold a topic, e.g. `_default`
+    if not partition.startswith(PARTITION_PREFIX):
+        return None
+    return partition.removeprefix(PARTITION_PREFIX)
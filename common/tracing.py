@@ -0,0 +1,45 @@
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+
+# The trace id of a request is taken from this header or generated, returned in the response
+# and passed on to fastapi_app_llm, so the logs of both applications can be matched in Loki.
+TRACE_HEADER = 'x-trace-id'
+_TRACE_ID_RE = re.compile(r'^[\w-]{1,64}$')
+
+_trace_id: ContextVar[str] = ContextVar('trace_id', default='-')
+
+
+def get_trace_id() -> str:
+    return _trace_id.get()
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class TraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        trace_id = dict(scope['headers']).get(TRACE_HEADER.encode(), b'').decode('latin-1')
+        if not _TRACE_ID_RE.match(trace_id):
+            trace_id = uuid.uuid4().hex
+
+        async def send_with_trace_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), (TRACE_HEADER.encode(), trace_id.encode())]
+            await send(message)
+
+        token = _trace_id.set(trace_id)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _trace_id.reset(token)
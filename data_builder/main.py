@@ -1,78 +1,304 @@
+import asyncio
+import json
 import os
+import threading
 
 import httpx
+import numpy as np
 import pandas as pd
 from pymilvus import FieldSchema, CollectionSchema, DataType, MilvusClient, exceptions
 from tqdm import tqdm
 
+from common.article_store import ArticleStoreWriter
+from common.bm25 import BM25IndexWriter
+from common.embedding_format import ACCEPT_EMBEDDINGS, load_embeddings
+from common.local_index import LocalIndexWriter
+from common.passages import passage_id, split_passages
+from common.topics import normalize_topic, partition_name
+
 milvus_host = os.getenv('MILVUS_HOST') or 'localhost'
 milvus_port = os.getenv('MILVUS_PORT') or '19530'
 llm_host = os.getenv('LLM_HOST') or 'localhost'
 llm_port = os.getenv('LLM_PORT') or '8080'
+app_host = os.getenv('APP_HOST')
+app_port = os.getenv('APP_PORT') or '8000'
 
-client = MilvusClient(uri=f'http://{milvus_host}:{milvus_port}')
-
-try:
-    client.drop_database('qa')
-except exceptions.MilvusException as e:
-    print(e)
-client.create_database('qa')
+dataset_path = os.getenv('DATASET_PATH') or 'Articles.csv'
+batch_size = int(os.getenv('INGEST_BATCH_SIZE') or 64)
+# max number of batches being encoded or inserted at the same time
+max_in_flight = int(os.getenv('INGEST_MAX_IN_FLIGHT') or 4)
+max_retries = int(os.getenv('INGEST_MAX_RETRIES') or 5)
+checkpoint_path = os.getenv('INGEST_CHECKPOINT') or 'ingest_checkpoint.json'
+# a run that didn't finish leaves the checkpoint, the next run continues from it unless INGEST_RESTART is set
+restart = (os.getenv('INGEST_RESTART') or '').lower() in ('1', 'true', 'yes')
+# `milvus`, `local` (the in-process index of the application, see DB_BACKEND) or `both`
+ingest_target = os.getenv('INGEST_TARGET') or 'milvus'
+local_index_path = os.getenv('LOCAL_INDEX_PATH') or 'local_index'
+# texts are also written to a compressed article store the application reads them from, see ARTICLE_STORE_PATH
+article_store_path = os.getenv('ARTICLE_STORE_PATH')
+# a BM25 index of the passages for the hybrid search of the application, see BM25_INDEX_PATH there
+bm25_index_path = os.getenv('BM25_INDEX_PATH')
+# articles are indexed as overlapping passages of PASSAGE_SIZE words, 0 indexes whole articles
+passage_size = int(os.getenv('PASSAGE_SIZE') or 200)
+passage_overlap = int(os.getenv('PASSAGE_OVERLAP') or 40)
+passage_settings = [passage_size, passage_overlap]
 
 article_max_len = 20480
-schema = CollectionSchema(
-    [
-        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
-        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=384, description='Embedding of the text'),
-        FieldSchema(name='topic', dtype=DataType.VARCHAR, max_length=100, description='Topic', is_partition_key=True),
-        FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=article_max_len, description='Article')
-    ]
-)
-index_params = MilvusClient.prepare_index_params()
-index_params.add_index(
-    field_name='embedding',
-    metric_type='IP',
-    index_type='IVF_FLAT',
-    index_name='embedding_index',
-    params={'nlist': 128}
-)
-
 collection_name = 'articles'
-if client.has_collection(collection_name):
-    client.drop_collection(collection_name)
-
-collection = client.create_collection(
-    collection_name=collection_name,
-    schema=schema,
-    index_params=index_params,
-)
-
-###
-
-df = pd.read_csv('Articles.csv', encoding='cp1252')[['Article', 'NewsType']]
-df['Article'] = df['Article'].apply(lambda x: x[:article_max_len].strip())
-
-url = f'http://{llm_host}:{llm_port}/encode'
-embeddings = []
-batch_size = 64
-for i in tqdm(range(0, len(df), batch_size)):
-    batch = df.iloc[i:i + batch_size]
-    articles = batch['Article'].to_list()
-    response = httpx.post(url, json={'items': articles})
-
-    if response.status_code == 200:
-        embeddings.extend(response.json())
-    else:
-        print(f"Error with status code: {response.status_code}")
-
-insert_df = pd.DataFrame({
-    'embedding': embeddings,
-    'topic': df['NewsType'].iloc[:len(embeddings)],
-    'text': df['Article'].iloc[:len(embeddings)],
-})
-
-data_formatted = insert_df.to_dict('records')
-client.insert(
-    collection_name=collection_name,
-    data=data_formatted,
-)
-client.load_collection(collection_name)
+
+to_milvus = ingest_target in ('milvus', 'both')
+to_local = ingest_target in ('local', 'both')
+client = MilvusClient(uri=f'http://{milvus_host}:{milvus_port}') if to_milvus else None
+
+
+def create_collection() -> None:
+    try:
+        client.drop_database('qa')
+    except exceptions.MilvusException as e:
+        print(e)
+    client.create_database('qa')
+
+    schema = CollectionSchema(
+        [
+            FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name='article_id', dtype=DataType.INT64, description='Article the passage was cut from'),
+            FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=384, description='Embedding of the text'),
+            # rows of a topic are kept in its own partition, see common.topics
+            FieldSchema(name='topic', dtype=DataType.VARCHAR, max_length=100, description='Topic'),
+            FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=article_max_len, description='Passage')
+        ]
+    )
+    index_params = MilvusClient.prepare_index_params()
+    index_params.add_index(
+        field_name='embedding',
+        metric_type='IP',
+        index_type='IVF_FLAT',
+        index_name='embedding_index',
+        params={'nlist': 128}
+    )
+
+    if client.has_collection(collection_name):
+        client.drop_collection(collection_name)
+
+    client.create_collection(
+        collection_name=collection_name,
+        schema=schema,
+        index_params=index_params,
+    )
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.done: set[int] = set()
+        # sizes of the local files after the batches in `done`, by output
+        self.files: dict[str, dict[str, int]] | None = None
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        settings = (state['dataset'], state['batch_size'], state.get('passages'))
+        if settings != (dataset_path, batch_size, passage_settings):
+            raise ValueError(f'{self.path} was made for another dataset, batch or passage size, set INGEST_RESTART=1')
+        self.done = set(state['done'])
+        self.files = state.get('files')
+        return True
+
+    def mark_done(self, batch: int, files: dict[str, dict[str, int]]) -> None:
+        self.done.add(batch)
+        self.files = files
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            state = {'dataset': dataset_path, 'batch_size': batch_size, 'passages': passage_settings}
+            json.dump({**state, 'done': sorted(self.done), 'files': files}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def with_retries(action, description: str):
+    for attempt in range(max_retries + 1):
+        try:
+            return await action()
+        except (httpx.HTTPError, exceptions.MilvusException) as e:
+            if attempt == max_retries:
+                raise
+            delay = min(2 ** attempt, 30)
+            print(f'{description} failed ({e!r}), retry in {delay} s')
+            await asyncio.sleep(delay)
+
+
+async def encode(http_client: httpx.AsyncClient, articles: list[str]) -> np.ndarray:
+    response = await http_client.post('/encode', json={'items': articles}, headers={'accept': ACCEPT_EMBEDDINGS})
+    response.raise_for_status()
+    return load_embeddings(response.headers.get('content-type'), response.content)
+
+
+# partitions known to exist, a new topic gets its partition on its first insert
+partitions: set[str] = set()
+partitions_lock = threading.Lock()
+
+
+def create_partition(partition: str) -> None:
+    # batches are inserted concurrently, the first one of a topic creates its partition
+    with partitions_lock:
+        if partition not in partitions and not client.has_partition(collection_name, partition):
+            client.create_partition(collection_name, partition)
+        partitions.add(partition)
+
+
+async def insert(rows: list[dict]) -> None:
+    by_partition: dict[str, list[dict]] = {}
+    for row in rows:
+        by_partition.setdefault(partition_name(row['topic']), []).append(row)
+    for partition, partition_rows in by_partition.items():
+        await asyncio.to_thread(create_partition, partition)
+        # a batch inserted before a crash is inserted again on resume, upsert keeps one row per id
+        await asyncio.to_thread(
+            client.upsert, collection_name=collection_name, data=partition_rows, partition_name=partition
+        )
+
+
+def export_local(
+        writer: LocalIndexWriter, ids: list[int], topics: list[str], embeddings: list, passages: list[str]
+) -> None:
+    by_topic: dict[str, list[int]] = {}
+    for i, topic in enumerate(topics):
+        by_topic.setdefault(topic, []).append(i)
+    for topic, rows in by_topic.items():
+        writer.add(
+            topic,
+            ids=[ids[i] for i in rows],
+            embeddings=[embeddings[i] for i in rows],
+            texts=None if article_store_path else [passages[i] for i in rows],
+        )
+
+
+def export_bm25(writer: BM25IndexWriter, ids: list[int], topics: list[str], passages: list[str]) -> None:
+    by_topic: dict[str, list[int]] = {}
+    for i, topic in enumerate(topics):
+        by_topic.setdefault(topic, []).append(i)
+    for topic, rows in by_topic.items():
+        writer.add(
+            topic,
+            ids=[ids[i] for i in rows],
+            texts=[passages[i] for i in rows],
+            keep_texts=not article_store_path,
+        )
+
+
+def local_outputs(
+        writer: LocalIndexWriter | None, store: ArticleStoreWriter | None, bm25: BM25IndexWriter | None
+) -> dict:
+    outputs = {'local_index': writer, 'article_store': store, 'bm25': bm25}
+    return {name: output for name, output in outputs.items() if output is not None}
+
+
+async def process_batch(
+        http_client: httpx.AsyncClient,
+        batch: int,
+        df: pd.DataFrame,
+        checkpoint: Checkpoint,
+        writer: LocalIndexWriter | None,
+        store: ArticleStoreWriter | None,
+        bm25: BM25IndexWriter | None,
+) -> None:
+    # row numbers are used as article ids, so every target and a resumed run use the same ids
+    article_ids, ids, topics, passages = [], [], [], []
+    for i, (article, topic) in enumerate(zip(df['Article'], df['NewsType'])):
+        article_id = batch * batch_size + i
+        for number, passage in enumerate(split_passages(article[:article_max_len], passage_size, passage_overlap)):
+            article_ids.append(article_id)
+            ids.append(passage_id(article_id, number))
+            topics.append(normalize_topic(topic))
+            passages.append(passage)
+    embeddings = await with_retries(lambda: encode(http_client, passages), f'encoding of batch {batch}')
+    if to_milvus:
+        rows = [
+            {'id': i, 'article_id': article_id, 'embedding': embedding, 'topic': topic, 'text': text}
+            for i, article_id, embedding, topic, text in zip(ids, article_ids, embeddings, topics, passages)
+        ]
+        await with_retries(lambda: insert(rows), f'insert of batch {batch}')
+    # the local files are written and checkpointed without an await in between, so the sizes in the checkpoint
+    # cover exactly the batches marked done; a batch cut off by a crash is truncated on resume
+    if store is not None:
+        store.add(ids, passages)
+    if writer is not None:
+        export_local(writer, ids, topics, embeddings, passages)
+    if bm25 is not None:
+        export_bm25(bm25, ids, topics, passages)
+    checkpoint.mark_done(batch, {name: output.sizes() for name, output in local_outputs(writer, store, bm25).items()})
+
+
+async def ingest(
+        checkpoint: Checkpoint,
+        writer: LocalIndexWriter | None,
+        store: ArticleStoreWriter | None,
+        bm25: BM25IndexWriter | None,
+) -> None:
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks: set[asyncio.Task] = set()
+
+    async def run(batch: int, df: pd.DataFrame) -> None:
+        try:
+            await process_batch(http_client, batch, df, checkpoint, writer, store, bm25)
+        finally:
+            in_flight.release()
+            progress.update()
+
+    async with httpx.AsyncClient(base_url=f'http://{llm_host}:{llm_port}', timeout=60) as http_client:
+        reader = pd.read_csv(dataset_path, encoding='cp1252', usecols=['Article', 'NewsType'], chunksize=batch_size)
+        with tqdm(initial=len(checkpoint.done)) as progress:
+            for batch, df in enumerate(reader):
+                if batch in checkpoint.done:
+                    continue
+                # the next chunk is read only when a slot is free, so memory is bounded by the window
+                await in_flight.acquire()
+                for task in [t for t in tasks if t.done()]:
+                    tasks.discard(task)
+                    task.result()
+                tasks.add(asyncio.create_task(run(batch, df)))
+            await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    checkpoint = Checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.remove()
+    resumed = checkpoint.load()
+    if resumed:
+        print(f'Resuming from {checkpoint_path}: {len(checkpoint.done)} batches are already loaded')
+    elif to_milvus:
+        create_collection()
+    writer = LocalIndexWriter(local_index_path, append=resumed) if to_local else None
+    store = ArticleStoreWriter(article_store_path, append=resumed) if article_store_path else None
+    bm25 = BM25IndexWriter(bm25_index_path, append=resumed) if bm25_index_path else None
+    if resumed and checkpoint.files is not None:
+        # rows written after the last checkpoint are written again
+        for name, output in local_outputs(writer, store, bm25).items():
+            output.truncate(checkpoint.files.get(name, {}))
+
+    # partitions are loaded by the application when their topics are searched, see MILVUS_MAX_LOADED_PARTITIONS
+    asyncio.run(ingest(checkpoint, writer, store, bm25))
+    if writer is not None:
+        writer.close()
+    if store is not None:
+        store.close()
+    if bm25 is not None:
+        bm25.close()
+    checkpoint.remove()
+
+    if app_host:
+        # answers cached by the application are based on the old collection
+        try:
+            httpx.post(f'http://{app_host}:{app_port}/cache/invalidate')
+        except httpx.HTTPError as e:
+            print(e)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ milvus_port = os.getenv('MILVUS_PORT') or '19530'
 
 client = MilvusClient(uri=f'http://{milvus_host}:{milvus_port}')
 collection_name = 'articles'
-client.load_collection(collection_name)
+client.load_partitions(collection_name, ['topic_business'])
 
 model = milvus_model.dense.SentenceTransformerEmbeddingFunction(
     model_name='all-MiniLM-L6-v2',
@@ -25,6 +25,6 @@ res = client.search(
     limit=5,
     search_params={'metric_type': 'IP', 'params': {}},
     output_fields=['topic', 'text'],
-    filter=f'topic == "business"',
+    partition_names=['topic_business'],
 )
 print(json.dumps(res, indent=4))
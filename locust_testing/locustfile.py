@@ -1,20 +1,35 @@
+import os
 import random
+import time
 
 from locust import HttpUser, TaskSet, task, between
 
+from benchmarks.workload import load_jsonl_questions, make_requests, synthetic_questions
+
+# a JSONL file with questions, see benchmarks/workload.py
+if os.getenv('LOCUST_QUESTIONS'):
+    QUESTIONS = load_jsonl_questions(os.environ['LOCUST_QUESTIONS'])
+else:
+    QUESTIONS = synthetic_questions(1000, seed=0)
+BATCH_SIZES = [1, 2, 5, 10]
+
 
 class UserBehavior(TaskSet):
     @task(1)
     def ask_questions(self):
-        questions = [
-            {"question": f"Test question {i}", "topic": random.choice(["sports", "business"])}
-            for i in range(5)
-        ]
-        payload = {"questions": questions}
+        payload = make_requests(QUESTIONS, 1, BATCH_SIZES, 0.5, 'batch', seed=random.getrandbits(32))[0]
+        started = time.perf_counter()
         with self.client.post("/ask", json=payload, stream=True, catch_response=True) as response:
             if response.status_code == 200:
-                for chunk in response.iter_content():
-                    pass
+                first = True
+                for _ in response.iter_content(chunk_size=None):
+                    if first:
+                        # time to the first event, reported as a separate entry
+                        self.user.environment.events.request.fire(
+                            request_type='SSE', name='/ask first event', response_length=0, exception=None,
+                            response_time=(time.perf_counter() - started) * 1000, context={},
+                        )
+                        first = False
 
 
 class WebsiteUser(HttpUser):